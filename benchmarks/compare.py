@@ -0,0 +1,71 @@
+"""
+Compares two micro-benchmark result files and flags the regressions.
+
+    python -m benchmarks.compare baseline.json results.json [--threshold 0.1]
+
+Exits with status 1 if a case is slower (median time) or uses more peak memory than
+the baseline by more than the threshold.
+"""
+import argparse
+import json
+import sys
+from typing import List, Tuple
+
+METRICS = (('median', 'time'), ('peak_memory', 'memory'))
+
+
+def compare(baseline: dict, current: dict, threshold: float, memory_threshold: float) -> List[Tuple]:
+    """
+    @return: (case, metric, baseline value, current value, relative change, regression) for
+    each case present in both result sets
+    """
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        for key, metric in METRICS:
+            if not base.get(key):
+                continue
+            change = (result[key] - base[key]) / base[key]
+            limit = threshold if metric == 'time' else memory_threshold
+            rows.append((name, metric, base[key], result[key], change, change > limit))
+    return rows
+
+
+def format_value(metric: str, value: float) -> str:
+    if metric == 'time':
+        return f'{value * 1000:.2f} ms'
+    return f'{value / 2**20:.2f} MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare micro-benchmark results against a baseline')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative time increase')
+    parser.add_argument('--memory-threshold', type=float, default=0.1, help='allowed relative memory increase')
+    args = parser.parse_args()
+
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+    with open(args.current) as fp:
+        current = json.load(fp)
+
+    rows = compare(baseline, current, args.threshold, args.memory_threshold)
+    for name, metric, base, value, change, regression in rows:
+        flag = 'REGRESSION' if regression else ''
+        print(f'{name:<36} {metric:<7} {format_value(metric, base):>12} -> '
+              f'{format_value(metric, value):>12} {change:+8.1%} {flag}')
+
+    missing = set(baseline['results']) - set(current['results'])
+    for name in sorted(missing):
+        print(f'{name:<36} missing from {args.current}')
+
+    regressions = [row for row in rows if row[-1]]
+    print(f'{len(regressions)} regression(s) in {len(rows)} comparisons')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+In-process stand-in for the AMQP broker: requests are queued with their publish time and
+delivered to main.callback through a fake channel, status messages sent by the service
+through PikaClient are recorded. Requests the service republishes (retries) are queued
+again with their headers.
+"""
+import json
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+# first word of the routing keys of the requests consumed by the service
+REQUEST_KINDS = ('request', 'derive')
+
+
+@dataclass
+class Delivery:
+    routing_key: str
+    body: bytes
+    user_id: str = 'bench'
+    delivery_tag: int = 0
+    published_at: float = field(default_factory=time.monotonic)
+    # AMQP timestamp set by the publisher
+    timestamp: float = field(default_factory=time.time)
+    redelivered: bool = False
+    headers: dict = None
+
+
+@dataclass
+class Method:
+    routing_key: str
+    delivery_tag: int
+    redelivered: bool = False
+
+
+@dataclass
+class Properties:
+    user_id: str
+    message_id: str = None
+    headers: dict = None
+    timestamp: int = None
+
+
+@dataclass
+class StatusMessage:
+    exchange: str
+    routing_key: str
+    message: dict
+    sent_at: float
+
+
+class FakeBroker:
+    """
+    Request queue and status exchange of the service
+    """
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.status: List[StatusMessage] = []
+        self.acked = 0
+        self.nacked = 0
+        self._tags = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def publish_request(self, routing_key: str, body: bytes, user_id: str = 'bench', headers: dict = None,
+                        redelivered: bool = False):
+        with self._lock:
+            self._tags += 1
+            delivery = Delivery(routing_key, body, user_id, self._tags, redelivered=redelivered, headers=headers)
+        self.requests.put(delivery)
+        return delivery
+
+    def deliver(self, delivery: Delivery, callback):
+        """
+        Delivers a request to a pika-style consumer callback
+        """
+        with self._lock:
+            self._pending[delivery.delivery_tag] = delivery
+        channel = FakeChannel(self)
+        method = Method(delivery.routing_key, delivery.delivery_tag, delivery.redelivered)
+        properties = Properties(delivery.user_id, headers=delivery.headers, timestamp=delivery.timestamp)
+        callback(channel, method, properties, delivery.body)
+
+    def ack(self, delivery_tag: int):
+        with self._lock:
+            self._pending.pop(delivery_tag, None)
+            self.acked += 1
+
+    def nack(self, delivery_tag: int, requeue: bool):
+        with self._lock:
+            delivery = self._pending.pop(delivery_tag, None)
+            self.nacked += 1
+        if requeue and delivery is not None:
+            delivery.redelivered = True
+            self.requests.put(delivery)
+
+    def record_status(self, exchange: str, routing_key: str, message: str):
+        with self._lock:
+            self.status.append(StatusMessage(exchange, routing_key, json.loads(message), time.monotonic()))
+
+    def status_for(self, routing_key: str) -> List[StatusMessage]:
+        with self._lock:
+            return [status for status in self.status if status.routing_key == routing_key]
+
+
+class FakeConnection:
+    def call_later(self, delay: float, callback):
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+class FakeChannel:
+    def __init__(self, broker: FakeBroker):
+        self.broker = broker
+        self.connection = FakeConnection()
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        self.broker.ack(delivery_tag)
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True):
+        self.broker.nack(delivery_tag, requeue)
+
+
+def fake_pika_client(broker: FakeBroker):
+    """
+    Returns a PikaClient replacement publishing on the fake broker, to be patched in
+    framework.pika_client and in the modules importing PikaClient
+    """
+    class FakePikaClient:
+        def __init__(self, exchange=None):
+            self.exchange = exchange
+
+        def write_message(self, routing_key, message, properties=None):
+            if self.exchange is None and routing_key.split('.', 1)[0] in REQUEST_KINDS:
+                # a retry republished on the service exchange
+                body = message.encode() if isinstance(message, str) else message
+                headers = properties.headers if properties is not None else None
+                broker.publish_request(routing_key, body, headers=headers, redelivered=True)
+                return
+            broker.record_status(self.exchange, routing_key, message)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exception_type, exception_value, exception_traceback):
+            pass
+
+    return FakePikaClient
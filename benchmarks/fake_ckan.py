@@ -0,0 +1,82 @@
+"""
+Local HTTP stand-in for the datalake (CKAN action API) and the OAuth login endpoint,
+answering like the production services with a configurable latency.
+"""
+import json
+import re
+import threading
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+
+class FakeCkanHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        server: FakeCkanServer = self.server
+        action = self.path.rstrip('/').rsplit('/', 1)[-1]
+        server.calls[action] += 1
+        server.bytes_received += length
+        sleep(server.latency)
+
+        if self.path == '/api/login':
+            self.send_json({'token': uuid.uuid4().hex, 'refreshToken': uuid.uuid4().hex})
+        elif action in ('package_create', 'package_patch'):
+            package = json.loads(body or b'{}')
+            package.setdefault('id', uuid.uuid4().hex)
+            for resource in package.get('resources', []):
+                resource.setdefault('id', uuid.uuid4().hex)
+                resource['package_id'] = package['id']
+            self.send_json({'success': True, 'result': package})
+        elif action in ('resource_create', 'resource_patch'):
+            # the id of a patched resource is a field of the multipart form
+            match = re.search(rb'name="id"\r\n\r\n([^\r]+)', body)
+            resource_id = match.group(1).decode() if match else uuid.uuid4().hex
+            self.send_json({'success': True, 'result': {
+                'id': resource_id,
+                'url': f'http://{self.headers.get("Host")}/dataset/resource/{resource_id}',
+            }})
+        elif action in ('package_delete', 'resource_delete'):
+            self.send_json({'success': True, 'result': None})
+        else:
+            self.send_json({'success': False, 'error': {'message': f'unknown action {action}'}}, status=404)
+
+
+class FakeCkanServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server on localhost (port 0 picks a free port), counting the calls per action
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0):
+        super().__init__(('127.0.0.1', port), FakeCkanHandler)
+        self.latency = latency
+        self.calls = Counter()
+        self.bytes_received = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
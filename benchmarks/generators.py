@@ -0,0 +1,123 @@
+"""
+Synthetic inputs for the micro-benchmarks: isochrones, rasters, requests and
+PROPAGATOR action strings of increasing size, deterministic for a given seed.
+"""
+import json
+import math
+
+import numpy as np
+import rasterio as rio
+from rasterio.transform import from_origin
+
+CENTER = (9.22, 42.44)
+PROBABILITIES = (0.5, 0.75, 0.9)
+
+
+def ring(n_vertices: int, radius: float, center=CENTER, seed: int = 0) -> np.ndarray:
+    """
+    Returns a closed, irregular ring of lon, lat coordinates
+    """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * math.pi, n_vertices, endpoint=False)
+    radii = radius * (1 + 0.1 * rng.standard_normal(n_vertices).clip(-3, 3))
+    coords = np.column_stack([
+        center[0] + radii * np.cos(angles),
+        center[1] + radii * np.sin(angles),
+    ])
+    return np.vstack([coords, coords[:1]])
+
+
+def isochrones(n_vertices: int, n_times: int = 4, radius: float = 0.05) -> dict:
+    """
+    Isochrones FeatureCollection as written by PROPAGATOR: one MultiLineString of rings
+    per probability and time, n_vertices vertices in total per feature
+    """
+    features = []
+    for t in range(1, n_times + 1):
+        for value in PROBABILITIES:
+            r = radius * t / n_times * (1.5 - value)
+            features.append({
+                'type': 'Feature',
+                'properties': {'value': value, 'time': t * 60},
+                'geometry': {
+                    'type': 'MultiLineString',
+                    'coordinates': [ring(n_vertices, r, seed=t).tolist()],
+                },
+            })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def write_isochrones(path: str, n_vertices: int, n_times: int = 4) -> str:
+    with open(path, 'w') as fp:
+        json.dump(isochrones(n_vertices, n_times), fp)
+    return path
+
+
+def write_raster(path: str, size: int, cell_size: float = None, seed: int = 0) -> str:
+    """
+    Writes a float32 raster of size x size cells covering the isochrones
+    """
+    cell_size = cell_size or 0.12 / size
+    half = size * cell_size / 2
+    rng = np.random.default_rng(seed)
+    profile = dict(
+        driver='GTiff', width=size, height=size, count=1, dtype='float32', crs='EPSG:4326',
+        transform=from_origin(CENTER[0] - half, CENTER[1] + half, cell_size, cell_size), nodata=-9999,
+    )
+    with rio.open(path, 'w', **profile) as dst:
+        dst.write((rng.random((size, size)) * 10).astype('float32'), 1)
+    return path
+
+
+def wkt_polygon(n_vertices: int, radius: float, seed: int = 0) -> str:
+    coords = ring(n_vertices, radius, seed=seed)
+    return 'POLYGON ((' + ', '.join(f'{x} {y}' for x, y in coords) + '))'
+
+
+def wkt_line(n_vertices: int, length: float, seed: int = 0) -> str:
+    rng = np.random.default_rng(seed)
+    x = CENTER[0] + np.linspace(-length / 2, length / 2, n_vertices)
+    y = CENTER[1] + 0.01 + np.cumsum(rng.standard_normal(n_vertices)) * length / n_vertices
+    return 'LINESTRING (' + ', '.join(f'{a} {b}' for a, b in zip(x, y)) + ')'
+
+
+def request_body(n_vertices: int, n_actions: int = 2) -> bytes:
+    """
+    Request message with an ignition polygon and firebreak actions of n_vertices vertices each
+    """
+    boundary_conditions = [
+        {
+            'time': 60 * i, 'w_dir': 90, 'w_speed': 10, 'moisture': 5,
+            'fireBreak': {
+                'waterLine': wkt_line(n_vertices, 0.05, seed=i),
+                'canadair': wkt_polygon(n_vertices, 0.005, seed=i),
+            },
+        }
+        for i in range(n_actions)
+    ]
+    return json.dumps({
+        'title': 'benchmark',
+        'description': 'benchmark',
+        'start': '2023-07-20T12:00:00.000Z',
+        'end': '2023-07-20T18:00:00.000Z',
+        'probabilityRange': 0.75,
+        'do_spotting': False,
+        'datatype_id': '35006',
+        'geometry': {'type': 'Polygon', 'coordinates': [ring(n_vertices, 0.002).tolist()]},
+        'boundary_conditions': boundary_conditions,
+    }).encode()
+
+
+def action_strings(n_vertices: int, n_actions: int = 10) -> str:
+    """
+    Newline separated PROPAGATOR strings (polygons, lines and points) as read_actions receives them
+    """
+    strings = []
+    for i in range(n_actions):
+        coords = ring(n_vertices, 0.01, seed=i)
+        lats = ' '.join(map(str, coords[:, 1]))
+        lons = ' '.join(map(str, coords[:, 0]))
+        strings.append(f'POLYGON: [{lats}];[{lons}]')
+        strings.append(f'LINE: [{lats}];[{lons}]')
+        strings.append(f'POINT:{coords[0, 1]};{coords[0, 0]}')
+    return '\n'.join(strings)
@@ -0,0 +1,75 @@
+"""
+Profiles the import of the service entry point and checks its startup budget.
+
+    python -m benchmarks.import_time [--module main] [--budget 1.0] [--top 15]
+
+Runs `python -X importtime` in a fresh interpreter and exits with status 1 if the import
+takes longer than the budget or pulls in a module that must only be loaded lazily (the
+geopandas/rasterio stack, loaded when a run is post-processed).
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+LAZY_MODULES = ('geopandas', 'pandas', 'rasterio', 'fiona', 'pyogrio')
+
+
+def profile_import(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    @return: self and cumulative import time in microseconds of each imported module
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr}')
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_time), int(cumulative))
+    return times
+
+
+def check(times: Dict[str, Tuple[int, int]], module: str, budget: float) -> List[str]:
+    """
+    @return: the violations of the startup budget
+    """
+    errors = []
+    total = times[module][1] / 1e6
+    if total > budget:
+        errors.append(f'import {module} took {total:.3f} s, budget {budget:.3f} s')
+    for name in LAZY_MODULES:
+        if name in times:
+            errors.append(f'{name} is imported at startup')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main', help='module to import')
+    parser.add_argument('--budget', type=float, default=1.0, help='maximum import time in seconds')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest imports to print')
+    args = parser.parse_args()
+
+    times = profile_import(args.module)
+    print(f'import {args.module}: {times[args.module][1] / 1e6:.3f} s, {len(times)} modules')
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for name, (self_time, cumulative) in sorted(times.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f'{cumulative / 1000:>9.1f} ms {self_time / 1000:>7.1f} ms  {name}')
+
+    errors = check(times, args.module, args.budget)
+    for error in errors:
+        print(f'FAIL: {error}')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
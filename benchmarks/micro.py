@@ -0,0 +1,157 @@
+"""
+Micro-benchmarks of the geo post-processing hot paths.
+
+Times and memory-profiles extract_isochrones, mask_on_cutoff, parse_request_body,
+read_actions, footprint (each method) and write_vector_tiles (if mapbox_vector_tile is
+installed) on synthetic inputs of increasing size, and stores the results as json
+(compare two result files with benchmarks.compare).
+
+    python -m benchmarks.micro --output results.json [--quick] [--filter mask]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks import generators
+
+# (label, isochrone vertices, raster size, request vertices)
+SIZES = [
+    ('small', 1_000, 256, 100),
+    ('medium', 10_000, 1024, 1_000),
+    ('large', 100_000, 2048, 10_000),
+]
+
+
+def configure_environment(work_dir: str):
+    """
+    Minimal service settings, must run before importing the service modules
+    """
+    for name in ('RMQ_HOSTNAME', 'RMQ_PORT', 'RMQ_VHOST', 'RMQ_EXCHANGE', 'RMQ_USERNAME',
+                 'RMQ_PASSWORD', 'RMQ_QUEUE', 'PYTHON_PATH', 'PROPAGATOR_DIR'):
+        os.environ.setdefault(name, 'bench')
+    os.environ['WORK_DIR'] = work_dir
+
+
+def measure(function: Callable, setup: Callable, repeat: int) -> dict:
+    """
+    Times function(*setup()) repeat times, then measures its peak traced memory once
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+        'repeat': repeat,
+        'peak_memory': peak,
+    }
+
+
+def build_cases(tmp_dir: str, sizes) -> List[Tuple[str, Callable, Callable]]:
+    """
+    Returns (name, function, setup) for each benchmark case, setup returns the function arguments
+    """
+    from propagator.footprint import FOOTPRINT_METHODS, footprint
+    from propagator.run_handler import PropagatorRunHandler
+    from propagator.utils import mask_on_cutoff, parse_request_body, read_actions
+
+    cases = []
+    for label, n_vertices, raster_size, request_vertices in sizes:
+        run_dir = os.path.join(tmp_dir, label)
+        handler = PropagatorRunHandler('bench', label, {'probabilityRange': 0.75}, datatype_id=35006)
+        os.makedirs(handler.output_dir, exist_ok=True)
+
+        isochrone_file = generators.write_isochrones(
+            os.path.join(handler.output_dir, f'isochrone_{label}.geojson'), n_vertices)
+        isochrones_gdf, _ = handler.extract_isochrones(isochrone_file)
+        raster_file = generators.write_raster(os.path.join(run_dir + '_RoS_mean.tiff'), raster_size)
+        body = generators.request_body(request_vertices)
+        actions = generators.action_strings(request_vertices)
+
+        cases += [
+            (f'extract_isochrones[{label}]', handler.extract_isochrones, lambda f=isochrone_file: (f,)),
+            (f'mask_on_cutoff[{label}]', mask_on_cutoff,
+             lambda f=raster_file, g=isochrones_gdf: (f, g, 0.75)),
+            (f'parse_request_body[{label}]', parse_request_body, lambda b=body: (b,)),
+            (f'read_actions[{label}]', read_actions, lambda a=actions: (a,)),
+        ]
+        cases += [
+            (f'footprint_{method}[{label}]', footprint,
+             lambda g=isochrones_gdf, m=method: (g.geometry.to_numpy(), m, 64))
+            for method in FOOTPRINT_METHODS
+        ]
+        if importlib.util.find_spec('mapbox_vector_tile') is not None:
+            cases.append((f'write_vector_tiles[{label}]', handler.write_vector_tiles, lambda g=isochrones_gdf: (g,)))
+    return cases
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def run(args) -> dict:
+    sizes = SIZES[:2] if args.quick else SIZES
+    results: Dict[str, dict] = {}
+
+    with tempfile.TemporaryDirectory(prefix='propagator_micro_') as tmp_dir:
+        configure_environment(os.path.join(tmp_dir, 'work'))
+        for name, function, setup in build_cases(tmp_dir, sizes):
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(function, setup, args.repeat)
+            print(f"{name:<36} median {results[name]['median'] * 1000:10.2f} ms  "
+                  f"peak {results[name]['peak_memory'] / 2**20:8.2f} MB", flush=True)
+
+    return {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the geo post-processing')
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case')
+    parser.add_argument('--quick', action='store_true', help='skip the large inputs')
+    parser.add_argument('--filter', help='only run the cases whose name contains this string')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
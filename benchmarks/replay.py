@@ -0,0 +1,253 @@
+"""
+Replay and load-test harness.
+
+Replays recorded requests (the message.json files of WORK_DIR) through main.callback at
+a configurable rate, with an in-process broker in place of RabbitMQ, a local stand-in
+for CKAN and the OAuth login, and a stub PROPAGATOR writing realistic outputs. Reports
+queue latency, end-to-end latency percentiles and throughput.
+
+    python -m benchmarks.replay --messages './work/*/message.json' --count 20 --rate 2 --workers 2
+
+The service configuration is taken from the environment, except the settings pointing
+to external systems (bus, datalake, OAuth, PROPAGATOR, WORK_DIR) which are overridden.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.fake_broker import FakeBroker, fake_pika_client
+from benchmarks.fake_ckan import FakeCkanServer
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_MESSAGES = os.path.join(BENCHMARKS_DIR, 'messages', '*.json')
+
+PERCENTILES = (50, 90, 99)
+
+
+@dataclass
+class RunRecord:
+    run_id: str
+    routing_key: str
+    published_at: float
+    started_at: float = None
+    ended_at: float = None
+    status_code: int = None
+    redeliveries: int = 0
+
+
+@dataclass
+class ReplayReport:
+    requests: int
+    completed: int
+    failed: int
+    duration: float
+    throughput: float
+    queue_latency: dict = field(default_factory=dict)
+    end_to_end_latency: dict = field(default_factory=dict)
+    redeliveries: int = 0
+    ckan_calls: dict = field(default_factory=dict)
+    status_messages: int = 0
+
+
+def latency_stats(values: List[float]) -> dict:
+    if not values:
+        return {}
+    stats = {f'p{p}': float(np.percentile(values, p)) for p in PERCENTILES}
+    stats['mean'] = float(np.mean(values))
+    stats['max'] = float(np.max(values))
+    return stats
+
+
+def configure_environment(work_dir: str, propagator_dir: str, ckan_url: str, args):
+    """
+    Points the service settings to the local stand-ins, must run before importing the service modules
+    """
+    os.environ.update({
+        'RMQ_HOSTNAME': 'localhost', 'RMQ_PORT': '5672', 'RMQ_VHOST': 'bench',
+        'RMQ_EXCHANGE': 'bench', 'RMQ_USERNAME': 'bench', 'RMQ_PASSWORD': 'bench',
+        'RMQ_QUEUE': 'bench',
+        'CKAN_URL': ckan_url, 'OAUTH_URL': ckan_url,
+        'OAUTH_API_KEY': 'bench', 'OAUTH_APP_ID': 'bench', 'OAUTH_USER': 'bench', 'OAUTH_PWD': 'bench',
+        'PYTHON_PATH': sys.executable,
+        'PROPAGATOR_DIR': propagator_dir,
+        'WORK_DIR': work_dir,
+        'STUB_PROPAGATOR_STEPS': str(args.steps),
+        'STUB_PROPAGATOR_DELAY': str(args.delay),
+        'STUB_PROPAGATOR_SIZE': str(args.size),
+    })
+
+
+def load_messages(pattern: str) -> List[bytes]:
+    files = sorted(glob.glob(pattern))
+    if not files:
+        logging.warning(f'No recorded messages match {pattern}, using the sample requests')
+        files = sorted(glob.glob(SAMPLE_MESSAGES))
+
+    messages = []
+    for message_file in files:
+        with open(message_file, 'rb') as fp:
+            messages.append(fp.read())
+    return messages
+
+
+def publisher(broker: FakeBroker, messages: List[bytes], records: Dict[str, RunRecord], count: int, rate: float):
+    """
+    Publishes count requests (cycling on the recorded messages) at rate requests per second
+    @param records: filled with the run records, by request routing key
+    """
+    start = time.monotonic()
+    for index in range(count):
+        if rate > 0:
+            time.sleep(max(start + index / rate - time.monotonic(), 0))
+
+        body = messages[index % len(messages)]
+        datatype = json.loads(body).get('datatype_id', '35006')
+        run_id = f'bench{index}'
+        routing_key = f'request.{datatype}.{run_id}'
+        record = records[routing_key] = RunRecord(run_id, f'status.propagator.{datatype}.{run_id}', time.monotonic())
+        record.published_at = broker.publish_request(routing_key, body).published_at
+
+
+def consumer(broker: FakeBroker, callback, records_by_key: dict, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            delivery = broker.requests.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+        record = records_by_key[delivery.routing_key]
+        if delivery.redelivered:
+            record.redeliveries += 1
+        if record.started_at is None:
+            record.started_at = time.monotonic()
+
+        try:
+            broker.deliver(delivery, callback)
+        except Exception:
+            logging.exception(f'Error handling {delivery.routing_key}')
+        finally:
+            broker.requests.task_done()
+
+
+def finalize(broker: FakeBroker, records: List[RunRecord]):
+    """
+    Takes the end of each run from its last 'end' status message
+    """
+    for record in records:
+        ends = [status for status in broker.status_for(record.routing_key) if status.message.get('type') == 'end']
+        if ends:
+            record.ended_at = ends[-1].sent_at
+            record.status_code = ends[-1].message.get('status_code')
+
+
+def replay(args) -> ReplayReport:
+    tmp_dir = tempfile.mkdtemp(prefix='propagator_bench_')
+    work_dir = os.path.join(tmp_dir, 'work')
+    propagator_dir = os.path.join(tmp_dir, 'propagator')
+    os.makedirs(work_dir)
+    os.makedirs(propagator_dir)
+    shutil.copy(os.path.join(BENCHMARKS_DIR, 'stub_propagator.py'), os.path.join(propagator_dir, 'main.py'))
+
+    messages = load_messages(args.messages)
+    ckan = FakeCkanServer(latency=args.ckan_latency).start()
+    configure_environment(work_dir, propagator_dir, ckan.url, args)
+
+    # service modules read their configuration at import time
+    import framework.pika_client
+    import main
+    import propagator.run_handler
+
+    broker = FakeBroker()
+    # the retry queue imports PikaClient from framework.pika_client when publishing
+    framework.pika_client.PikaClient = propagator.run_handler.PikaClient = fake_pika_client(broker)
+
+    records_by_key: Dict[str, RunRecord] = {}
+    publisher_thread = threading.Thread(
+        target=publisher, args=(broker, messages, records_by_key, args.count, args.rate))
+    start = time.monotonic()
+    publisher_thread.start()
+
+    stop = threading.Event()
+    workers = [
+        threading.Thread(target=consumer, args=(broker, main.callback, records_by_key, stop), daemon=True)
+        for _ in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    publisher_thread.join()
+    broker.requests.join()
+    stop.set()
+    for worker in workers:
+        worker.join()
+    duration = time.monotonic() - start
+
+    records = list(records_by_key.values())
+    finalize(broker, records)
+    ckan.stop()
+    if not args.keep:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    completed = [r for r in records if r.status_code == 200]
+    return ReplayReport(
+        requests=len(records),
+        completed=len(completed),
+        failed=len(records) - len(completed),
+        duration=duration,
+        throughput=len(completed) / duration if duration > 0 else 0,
+        queue_latency=latency_stats([r.started_at - r.published_at for r in records if r.started_at]),
+        end_to_end_latency=latency_stats([r.ended_at - r.published_at for r in completed]),
+        redeliveries=sum(r.redeliveries for r in records),
+        ckan_calls=dict(ckan.calls),
+        status_messages=len(broker.status),
+    )
+
+
+def print_report(report: ReplayReport):
+    print(f'requests: {report.requests}  completed: {report.completed}  failed: {report.failed}  '
+          f'redeliveries: {report.redeliveries}')
+    print(f'duration: {report.duration:.2f} s  throughput: {report.throughput:.3f} runs/s')
+    for name, stats in (('queue latency', report.queue_latency), ('end-to-end latency', report.end_to_end_latency)):
+        if stats:
+            print(f'{name:>20}: ' + '  '.join(f'{k} {v:.3f} s' for k, v in stats.items()))
+    print(f'CKAN calls: {report.ckan_calls}  status messages: {report.status_messages}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded requests through the service')
+    parser.add_argument('--messages', default=os.path.join(os.getenv('WORK_DIR', './work'), '*', 'message.json'),
+                        help='glob of the recorded message.json files')
+    parser.add_argument('--count', type=int, default=10, help='number of requests to publish')
+    parser.add_argument('--rate', type=float, default=1, help='requests per second, 0 publishes all at once')
+    parser.add_argument('--workers', type=int, default=1, help='concurrent consumers')
+    parser.add_argument('--steps', type=int, default=4, help='timesteps written by the stub PROPAGATOR')
+    parser.add_argument('--delay', type=float, default=0.5, help='seconds per stub PROPAGATOR timestep')
+    parser.add_argument('--size', type=int, default=500, help='stub raster size in cells')
+    parser.add_argument('--ckan-latency', type=float, default=0.05, help='seconds added to each CKAN call')
+    parser.add_argument('--output', help='write the report as json to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary WORK_DIR')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+    report = replay(args)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(asdict(report), fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Stub PROPAGATOR main.py for the benchmarks.
+
+Accepts the PROPAGATOR command line (-id, -f, -of, -tl) and writes, for each timestep,
+the outputs the service post-processes: isochrones (MultiLineString rings with a
+'value' per probability) and the RoS / fireline intensity rasters, around the first
+ignition of the parameter file. Must not import anything from this repository.
+
+Environment:
+    STUB_PROPAGATOR_STEPS   number of timesteps (default 4)
+    STUB_PROPAGATOR_DELAY   seconds per timestep (default 0.5)
+    STUB_PROPAGATOR_SIZE    raster size in cells (default 500)
+    STUB_PROPAGATOR_EXIT    exit code of the run (default 0)
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import rasterio as rio
+from rasterio.transform import from_origin
+
+RASTERS = ('RoS_mean', 'RoS_max', 'fireline_intensity_max', 'fireline_intensity_mean')
+PROBABILITIES = (0.5, 0.75, 0.9)
+CELL_SIZE = 0.0002
+
+
+def ignition_center(params: dict):
+    """
+    Returns lon, lat of the first ignition (propagator strings are lat;lon)
+    """
+    for ignition in params.get('ignitions', []):
+        lats, lons = ignition.split(':', 1)[1].split(';')[:2]
+        lats = [float(v) for v in re.findall(r'-?\d+\.?\d*', lats)]
+        lons = [float(v) for v in re.findall(r'-?\d+\.?\d*', lons)]
+        if lats and lons:
+            return float(np.mean(lons)), float(np.mean(lats))
+    return 9.2, 42.4
+
+
+def isochrones(lon: float, lat: float, step: int, minutes: int) -> dict:
+    features = []
+    for value in PROBABILITIES:
+        radius = CELL_SIZE * 10 * step * (1.5 - value)
+        ring = [
+            [lon - radius, lat - radius], [lon + radius, lat - radius],
+            [lon + radius, lat + radius], [lon - radius, lat + radius],
+            [lon - radius, lat - radius],
+        ]
+        features.append({
+            'type': 'Feature',
+            'properties': {'value': value, 'time': minutes},
+            'geometry': {'type': 'MultiLineString', 'coordinates': [ring]},
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-id')
+    parser.add_argument('-f')
+    parser.add_argument('-of')
+    parser.add_argument('-tl')
+    args = parser.parse_args()
+
+    steps = int(os.getenv('STUB_PROPAGATOR_STEPS', '4'))
+    delay = float(os.getenv('STUB_PROPAGATOR_DELAY', '0.5'))
+    size = int(os.getenv('STUB_PROPAGATOR_SIZE', '500'))
+    exit_code = int(os.getenv('STUB_PROPAGATOR_EXIT', '0'))
+
+    with open(args.f) as fp:
+        params = json.load(fp)
+    lon, lat = ignition_center(params)
+    time_limit = params.get('time_limit', 60)
+
+    half = size * CELL_SIZE / 2
+    profile = dict(
+        driver='GTiff', width=size, height=size, count=1, dtype='float32', crs='EPSG:4326',
+        transform=from_origin(lon - half, lat + half, CELL_SIZE, CELL_SIZE), nodata=-9999,
+    )
+    rows, cols = np.mgrid[0:size, 0:size]
+    distance = np.hypot(rows - size / 2, cols - size / 2)
+    rng = np.random.default_rng(0)
+
+    print(f'Starting simulation {args.id}', flush=True)
+    for step in range(1, steps + 1):
+        time.sleep(delay)
+        minutes = time_limit * step // steps
+        burned = distance < size / 2 * step / steps
+
+        for name in RASTERS:
+            values = np.where(burned, rng.random((size, size)) * 10 * step, 0).astype('float32')
+            with rio.open(os.path.join(args.of, f'{name}_{minutes}.tiff'), 'w', **profile) as dst:
+                dst.write(values, 1)
+
+        with open(os.path.join(args.of, f'isochrone_{minutes}.geojson'), 'w') as fp:
+            json.dump(isochrones(lon, lat, step, minutes), fp)
+
+        print(f'time: {minutes}', flush=True)
+
+    if exit_code:
+        print('Stub simulation error', file=sys.stderr)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
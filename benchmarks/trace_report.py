@@ -0,0 +1,68 @@
+"""
+Per-span latency breakdown of the traces exported to a file (TRACING_EXPORTER=file).
+
+    python -m benchmarks.trace_report traces.jsonl [--run-id <run_id>]
+"""
+import argparse
+import json
+from collections import defaultdict
+
+import numpy as np
+
+
+def load_spans(trace_file: str, run_id: str = None):
+    spans = []
+    with open(trace_file) as fp:
+        for line in fp:
+            entry = json.loads(line)
+            if run_id is None or entry['attributes'].get('run_id') == run_id:
+                spans.append(entry)
+    return spans
+
+
+def breakdown(spans) -> dict:
+    """
+    @return: span name -> count, mean, p50, p90, p99 and max duration in ms, error count
+    """
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    for entry in spans:
+        durations[entry['name']].append(entry['duration_ms'])
+        if entry['status'] == 'ERROR':
+            errors[entry['name']] += 1
+
+    report = {}
+    for name, values in durations.items():
+        report[name] = {
+            'count': len(values),
+            'mean': float(np.mean(values)),
+            'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(np.max(values)),
+            'errors': errors[name],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-span latency breakdown of exported traces')
+    parser.add_argument('trace_file')
+    parser.add_argument('--run-id', help='only the spans of this run')
+    args = parser.parse_args()
+
+    spans = load_spans(args.trace_file, args.run_id)
+    queue_latencies = [s['attributes']['queue_latency_ms'] for s in spans if 'queue_latency_ms' in s['attributes']]
+
+    print(f"{'span':<24}{'count':>7}{'mean':>11}{'p50':>11}{'p90':>11}{'p99':>11}{'max':>11}{'errors':>8}")
+    for name, stats in sorted(breakdown(spans).items(), key=lambda item: -item[1]['mean'] * item[1]['count']):
+        print(f"{name:<24}{stats['count']:>7}" + ''.join(f'{stats[k]:>9.1f}ms' for k in ('mean', 'p50', 'p90', 'p99', 'max'))
+              + f"{stats['errors']:>8}")
+    if queue_latencies:
+        print(f"{'queue latency':<24}{len(queue_latencies):>7}{np.mean(queue_latencies):>9.1f}ms"
+              f"{np.percentile(queue_latencies, 50):>9.1f}ms{np.percentile(queue_latencies, 90):>9.1f}ms"
+              f"{np.percentile(queue_latencies, 99):>9.1f}ms{np.max(queue_latencies):>9.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
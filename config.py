@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=".env")
 
@@ -29,3 +30,232 @@ class PropagatorConfig:
     PYTHON_PATH = trygetenv('PYTHON_PATH')
     PROPAGATOR_DIR = trygetenv('PROPAGATOR_DIR')
     WORK_DIR = trygetenv('WORK_DIR')
+    # number of simulations a service instance runs at the same time
+    MAX_CONCURRENT_RUNS = int(os.getenv('MAX_CONCURRENT_RUNS', '1'))
+
+class RasterOutputConfig:
+    """
+    Creation options for the rasters written by the service (Cloud-Optimized GeoTIFF layout).
+    """
+    COMPRESS = os.getenv('RASTER_COMPRESS', 'DEFLATE')
+    COMPRESS_LEVEL = int(os.getenv('RASTER_COMPRESS_LEVEL', '6'))
+    BLOCKSIZE = int(os.getenv('RASTER_BLOCKSIZE', '512'))
+    NODATA = float(os.getenv('RASTER_NODATA', '-9999'))
+    OVERVIEW_RESAMPLING = os.getenv('RASTER_OVERVIEW_RESAMPLING', 'nearest')
+    OVERVIEW_MIN_SIZE = int(os.getenv('RASTER_OVERVIEW_MIN_SIZE', '256'))
+
+class GeometryConfig:
+    """
+    Preprocessing of the request geometries.
+    SIMPLIFY_TOLERANCE (metres) simplifies ignitions and actions before they are passed to PROPAGATOR;
+    0 disables it, or defaults to half the model resolution when SNAP_TO_GRID is enabled.
+    """
+    SIMPLIFY_TOLERANCE = float(os.getenv('GEOMETRY_SIMPLIFY_TOLERANCE', '0'))
+    # snap, deduplicate, merge and simplify ignitions and actions on the model grid
+    SNAP_TO_GRID = os.getenv('GEOMETRY_SNAP_TO_GRID', 'false').lower() in ('1', 'true', 'yes')
+    # resolution of the model grid in metres
+    RESOLUTION = float(os.getenv('GEOMETRY_RESOLUTION', '20'))
+
+class ValidationConfig:
+    """
+    Bounds used to reject requests before the simulation is started.
+    Time limits are in minutes, the domain extent in kilometres.
+    """
+    MIN_TIME_LIMIT = int(os.getenv('VALIDATION_MIN_TIME_LIMIT', '1'))
+    MAX_TIME_LIMIT = int(os.getenv('VALIDATION_MAX_TIME_LIMIT', str(72 * 60)))
+    MAX_DOMAIN_EXTENT = float(os.getenv('VALIDATION_MAX_DOMAIN_EXTENT', '100'))
+
+class WarmStartConfig:
+    """
+    Optional warm-start worker: a pre-initialised PROPAGATOR process forks each simulation.
+    PRELOAD lists modules imported once by the worker, INIT an optional module:function
+    (from PROPAGATOR_DIR) called once, e.g. to load static data.
+    """
+    ENABLED = os.getenv('PROPAGATOR_WARM_START', 'false').lower() in ('1', 'true', 'yes')
+    PRELOAD = os.getenv('PROPAGATOR_WARM_PRELOAD', 'numpy')
+    INIT = os.getenv('PROPAGATOR_WARM_INIT', '')
+    SOCKET = os.getenv('PROPAGATOR_WARM_SOCKET', os.path.join(tempfile.gettempdir(), 'propagator_warm_worker.sock'))
+
+class StaticDataConfig:
+    """
+    Optional local cache of the PROPAGATOR static inputs cropped on the run domain.
+    LAYERS is a comma separated list of name=path (paths relative to PROPAGATOR_DIR);
+    the cropped arrays are passed to the simulation in the 'static_data' parameter.
+    DOMAIN_BUFFER is in km around the ignitions, TILE_SIZE in degrees, CACHE_BUDGET in MB.
+    """
+    LAYERS = dict(
+        layer.strip().split('=', 1)
+        for layer in os.getenv('STATIC_DATA_LAYERS', '').split(',') if layer.strip()
+    )
+    CACHE_DIR = os.getenv('STATIC_DATA_CACHE_DIR', os.path.join(PropagatorConfig.WORK_DIR, 'static_cache'))
+    CACHE_BUDGET = int(os.getenv('STATIC_DATA_CACHE_BUDGET', '2048')) * 1024 * 1024
+    DOMAIN_BUFFER = float(os.getenv('STATIC_DATA_DOMAIN_BUFFER', '10'))
+    TILE_SIZE = float(os.getenv('STATIC_DATA_TILE_SIZE', '0.1'))
+
+class ResourceLimitsConfig:
+    """
+    Per-run resource limits and admission control. MEMORY (MB) and CPU_TIME (seconds)
+    are applied to each simulation process with setrlimit, 0 disables the limit.
+    CPUS_PER_RUN pins each simulation on its own set of cores, 0 disables pinning.
+    A request is taken off the queue only if the node has the expected footprint
+    (EXPECTED_MEMORY and EXPECTED_DISK, in MB) available, 0 disables the check.
+    """
+    MEMORY = int(os.getenv('RUN_MAX_MEMORY', '0'))
+    CPU_TIME = int(os.getenv('RUN_MAX_CPU_TIME', '0'))
+    CPUS_PER_RUN = int(os.getenv('RUN_CPUS', '0'))
+    EXPECTED_MEMORY = int(os.getenv('RUN_EXPECTED_MEMORY', '0'))
+    EXPECTED_DISK = int(os.getenv('RUN_EXPECTED_DISK', '0'))
+    ADMISSION_RETRY_DELAY = float(os.getenv('RUN_ADMISSION_RETRY_DELAY', '10'))
+
+class LifecycleConfig:
+    """
+    WORK_DIR lifecycle: finished runs are optionally compacted into a compressed archive
+    after a successful upload (COMPACT), and runs are evicted oldest first when WORK_DIR exceeds
+    QUOTA (MB) or are older than MAX_AGE (hours). 0 disables the quota / age limit.
+    The checks run every CHECK_INTERVAL seconds in a background thread.
+    """
+    COMPACT = os.getenv('WORK_DIR_COMPACT', 'false').lower() in ('1', 'true', 'yes')
+    QUOTA = int(os.getenv('WORK_DIR_QUOTA', '0'))
+    MAX_AGE = float(os.getenv('WORK_DIR_MAX_AGE', '0'))
+    CHECK_INTERVAL = float(os.getenv('WORK_DIR_CHECK_INTERVAL', '600'))
+
+class RunControlConfig:
+    """
+    Supervision of the simulations: a simulation is stopped after TIMEOUT_BASE seconds plus
+    TIMEOUT_PER_HOUR seconds per simulated hour (wall-clock, both 0 disable the timeout), and
+    killed if still running KILL_GRACE seconds after SIGTERM. Runs are cancelled by a message
+    on CANCEL_ROUTING_KEY.<run_id>, a cancellation received before the run starts is kept
+    CANCEL_TTL seconds. On SIGTERM the service stops consuming, the runs in progress have
+    DRAIN_TIMEOUT seconds to end before being stopped and republished for the other nodes.
+    """
+    TIMEOUT_BASE = float(os.getenv('RUN_TIMEOUT_BASE', '1800'))
+    TIMEOUT_PER_HOUR = float(os.getenv('RUN_TIMEOUT_PER_HOUR', '120'))
+    KILL_GRACE = float(os.getenv('RUN_KILL_GRACE', '30'))
+    CANCEL_ROUTING_KEY = os.getenv('RUN_CANCEL_ROUTING_KEY', 'cancel.propagator')
+    CANCEL_TTL = float(os.getenv('RUN_CANCEL_TTL', '3600'))
+    DRAIN_TIMEOUT = float(os.getenv('RUN_DRAIN_TIMEOUT', '600'))
+
+class RetryConfig:
+    """
+    Retries of the failed runs: transient failures (broker, datalake, authentication,
+    crashed simulation) are retried up to MAX_RETRIES times, BASE_DELAY seconds after the
+    failure, doubled at each attempt up to MAX_DELAY. At most MAX_PENDING retries wait in
+    the queue. Requests that can't be retried are written with their diagnostics to
+    DEAD_LETTER_DIR, and published on DEAD_LETTER_ROUTING_KEY if set.
+    """
+    MAX_RETRIES = int(os.getenv('RETRY_MAX_RETRIES', '3'))
+    BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '30'))
+    MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '900'))
+    MAX_PENDING = int(os.getenv('RETRY_MAX_PENDING', '100'))
+    DEAD_LETTER_DIR = os.getenv('RETRY_DEAD_LETTER_DIR', os.path.join(PropagatorConfig.WORK_DIR, 'dead_letter'))
+    DEAD_LETTER_ROUTING_KEY = os.getenv('RETRY_DEAD_LETTER_ROUTING_KEY', '')
+
+class DeriveConfig:
+    """
+    Derive requests, on ROUTING_KEY.<datatype>.<run_id>, compute the products of a published
+    run again for new parameters (e.g. probabilityRange) from its outputs in WORK_DIR, and add
+    them to the datalake package of the run without simulating again.
+    """
+    ROUTING_KEY = os.getenv('DERIVE_ROUTING_KEY', 'derive')
+
+class LoggingConfig:
+    """
+    Logging pipeline: records are handed to a background listener thread which writes
+    them to stdout and to a size-rotated FILE (MAX_BYTES, BACKUP_COUNT). FORMAT is json or
+    text, messages longer than MAX_LENGTH characters are truncated. LEVELS and SAMPLING
+    are comma separated logger=value lists, e.g. LOG_LEVELS=propagator.wrapper=DEBUG and
+    LOG_SAMPLING=propagator.wrapper=0.1 (fraction of the records below WARNING kept).
+    """
+    LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    FORMAT = os.getenv('LOG_FORMAT', 'json')
+    FILE = os.getenv('LOG_FILE', 'info.log')
+    MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    MAX_LENGTH = int(os.getenv('LOG_MAX_LENGTH', '2000'))
+    LEVELS = dict(
+        item.strip().split('=', 1)
+        for item in os.getenv('LOG_LEVELS', '').split(',') if item.strip()
+    )
+    SAMPLING = {
+        name: float(rate) for name, rate in (
+            item.strip().split('=', 1)
+            for item in os.getenv('LOG_SAMPLING', '').split(',') if item.strip()
+        )
+    }
+
+class TracingConfig:
+    """
+    Optional tracing of the runs. Spans are exported in batches by a background thread,
+    as json lines to FILE (EXPORTER=file) or as OTLP/HTTP json to OTLP_ENDPOINT (EXPORTER=otlp).
+    """
+    ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    EXPORTER = os.getenv('TRACING_EXPORTER', 'file')
+    FILE = os.getenv('TRACING_FILE', 'traces.jsonl')
+    OTLP_ENDPOINT = os.getenv('TRACING_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    SERVICE_NAME = os.getenv('TRACING_SERVICE_NAME', 'propagator-is')
+    FLUSH_INTERVAL = float(os.getenv('TRACING_FLUSH_INTERVAL', '5'))
+
+class DatalakeConfig:
+    """
+    Upload of the run products to the datalake: files are uploaded concurrently
+    by UPLOAD_WORKERS threads, TIMEOUT is the timeout in seconds of each API call.
+    """
+    UPLOAD_WORKERS = int(os.getenv('DATALAKE_UPLOAD_WORKERS', '4'))
+    TIMEOUT = float(os.getenv('DATALAKE_TIMEOUT', '300'))
+
+class FootprintConfig:
+    """
+    Spatial extent of the runs in the datalake: bounding box (bbox), convex hull (convex) or
+    concave hull (concave) of the isochrones, simplified to at most MAX_VERTICES vertices.
+    METHODS overrides METHOD per datatype as a comma separated datatype=method list,
+    e.g. FOOTPRINT_METHODS=35007=concave,35010=bbox
+    """
+    METHOD = os.getenv('FOOTPRINT_METHOD', 'bbox')
+    METHODS = {
+        int(datatype): method.strip()
+        for datatype, method in (
+            item.strip().split('=', 1)
+            for item in os.getenv('FOOTPRINT_METHODS', '').split(',') if item.strip()
+        )
+    }
+    MAX_VERTICES = int(os.getenv('FOOTPRINT_MAX_VERTICES', '64'))
+    CONCAVE_RATIO = float(os.getenv('FOOTPRINT_CONCAVE_RATIO', '0.3'))
+
+class VectorTilesConfig:
+    """
+    Optional product packaging the isochrones as Mapbox Vector Tiles in an MBTiles archive,
+    generalized per zoom level (requires mapbox_vector_tile), uploaded as DATATYPE.
+    EXTENT and BUFFER are in tile units.
+    """
+    ENABLED = os.getenv('VECTOR_TILES_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    DATATYPE = int(os.getenv('VECTOR_TILES_DATATYPE', '35012'))
+    MIN_ZOOM = int(os.getenv('VECTOR_TILES_MIN_ZOOM', '6'))
+    MAX_ZOOM = int(os.getenv('VECTOR_TILES_MAX_ZOOM', '14'))
+    EXTENT = int(os.getenv('VECTOR_TILES_EXTENT', '4096'))
+    BUFFER = int(os.getenv('VECTOR_TILES_BUFFER', '64'))
+
+class TimeSeriesConfig:
+    """
+    Optional product stacking every timestep of the VARIABLES rasters (comma separated output
+    prefixes) in one multi-band Cloud-Optimized GeoTIFF, uploaded as DATATYPE.
+    """
+    ENABLED = os.getenv('TIME_SERIES_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    DATATYPE = int(os.getenv('TIME_SERIES_DATATYPE', '35013'))
+    VARIABLES = [
+        variable.strip()
+        for variable in os.getenv(
+            'TIME_SERIES_VARIABLES', 'RoS_mean,RoS_max,fireline_intensity_max,fireline_intensity_mean'
+        ).split(',') if variable.strip()
+    ]
+
+
+class BurnRastersConfig:
+    """
+    Optional products rasterized from the isochrones of all the timesteps, on the grid of the
+    GRID_VARIABLE rasters: the first arrival time (minutes) at the requested probability, uploaded
+    as ARRIVAL_TIME_DATATYPE, and the maximum probability reached, uploaded as PROBABILITY_DATATYPE.
+    """
+    ENABLED = os.getenv('BURN_RASTERS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    ARRIVAL_TIME_DATATYPE = int(os.getenv('BURN_RASTERS_ARRIVAL_TIME_DATATYPE', '35014'))
+    PROBABILITY_DATATYPE = int(os.getenv('BURN_RASTERS_PROBABILITY_DATATYPE', '35015'))
+    GRID_VARIABLE = os.getenv('BURN_RASTERS_GRID_VARIABLE', 'RoS_mean')
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+from dotenv import dotenv_values
+
+# the settings config.py requires, from the template, with a scratch WORK_DIR
+os.environ.setdefault('WORK_DIR', tempfile.mkdtemp(prefix='propagator-tests-'))
+for name, value in dotenv_values(os.path.join(os.path.dirname(__file__), '.env.template')).items():
+    os.environ.setdefault(name, value)
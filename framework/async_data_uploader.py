@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+from dataclasses import replace
+from os.path import basename
+from typing import List, Tuple
+
+import aiohttp
+
+from config import DatalakeConfig
+from framework.data_uploader import (DataUploadException,
+                                     MetadataDeleteException,
+                                     MetadataUploadException, upload_errors)
+from framework.tools import AuthenticationException
+from framework.tracing import traced
+from models.datalake import DatalakeMetadata, DatalakeResourceMetadata, dumps
+
+logger = logging.getLogger(__name__)
+
+
+async def get_access_token(session: aiohttp.ClientSession) -> str:
+    url = f'{os.getenv("OAUTH_URL")}/api/login'
+    body = {
+        "loginId": os.getenv("OAUTH_USER"),
+        "password": os.getenv("OAUTH_PWD"),
+        "applicationId": os.getenv("OAUTH_APP_ID"),
+        "noJWT": False
+    }
+    headers = {
+        "Authorization": os.getenv("OAUTH_API_KEY"),
+    }
+    try:
+        async with session.post(url, json=body, headers=headers) as response:
+            if response.status != 200:
+                error = await response.text()
+                logger.error(f'Error obtaining the access token: {error}')
+                raise AuthenticationException(error)
+            response_json = await response.json()
+    except aiohttp.ClientError as err:
+        logger.error(f"Error obtaining the access token: {err}")
+        raise AuthenticationException(str(err)) from err
+
+    logger.info("Access Token obtained")
+    return response_json["token"]
+
+
+async def action(session: aiohttp.ClientSession, access_token: str, action: str,
+                 exception: type = DataUploadException, **kwargs) -> dict:
+    """
+    Calls a CKAN action, see framework.data_uploader.DatalakeClient.action
+    """
+    url = f'{os.getenv("CKAN_URL")}/api/action/{action}'
+    headers = {
+        "Authorization": f'Bearer {access_token}',
+    }
+    if 'json' in kwargs:
+        # serialized with orjson if available
+        kwargs['data'] = dumps(kwargs.pop('json'))
+        headers["Content-Type"] = "application/json"
+    try:
+        async with session.post(url, headers=headers, **kwargs) as response:
+            if response.status != 200:
+                error = await response.text()
+                logger.error(f'Error calling {action}: {error}')
+                raise exception(error, status=response.status)
+            response_dict = await response.json()
+    except aiohttp.ClientError as e:
+        logger.error(f'Error calling {action}: {e}')
+        raise exception(str(e))
+
+    if response_dict.get("success") is not True:
+        raise exception(str(response_dict.get("error")), status=response.status, transient=False)
+    return response_dict["result"]
+
+
+async def open_file(filepath: str):
+    """
+    Opens a file to upload in the default executor, the event loop is not blocked
+    (aiohttp reads the file in the executor too)
+    """
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, open, filepath, "rb")
+    except FileNotFoundError:
+        logger.error("Error occurred: file not found" + str(filepath))
+        raise DataUploadException(f'file not found: {filepath}', transient=False)
+
+
+@traced()
+async def upload_file(session: aiohttp.ClientSession, access_token: str, resource_id: str, filepath: str) -> str:
+    logger.info(f'Uploading {filepath}')
+    with await open_file(filepath) as file:
+        form = aiohttp.FormData()
+        form.add_field('id', resource_id)
+        form.add_field('upload', file, filename=basename(filepath))
+        result = await action(session, access_token, 'resource_patch', data=form)
+    return result.get('url')
+
+
+async def delete_package(session: aiohttp.ClientSession, access_token: str, package_id: str):
+    """
+    Async counterpart of framework.data_uploader.DatalakeClient.delete_package
+    """
+    try:
+        await action(session, access_token, 'package_delete', exception=MetadataDeleteException, json={"id": package_id})
+        logger.info(f'Package {package_id} deleted')
+    except MetadataDeleteException as exp:
+        logger.error(f'Error deleting package {package_id}: {exp}')
+
+
+@traced()
+async def publish(
+        session: aiohttp.ClientSession,
+        metadata: DatalakeMetadata,
+        files: List[Tuple[str, DatalakeResourceMetadata]]
+    ) -> Tuple[str, List[str]]:
+    """
+    Async counterpart of framework.data_uploader.DatalakeClient.publish: the package is created
+    with its resource entries, the files are uploaded concurrently (at most
+    DatalakeConfig.UPLOAD_WORKERS at a time) and the package is deleted if any upload fails
+    @return: the package id and the urls of the resources, in the order of files
+    """
+    access_token = await get_access_token(session)
+
+    body = metadata.as_json_dict()
+    body["resources"] = []
+    for _, resource in files:
+        resource_body = resource.as_json_dict()
+        resource_body.pop("package_id", None)
+        resource_body["url"] = ""
+        body["resources"].append(resource_body)
+    package = await action(session, access_token, 'package_create', exception=MetadataUploadException, json=body)
+    logger.info(f'Package {package["id"]} created with {len(files)} resources')
+
+    resource_ids = [resource["id"] for resource in package.get("resources", [])]
+    semaphore = asyncio.Semaphore(DatalakeConfig.UPLOAD_WORKERS)
+
+    async def upload_one(resource_id: str, filepath: str) -> str:
+        async with semaphore:
+            return await upload_file(session, access_token, resource_id, filepath)
+
+    if len(resource_ids) != len(files):
+        results = [DataUploadException(f'{len(resource_ids)} resources created, {len(files)} expected')]
+    else:
+        results = await asyncio.gather(*(
+            upload_one(resource_id, filepath) for resource_id, (filepath, _) in zip(resource_ids, files)
+        ), return_exceptions=True)
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        logger.error(f'{len(errors)} of {len(files)} uploads failed. Removing package {package["id"]}...')
+        await delete_package(session, access_token, package["id"])
+        raise upload_errors(errors)
+
+    return package["id"], list(results)
+
+
+@traced()
+async def patch_package(session: aiohttp.ClientSession, package_id: str, **fields) -> dict:
+    """
+    Async counterpart of framework.data_uploader.DatalakeClient.patch_package
+    """
+    access_token = await get_access_token(session)
+    return await action(session, access_token, 'package_patch', exception=MetadataUploadException,
+                        json={"id": package_id, **fields})
+
+
+@traced()
+async def create_resource(session: aiohttp.ClientSession, access_token: str, filepath: str,
+                          resource_metadata: DatalakeResourceMetadata) -> dict:
+    logger.info(f'Uploading {filepath}')
+    with await open_file(filepath) as file:
+        form = aiohttp.FormData()
+        for key, value in resource_metadata.as_json_dict().items():
+            if value is not None:
+                form.add_field(key, str(value))
+        form.add_field('upload', file, filename=basename(filepath))
+        return await action(session, access_token, 'resource_create', data=form)
+
+
+async def add_resources(
+        session: aiohttp.ClientSession,
+        package_id: str,
+        files: List[Tuple[str, DatalakeResourceMetadata]]
+    ) -> List[str]:
+    """
+    Async counterpart of framework.data_uploader.DatalakeClient.add_resources
+    @return: the urls of the resources, in the order of files
+    """
+    access_token = await get_access_token(session)
+    semaphore = asyncio.Semaphore(DatalakeConfig.UPLOAD_WORKERS)
+
+    async def upload_one(filepath: str, resource: DatalakeResourceMetadata) -> dict:
+        async with semaphore:
+            return await create_resource(session, access_token, filepath, replace(resource, package_id=package_id))
+
+    results = await asyncio.gather(*(
+        upload_one(filepath, resource) for filepath, resource in files
+    ), return_exceptions=True)
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        logger.error(f'{len(errors)} of {len(files)} uploads failed. Removing the resources added to {package_id}...')
+        for result in results:
+            if not isinstance(result, BaseException):
+                try:
+                    await action(session, access_token, 'resource_delete', exception=MetadataDeleteException,
+                                 json={"id": result["id"]})
+                except MetadataDeleteException:
+                    pass
+        raise upload_errors(errors)
+
+    return [result.get('url') for result in results]
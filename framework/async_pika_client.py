@@ -0,0 +1,68 @@
+import ssl
+
+import aio_pika
+
+from config import RabbitMQConfig
+
+
+class AsyncPikaClient:
+    """
+    Persistent (robust) AMQP connection shared by the consumer and the publishers of the asyncio runtime
+    """
+    def __init__(self, prefetch_count: int = 1):
+        self.config = RabbitMQConfig()
+        self.prefetch_count = prefetch_count
+        self.conn = None
+        self.channel = None
+        self._exchanges = {}
+
+    async def connect(self, prefetch_count: int = None):
+        config = self.config
+        self.conn = await aio_pika.connect_robust(
+            host=config.RMQ_HOST,
+            port=int(config.RMQ_PORT),
+            login=config.RMQ_USERNAME,
+            password=config.RMQ_PASSWORD,
+            virtualhost=config.RMQ_VHOST,
+            ssl=True,
+            ssl_context=ssl.create_default_context()
+        )
+        self.channel = await self.conn.channel()
+        await self.channel.set_qos(prefetch_count=prefetch_count or self.prefetch_count)
+        return self
+
+    async def get_exchange(self, exchange: str):
+        # declare the exchange passively (just checks it exists)
+        if exchange not in self._exchanges:
+            self._exchanges[exchange] = await self.channel.get_exchange(exchange, ensure=True)
+        return self._exchanges[exchange]
+
+    async def get_queue(self, queue: str):
+        return await self.channel.get_queue(queue, ensure=True)
+
+    async def subscribe(self, exchange: str, routing_key: str, callback):
+        """
+        Consumes the messages of a routing key on a queue of this connection only
+        @param callback: coroutine function called with each message
+        """
+        queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(await self.get_exchange(exchange), routing_key=routing_key)
+        await queue.consume(callback, no_ack=True)
+        return queue
+
+    async def write_message(self, exchange: str, routing_key: str, message: str, properties: dict = None):
+        target = await self.get_exchange(exchange)
+        return await target.publish(
+            aio_pika.Message(body=message.encode('utf-8'), **(properties or {})),
+            routing_key=routing_key
+        )
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exception_type, exception_value, exception_traceback):
+        await self.close()
@@ -1,168 +1,264 @@
+import contextvars
 import datetime
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from os.path import basename
-import re
-from urllib.parse import quote
+from typing import List, Tuple
 
 import requests
-from dotenv import load_dotenv
-from models.datalake import DatalakeMetadata, DatalakeResourceMetadata
-from requests import HTTPError
+from models.datalake import DatalakeMetadata, DatalakeResourceMetadata, dumps
 
+from config import DatalakeConfig
 from framework.tools import get_access_token
+from framework.tracing import traced
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-class DataUploadException(Exception):
+# statuses of the datalake errors that may not happen again: timeouts and rate limits (the
+# server errors, 5xx, too)
+TRANSIENT_STATUSES = (408, 429)
+
+
+class DatalakeException(Exception):
+    """
+    Error of a datalake call
+    @param status: HTTP status of the response, None if the datalake didn't answer
+    @param transient: True if the call may succeed when repeated; by default when the datalake
+    didn't answer or answered with a server error, a timeout or a rate limit
+    """
+    def __init__(self, message: str = '', status: int = None, transient: bool = None):
+        super().__init__(message)
+        self.status = status
+        if transient is None:
+            transient = status is None or status in TRANSIENT_STATUSES or status >= 500
+        self.transient = transient
+
+
+class DataUploadException(DatalakeException):
     pass
-class MetadataUploadException(Exception):
+class MetadataUploadException(DatalakeException):
     pass
 
-class MetadataDeleteException(Exception):
+class MetadataDeleteException(DatalakeException):
     pass
 
 
-def delete_metadata(metadata_id):
-    
-    url = f'{os.getenv("CKAN_URL")}/api/action/package_delete'
-    headers = {
-        "Authorization": f'Bearer {access_token}',
-    }
-    body = {"id": metadata_id}
-    try:
-        response = requests.post(url, json=body, headers=headers)
-        # If the response was successful, no Exception will be raised
-        response.raise_for_status()
-    except HTTPError as http_err:
-        logging.info(f"HTTP error occurred: {http_err}")  # Python 3.6
-    except Exception as err:
-        logging.info(f"Other error occurred: {err}")  # Python 3.6
-    else:
-        logging.info("Metadata deleted")
-
-    if response.status_code == 200:
-        response_dict = response.json()
-        assert response_dict["success"] is True
-    else:
-        logging.error('Error in deleting the metadata:')
-        logging.error(response.json())
-        raise MetadataDeleteException
-
-
-def upload_metadata(metadata: DatalakeMetadata):
-    access_token = get_access_token()
-
-    url = f'{os.getenv("CKAN_URL")}/api/action/package_create'
-    headers = {
-        "Authorization": f'Bearer {access_token}',
-    }
-    body = metadata.as_json_dict()
-
-    try:
-        response = requests.post(url, json=body, headers=headers)
-        # If the response was successful, no Exception will be raised
-        response.raise_for_status()
-    except HTTPError as http_err:
-        logging.error(f"HTTP error occurred: {http_err}")  # Python 3.6
-    except Exception as err:
-        logging.error(f"Other error occurred: {err}")  # Python 3.6
-    else:
-        logging.info("Metadata uploaded")
-
-    if response.status_code == 200:
-        response_dict = response.json()
-        assert response_dict["success"] is True
-        created_package = response_dict["result"]
-    else:
-        logging.error('Error:')
-        error = response.json()
-        logging.error(error)
-        raise MetadataUploadException(response.text)
-
-    return created_package["id"]
-
-
-def upload_resource(metadata_id: str, filepath: str, resource_metadata: DatalakeResourceMetadata, filename: str):
-    access_token = get_access_token()
-
-    url = f'{os.getenv("CKAN_URL")}/api/action/resource_create'
-    logging.info(f'Uploading {filepath}')
-
-    resource_body = resource_metadata.as_json_dict()
-    headers = {
-        "Authorization": f'Bearer {access_token}',
-    }
-    try:
-        with open(filepath, "rb") as file:
-            response = requests.post(url,
-                        data=resource_body,
-                        headers=headers,
-                        files=[('upload', file)])
-
-    except FileNotFoundError as e:
-        logging.error("Error occurred: file not found" + str(filepath))
-        raise DataUploadException(str(error))
-
-    except requests.exceptions.RequestException as e:
-        logging.error("Error occurred: " + str(e))
-        raise DataUploadException(str(error))
-
-
-    if response.status_code != 200:
-        error = response.json()
-        logging.error(f'Error Uploading resource: {error}')
-        raise DataUploadException(str(error))
-
-    response_json = response.json()
-    resource_url = None
-    
-    if 'result' in response_json and 'url' in response_json['result']:
-        resource_url = response_json['result']['url']
-    
-    return resource_url
-
-
-
-def upload(
-        metadata_id: str,
-        filepath: str, 
-        file_date_start:datetime, 
-        file_date_end:datetime, 
-        format:str='GeoJSON',
-        request_code:str=None,
-        datatype_resource: int = None
-    ):
-    
+def upload_errors(errors: List[BaseException]) -> DataUploadException:
+    """
+    Returns the error of concurrent uploads that failed: transient only if every failure is,
+    otherwise repeating them fails again
+    """
+    return DataUploadException(
+        '; '.join(str(error) for error in errors),
+        transient=all(isinstance(error, DatalakeException) and error.transient for error in errors)
+    )
+
+
+def resource_metadata(
+        filepath: str,
+        file_date_start: datetime,
+        file_date_end: datetime,
+        format: str = 'GeoJSON',
+        request_code: str = None,
+        datatype_resource: int = None,
+        metadata_id: str = None
+    ) -> DatalakeResourceMetadata:
+    """
+    Builds the metadata of a resource, named after its file
+    """
     resource_name = basename(filepath).rsplit('.', 1)[0]
-    res_metadata = DatalakeResourceMetadata(
+    return DatalakeResourceMetadata(
         notes=f'{resource_name}',
         package_id=metadata_id,
         file_date_start=file_date_start,
         file_date_end=file_date_end,
         name=resource_name,
         format=format,
-        request_code=request_code, 
+        request_code=request_code,
         datatype_resource=datatype_resource
     )
 
-    logging.info(f'Uploading on metadata_id: {metadata_id}')
-
-    # 4 . uploade datasets 
-    try:
-        # iterate on files inside resource_filepath and upload them
-        resource_url = upload_resource(
-            metadata_id,
-            filepath,
-            res_metadata,
-            filepath
-            )
-        logging.info("Uploading done!")
-    except DataUploadException:
-        # if any error occurs in uploading datasets, delete the metadata 
-        # (otherwise it will be metadata with no data)
-        logging.error('One or more dataset upload failed. Removing the metadata...')
-        delete_metadata(metadata_id)
-
-    return resource_url
 
+class DatalakeClient:
+    """
+    Registers a package and all its resources in the datalake with as few calls as CKAN allows:
+    one login, one package_create carrying the resource entries, then the files are uploaded
+    concurrently on the created resources (resource_patch). If any upload fails the package is
+    deleted, so that no package is left with missing data.
+    """
+    def __init__(self, url: str = None, workers: int = None):
+        self.url = url or os.getenv("CKAN_URL")
+        self.workers = workers or DatalakeConfig.UPLOAD_WORKERS
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._access_token = None
+
+    @property
+    def access_token(self) -> str:
+        if self._access_token is None:
+            self._access_token = get_access_token()
+        return self._access_token
+
+    def action(self, action: str, exception: type = DataUploadException, **kwargs) -> dict:
+        """
+        Calls a CKAN action
+        @param action: action name
+        @param exception: exception raised on failure
+        @param kwargs: request arguments (json, data, files)
+        @return: the result of the action
+        """
+        headers = {
+            "Authorization": f'Bearer {self.access_token}',
+        }
+        if 'json' in kwargs:
+            # serialized with orjson if available
+            kwargs['data'] = dumps(kwargs.pop('json'))
+            headers["Content-Type"] = "application/json"
+        try:
+            response = self.session.post(f'{self.url}/api/action/{action}', headers=headers,
+                                         timeout=DatalakeConfig.TIMEOUT, **kwargs)
+        except requests.exceptions.RequestException as e:
+            logger.error(f'Error calling {action}: {e}')
+            raise exception(str(e))
+
+        if response.status_code != 200:
+            logger.error(f'Error calling {action}: {response.text}')
+            raise exception(response.text, status=response.status_code)
+
+        response_dict = response.json()
+        if response_dict.get("success") is not True:
+            raise exception(str(response_dict.get("error")), status=response.status_code, transient=False)
+        return response_dict["result"]
+
+    @traced()
+    def create_package(self, metadata: DatalakeMetadata, resources: List[DatalakeResourceMetadata]) -> dict:
+        """
+        Creates the package with its resource entries (without data)
+        @return: the created package, with the resource ids in the order of resources
+        """
+        body = metadata.as_json_dict()
+        body["resources"] = []
+        for resource in resources:
+            resource_body = resource.as_json_dict()
+            resource_body.pop("package_id", None)
+            resource_body["url"] = ""
+            body["resources"].append(resource_body)
+
+        package = self.action('package_create', exception=MetadataUploadException, json=body)
+        logger.info(f'Package {package["id"]} created with {len(resources)} resources')
+        return package
+
+    @traced()
+    def upload_file(self, resource_id: str, filepath: str) -> str:
+        """
+        Uploads the data of a resource
+        @return: the url of the resource
+        """
+        logger.info(f'Uploading {filepath}')
+        try:
+            with open(filepath, "rb") as file:
+                result = self.action('resource_patch', data={"id": resource_id},
+                                     files=[('upload', (basename(filepath), file))])
+        except FileNotFoundError:
+            logger.error(f'Error occurred: file not found {filepath}')
+            raise DataUploadException(f'file not found: {filepath}', transient=False)
+        return result.get("url")
+
+    def delete_package(self, package_id: str):
+        try:
+            self.action('package_delete', exception=MetadataDeleteException, json={"id": package_id})
+            logger.info(f'Package {package_id} deleted')
+        except MetadataDeleteException as exp:
+            logger.error(f'Error deleting package {package_id}: {exp}')
+
+    def publish(self, metadata: DatalakeMetadata, files: List[Tuple[str, DatalakeResourceMetadata]]) -> Tuple[str, List[str]]:
+        """
+        Creates a package with a resource for each file and uploads the files concurrently,
+        deleting the package if any upload fails
+        @param metadata: package metadata
+        @param files: list of (file path, resource metadata)
+        @return: the package id and the urls of the resources, in the order of files
+        @raise DataUploadException: if any upload failed (the package is deleted)
+        """
+        package = self.create_package(metadata, [resource for _, resource in files])
+        resource_ids = [resource["id"] for resource in package.get("resources", [])]
+        if len(resource_ids) != len(files):
+            self.delete_package(package["id"])
+            raise DataUploadException(f'{len(resource_ids)} resources created, {len(files)} expected')
+
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(files)), 1)) as executor:
+            futures = [
+                # each upload in a copy of the current context, so that spans and logs keep the run
+                executor.submit(contextvars.copy_context().run, self.upload_file, resource_id, filepath)
+                for resource_id, (filepath, _) in zip(resource_ids, files)
+            ]
+            errors = [future.exception() for future in futures if future.exception() is not None]
+
+        if errors:
+            logger.error(f'{len(errors)} of {len(files)} uploads failed. Removing package {package["id"]}...')
+            self.delete_package(package["id"])
+            raise upload_errors(errors)
+
+        return package["id"], [future.result() for future in futures]
+
+    @traced()
+    def patch_package(self, package_id: str, **fields) -> dict:
+        """
+        Updates fields of an existing package
+        @return: the updated package
+        """
+        return self.action('package_patch', exception=MetadataUploadException, json={"id": package_id, **fields})
+
+    @traced()
+    def create_resource(self, filepath: str, resource_metadata: DatalakeResourceMetadata) -> dict:
+        """
+        Creates a resource with its data in an existing package (resource_metadata.package_id)
+        @return: the created resource
+        """
+        logger.info(f'Uploading {filepath}')
+        data = {key: value for key, value in resource_metadata.as_json_dict().items() if value is not None}
+        try:
+            with open(filepath, "rb") as file:
+                return self.action('resource_create', data=data, files=[('upload', (basename(filepath), file))])
+        except FileNotFoundError:
+            logger.error(f'Error occurred: file not found {filepath}')
+            raise DataUploadException(f'file not found: {filepath}', transient=False)
+
+    def delete_resource(self, resource_id: str):
+        try:
+            self.action('resource_delete', exception=MetadataDeleteException, json={"id": resource_id})
+            logger.info(f'Resource {resource_id} deleted')
+        except MetadataDeleteException as exp:
+            logger.error(f'Error deleting resource {resource_id}: {exp}')
+
+    def add_resources(self, package_id: str, files: List[Tuple[str, DatalakeResourceMetadata]]) -> List[str]:
+        """
+        Adds a resource for each file to an existing package, uploading the files concurrently;
+        if any upload fails the resources added are deleted, the package is left as it was
+        @param package_id: id of the package
+        @param files: list of (file path, resource metadata)
+        @return: the urls of the resources, in the order of files
+        @raise DataUploadException: if any upload failed
+        """
+        # logged in once, before the concurrent uploads
+        self.access_token
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(files)), 1)) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, self.create_resource,
+                                filepath, replace(resource, package_id=package_id))
+                for filepath, resource in files
+            ]
+            errors = [future.exception() for future in futures if future.exception() is not None]
+
+        if errors:
+            logger.error(f'{len(errors)} of {len(files)} uploads failed. Removing the resources added to {package_id}...')
+            for future in futures:
+                if future.exception() is None:
+                    self.delete_resource(future.result()["id"])
+            raise upload_errors(errors)
+
+        return [future.result().get("url") for future in futures]
@@ -0,0 +1,148 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict
+
+from config import LoggingConfig
+
+run_id_var = contextvars.ContextVar('run_id', default=None)
+
+_listener = None
+
+
+@contextmanager
+def run_context(run_id: str):
+    """
+    Tags the records logged in the context (and in the contexts copied from it) with run_id
+    """
+    token = run_id_var.set(run_id)
+    try:
+        yield
+    finally:
+        run_id_var.reset(token)
+
+
+def truncate(text: str, max_length: int) -> str:
+    if max_length > 0 and len(text) > max_length:
+        return f'{text[:max_length]}... [{len(text) - max_length} characters truncated]'
+    return text
+
+
+class RunContextFilter(logging.Filter):
+    """
+    Adds the run_id of the current context to the records, in the logging thread
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.run_id = run_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records below WARNING of the configured loggers
+    """
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # longest prefix first, so that the most specific logger wins
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        for name, rate in self.rates:
+            if record.name == name or record.name.startswith(name + '.'):
+                return random.random() < rate
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that hands the records to the listener as they are: message formatting
+    (including the arguments) happens in the listener thread, not in the logging one
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json object per line, with the run_id context and a truncated message
+    """
+    def __init__(self, max_length: int):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'run_id': getattr(record, 'run_id', None),
+            'message': truncate(record.getMessage().rstrip('\n'), self.max_length),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The previous plain text format, with the run_id context and a truncated message
+    """
+    def __init__(self, max_length: int):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = truncate(record.getMessage().rstrip('\n'), self.max_length)
+        line = f"{self.formatTime(record)} [{record.levelname}] {getattr(record, 'run_id', None) or '-'} {message}"
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(config=LoggingConfig) -> logging.handlers.QueueListener:
+    """
+    Configures the root logger to enqueue the records, written to stdout and to a
+    rotated file by a listener thread, so that logging never blocks the caller on I/O.
+    Safe to call more than once.
+    @return: the listener
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = JsonFormatter(config.MAX_LENGTH) if config.FORMAT == 'json' else TextFormatter(config.MAX_LENGTH)
+    handlers = [
+        logging.handlers.RotatingFileHandler(
+            config.FILE, maxBytes=config.MAX_BYTES, backupCount=config.BACKUP_COUNT),
+        logging.StreamHandler(),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RunContextFilter())
+    if config.SAMPLING:
+        queue_handler.addFilter(SamplingFilter(config.SAMPLING))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.LEVEL)
+    for name, level in config.LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    return _listener
@@ -6,24 +6,26 @@ from config import RabbitMQConfig
         
 config = RabbitMQConfig()
 
-class PikaClient:
-    def __init__(self, exchange=config.RMQ_EXCHANGE):
-        self.exchange = exchange
-        credentials = pika.PlainCredentials(config.RMQ_USERNAME, config.RMQ_PASSWORD)
-        ssl_options = pika.SSLOptions(ssl.create_default_context(), config.RMQ_HOST)
+def connection_parameters() -> pika.ConnectionParameters:
+    credentials = pika.PlainCredentials(config.RMQ_USERNAME, config.RMQ_PASSWORD)
+    ssl_options = pika.SSLOptions(ssl.create_default_context(), config.RMQ_HOST)
+
+    # create the connection parameters
+    return pika.ConnectionParameters(
+        host=config.RMQ_HOST,
+        port=config.RMQ_PORT,
+        virtual_host=config.RMQ_VHOST,
+        credentials=credentials,
+        ssl_options=ssl_options,
+        locale="en_US")
 
-        # create the connection parameters
-        params = pika.ConnectionParameters(
-            host=config.RMQ_HOST,
-            port=config.RMQ_PORT,
-            virtual_host=config.RMQ_VHOST,
-            credentials=credentials,
-            ssl_options=ssl_options,
-            locale="en_US")
 
+class PikaClient:
+    def __init__(self, exchange=None):
+        self.exchange = exchange or config.RMQ_EXCHANGE
 
         # create a connection instance and then close it, or use the 'with' scope
-        self.conn = pika.BlockingConnection(parameters=params)
+        self.conn = pika.BlockingConnection(parameters=connection_parameters())
         # create channel to the broker
         self.channel = self.conn.channel()
         # declare the exchange to use passively (just checks it exists), in this case a topic exchange
@@ -6,6 +6,8 @@ from dotenv import load_dotenv
 from pathlib import Path
 import logging
 
+logger = logging.getLogger(__name__)
+
 load_dotenv(dotenv_path=".env")
 
 
@@ -15,15 +17,15 @@ def callback(channel, method, properties, body):
     """
     Simplest callback you can have
     """
-    logging.info(f"[{datetime.now()}] Received {method.routing_key}:{body}")
+    logger.info(f"[{datetime.now()}] Received {method.routing_key}:{body}")
 
 
 if __name__ == "__main__":
     from config import RabbitMQConfig
 
     config = RabbitMQConfig()
-    logging.info(f"Connecting to {config.RMQ_HOST}:{config.RMQ_PORT}/{config.RMQ_VHOST}")
-    logging.info(f"Credentials: {config.RMQ_USERNAME} - {config.RMQ_PASSWORD}")
+    logger.info(f"Connecting to {config.RMQ_HOST}:{config.RMQ_PORT}/{config.RMQ_VHOST}")
+    logger.info(f"Credentials: {config.RMQ_USERNAME} - {config.RMQ_PASSWORD}")
     # uncomment following line if you encounter troubles with certification authority validation
     # assert os.path.exists(config.CA_FILE) and os.path.isfile(config.CA_FILE)
 
@@ -55,7 +57,7 @@ if __name__ == "__main__":
         channel.exchange_declare(config.RMQ_EXCHANGE, exchange_type="topic", passive=True)
         channel.queue_bind(queue=config.RMQ_QUEUE, exchange=config.RMQ_EXCHANGE, routing_key=BINDING_KEY)
 
-        logging.info("Waiting for messages, press CTRL+C to exit.")
+        logger.info("Waiting for messages, press CTRL+C to exit.")
         try:
             # start listening and consuming messages
             channel.basic_consume(queue=config.RMQ_QUEUE, on_message_callback=callback, auto_ack=True)
@@ -1,19 +1,18 @@
 import json
 import logging
 import os
-import pdb
-import ssl
-from datetime import datetime
 
-import pika
 import requests
-from dotenv import load_dotenv
 from requests import HTTPError
 
-load_dotenv(".env", verbose=True)
+logger = logging.getLogger(__name__)
 
 REFRESH_TOKEN = None
 
+
+class AuthenticationException(Exception):
+    pass
+
 # Get access token
 
 
@@ -32,18 +31,12 @@ def get_access_token():
         response = requests.post(url, json=body, headers=headers)
         # If the response was successful, no Exception will be raised
         response.raise_for_status()
-    except HTTPError as http_err:
-        logging.error(f"HTTP error occurred: {http_err}")  # Python 3.6
-    except Exception as err:
-        logging.error(f"Other error occurred: {err}")  # Python 3.6
-    else:
-        logging.info("Access Token obtained")
-    if response.status_code == 200:
-        REFRESH_TOKEN = response.json()["refreshToken"]
-    else:
-        logging.error('Error:')
-        logging.error(response.json())
-        raise Exception
+    except requests.RequestException as err:
+        logger.error(f"Error obtaining the access token: {err}")
+        raise AuthenticationException(str(err)) from err
+
+    logger.info("Access Token obtained")
+    REFRESH_TOKEN = response.json()["refreshToken"]
     return response.json()["token"]
 
 
@@ -57,16 +50,20 @@ def refresh_token():
         # If the response was successful, no Exception will be raised
         response.raise_for_status()
     except HTTPError as http_err:
-        logging.error(f"HTTP error occurred: {http_err}")  # Python 3.6
+        logger.error(f"HTTP error occurred: {http_err}")  # Python 3.6
     except Exception as err:
-        logging.error(f"Other error occurred: {err}")  # Python 3.6
+        logger.error(f"Other error occurred: {err}")  # Python 3.6
     else:
-        logging.error("Access Token obtained")
+        logger.error("Access Token obtained")
 
     return response.json()["token"]
 
 
 def send_notification_example(message):
+    import ssl
+
+    import pika
+
     from config import RabbitMQConfig
     config = RabbitMQConfig()
 
@@ -101,4 +98,4 @@ def send_notification_example(message):
         # send the message on the given exchange, with the required routing key and body
         channel.basic_publish(exchange=config.RMQ_EXCHANGE,
                               routing_key=routing_key, body=json.dumps(message))
-        logging.info(f"Sent {routing_key}:{message}")
+        logger.info(f"Sent {routing_key}:{message}")
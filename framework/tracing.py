@@ -0,0 +1,236 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from config import TracingConfig
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = 'traceparent'
+RUN_ID_HEADER = 'run_id'
+
+OTLP_STATUS_CODES = {'OK': 1, 'ERROR': 2}
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start: int = field(default_factory=time.time_ns)
+    end: int = None
+    attributes: dict = field(default_factory=dict)
+    status: str = 'OK'
+    status_message: str = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end - self.start) / 1e6 if self.end else None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def as_dict(self) -> dict:
+        entry = asdict(self)
+        entry['duration_ms'] = self.duration_ms
+        return entry
+
+
+def new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def parse_traceparent(value: str):
+    """
+    @return: (trace_id, parent span id) of a W3C traceparent header, None if invalid
+    """
+    try:
+        _, trace_id, span_id, _ = value.split('-')
+    except (AttributeError, ValueError):
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16:
+        return None
+    return trace_id, span_id
+
+
+def inject(headers: dict = None) -> dict:
+    """
+    Adds the trace context of the current span (and its run_id) to message headers
+    """
+    headers = dict(headers or {})
+    span = current_span.get()
+    if span is not None:
+        headers[TRACEPARENT_HEADER] = f'00-{span.trace_id}-{span.span_id}-01'
+        if 'run_id' in span.attributes:
+            headers[RUN_ID_HEADER] = span.attributes['run_id']
+    return headers
+
+
+@contextmanager
+def span(name: str, headers: dict = None, **attributes):
+    """
+    Records a span around the context, child of the current span. A root span continues
+    the trace of the incoming message headers if they carry one.
+    Nothing is recorded when tracing is disabled.
+    @param name: span name
+    @param headers: optional incoming message headers
+    @param attributes: span attributes (run_id is inherited from the parent)
+    """
+    if not TracingConfig.ENABLED:
+        yield None
+        return
+
+    parent = current_span.get()
+    if parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+        attributes.setdefault('run_id', parent.attributes.get('run_id'))
+    else:
+        trace_id, parent_id = parse_traceparent((headers or {}).get(TRACEPARENT_HEADER)) or (new_id(16), None)
+
+    current = Span(name, trace_id, new_id(8), parent_id, attributes={
+        key: value for key, value in attributes.items() if value is not None
+    })
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as exp:
+        current.status = 'ERROR'
+        current.status_message = f'{type(exp).__name__}: {exp}'
+        raise
+    finally:
+        current_span.reset(token)
+        current.end = time.time_ns()
+        get_exporter().export(current)
+
+
+def traced(name: str = None):
+    """
+    Decorator recording a span around each call of a function or coroutine function
+    """
+    def decorator(function):
+        span_name = name or function.__name__
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(spans: List[Span], service_name: str) -> dict:
+    """
+    OTLP/HTTP json payload of a batch of spans
+    """
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{
+            'scope': {'name': 'propagator'},
+            'spans': [{
+                'traceId': s.trace_id,
+                'spanId': s.span_id,
+                'parentSpanId': s.parent_id or '',
+                'name': s.name,
+                'kind': 1,
+                'startTimeUnixNano': str(s.start),
+                'endTimeUnixNano': str(s.end),
+                'attributes': [{'key': k, 'value': otlp_value(v)} for k, v in s.attributes.items()],
+                'status': {'code': OTLP_STATUS_CODES[s.status], 'message': s.status_message or ''},
+            } for s in spans],
+        }],
+    }]}
+
+
+class SpanExporter:
+    """
+    Exports the finished spans in batches from a background thread
+    """
+    def __init__(self, exporter: str, file: str, endpoint: str, service_name: str, interval: float):
+        self.exporter = exporter
+        self.file = file
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.interval = interval
+        self.spans = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self.loop, name='span-exporter', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def export(self, span: Span):
+        self.spans.put(span)
+
+    def loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.spans.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+
+        try:
+            if self.exporter == 'otlp':
+                import requests
+                requests.post(self.endpoint, json=to_otlp(batch, self.service_name), timeout=10).raise_for_status()
+            else:
+                with open(self.file, 'a') as fp:
+                    for s in batch:
+                        fp.write(json.dumps(s.as_dict(), default=str) + '\n')
+        except Exception as exp:
+            logger.warning(f'Error exporting {len(batch)} spans: {exp}')
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> SpanExporter:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = SpanExporter(
+                    TracingConfig.EXPORTER,
+                    TracingConfig.FILE,
+                    TracingConfig.OTLP_ENDPOINT,
+                    TracingConfig.SERVICE_NAME,
+                    TracingConfig.FLUSH_INTERVAL
+                )
+    return _exporter
@@ -1,42 +1,50 @@
 
+import argparse
+import asyncio
+import functools
 import json
+import signal
 import ssl
+import time
 import pika
 
 from config import RabbitMQConfig
 from config import PropagatorConfig
-from propagator.run_handler import PropagatorRunHandler
+from config import ResourceLimitsConfig
+from config import RunControlConfig
+from propagator.run_handler import (DEFAULT_DATATYPE_ID, PRODUCTS,
+                                    PropagatorRunHandler)
 import logging
 from datetime import datetime
-import logging
+from framework.logging_setup import run_context, setup_logging
+from framework.tracing import span
+from propagator.derive import (derive_params, find_stored_run,
+                               is_derive_request, validate_derive_request)
+from propagator.lifecycle import get_lifecycle_manager
+from propagator.resources import check_admission
+from propagator.retry import (RetryJob, RetryStage, classify_exception,
+                              get_retry_queue)
+from propagator.supervisor import (get_run_supervisor, on_cancel_message,
+                                   start_cancellation_listener)
 from propagator.utils import parse_request_body
+from propagator.validation import RequestValidationException, validate_request
 import os
 
+logger = logging.getLogger(__name__)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("info.log"),
-        logging.StreamHandler()
-    ]
-)
+# the whole run, or one of its products
+SUPPORTED_DATA_TYPES = [DEFAULT_DATATYPE_ID] + [product.datatype_id for product in PRODUCTS]
 
-SUPPORTED_DATA_TYPES = [35006, ]#35007, 35008, 35009, 35010]
+# seconds between two checks of the drain mode by the consumer
+DRAIN_CHECK_INTERVAL = 1
 
-def callback(channel, method, properties, body):
-    user_id = properties.user_id
-    routing_key: str = method.routing_key
 
-    logging.info(f"Received message: user_id: {user_id}, routing_key: {routing_key}")
-    logging.info(f"body: {body}")
-    
-    _, datatype, *run_id = routing_key.split('.')
-    if int(datatype) not in SUPPORTED_DATA_TYPES: return
+def run_dir(run_id: str, datatype) -> str:
+    return os.path.abspath(os.path.join(PropagatorConfig.WORK_DIR, run_id + '.' + str(datatype)))
 
-    run_id = '.'.join(run_id)
 
-    output_dir_rel = os.path.join(PropagatorConfig.WORK_DIR, run_id + '.' + str(datatype))
+def write_message_file(run_id: str, datatype: str, body):
+    output_dir_rel = run_dir(run_id, datatype)
     os.makedirs(output_dir_rel, exist_ok=True)
     param_file = os.path.join(output_dir_rel, 'message.json')
     
@@ -44,16 +52,122 @@ def callback(channel, method, properties, body):
         json.dump(json.loads(body),fp)
 
 
-    logging.info(f"run_id: {run_id}")
+def record_queue_latency(root_span, timestamp):
+    """
+    Records the time the request waited on the bus, if the publisher set its timestamp
+    @param timestamp: AMQP timestamp, seconds since the epoch or datetime
+    """
+    if root_span is None or not timestamp:
+        return
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+    root_span.set_attribute('queue_latency_ms', max(time.time() - timestamp, 0) * 1000)
+
+
+def derive_run(user_id: str, run_id: str, datatype_id: int, body, job: RetryJob):
+    """
+    Handles a derive request: the products of a run stored on this node are computed
+    again for the parameters of the request, without simulating
+    """
+    try:
+        overrides = validate_derive_request(body)
+    except RequestValidationException as exp:
+        logger.warning(f"Invalid derive request {run_id}: {exp}")
+        runner = PropagatorRunHandler(user_id, run_id, {}, datatype_id=datatype_id)
+        runner.send_error_message('VALIDATION_ERROR', status_code=400, type='end', details=exp.errors)
+        return
+
+    stored_run = find_stored_run(run_id)
+    if stored_run is None:
+        logger.warning(f"Derive request {run_id}: run not stored on this node")
+        runner = PropagatorRunHandler(user_id, run_id, {}, datatype_id=datatype_id)
+        runner.send_error_message('RUN_NOT_FOUND', status_code=404, type='end')
+        return
+
+    try:
+        runner = PropagatorRunHandler(user_id, run_id, derive_params(stored_run, overrides),
+                                      datatype_id=datatype_id, retry_job=job, stored_run=stored_run)
+        runner.derive_products()
+    except Exception as exp:
+        logger.exception(f"Error deriving {run_id}")
+        get_retry_queue().retry(job, classify_exception(exp, RetryStage.RUN), f'{run_id} error: {exp}', exp)
+
+
+def callback(channel, method, properties, body):
+    user_id = properties.user_id
+    routing_key: str = method.routing_key
+
+    logger.info(f"Received message: user_id: {user_id}, routing_key: {routing_key}")
+    logger.debug("body: %s", body)
     
-    data = parse_request_body(body)
-    runner = PropagatorRunHandler(user_id, run_id, data, datatype_id=35006)
-    runner.run_propagator()
+    _, datatype, *run_id = routing_key.split('.')
+    if int(datatype) not in SUPPORTED_DATA_TYPES:
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        return
+
+    # leave the request on the queue for the other nodes while draining
+    if get_run_supervisor().draining:
+        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        return
+
+    # leave the request on the queue if the node can't take it now, derive requests don't simulate
+    derive = is_derive_request(routing_key)
+    reason = None if derive else check_admission()
+    if reason is not None:
+        logger.warning(f"Request {routing_key} not admitted: {reason}")
+        # requeue it later from the connection ioloop, sleeping here would block the heartbeats
+        channel.connection.call_later(
+            ResourceLimitsConfig.ADMISSION_RETRY_DELAY,
+            functools.partial(channel.basic_nack, delivery_tag=method.delivery_tag, requeue=True)
+        )
+        return
+    channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    run_id = '.'.join(run_id)
+    # a republished request carries its previous attempts and its original user
+    job = RetryJob.from_delivery(routing_key, user_id, body, int(datatype), properties.headers)
+    user_id = job.user_id
+    with run_context(run_id), span('callback', headers=properties.headers, run_id=run_id, routing_key=routing_key) as root_span:
+        record_queue_latency(root_span, properties.timestamp)
+
+        if derive:
+            derive_run(user_id, run_id, int(datatype), body, job)
+            return
+
+        # reject invalid requests before any disk or subprocess work
+        try:
+            validate_request(body)
+        except RequestValidationException as exp:
+            logger.warning(f"Invalid request {run_id}: {exp}")
+            runner = PropagatorRunHandler(user_id, run_id, {}, datatype_id=int(datatype))
+            runner.send_error_message('VALIDATION_ERROR', status_code=400, type='end', details=exp.errors)
+            return
+
+        try:
+            # in use from its creation, so that it isn't evicted before the run starts
+            with get_lifecycle_manager().running(run_dir(run_id, datatype)):
+                write_message_file(run_id, datatype, body)
+
+                logger.info(f"run_id: {run_id}")
+
+                data = parse_request_body(body)
+                runner = PropagatorRunHandler(user_id, run_id, data, datatype_id=int(datatype), retry_job=job)
+                runner.run_propagator()
+        except Exception as exp:
+            # the request is already acked: retried if the failure is transient, dead-lettered otherwise
+            logger.exception(f"Error handling request {run_id}")
+            get_retry_queue().retry(job, classify_exception(exp, RetryStage.RUN), f'{run_id} error: {exp}', exp)
 
 
 def main():
     config = RabbitMQConfig()
-    logging.info(f"Connecting to {config.RMQ_HOST}:{config.RMQ_PORT}/{config.RMQ_VHOST}")
+    get_lifecycle_manager()
+    retry_queue = get_retry_queue()
+    supervisor = get_run_supervisor()
+    start_cancellation_listener()
+    # SIGTERM (e.g. a deploy) drains the node instead of killing the runs in progress
+    signal.signal(signal.SIGTERM, supervisor.drain)
+    logger.info(f"Connecting to {config.RMQ_HOST}:{config.RMQ_PORT}/{config.RMQ_VHOST}")
 
     # set credentials and SSL params
     credentials = pika.PlainCredentials(config.RMQ_USERNAME, config.RMQ_PASSWORD)
@@ -70,22 +184,220 @@ def main():
 
     # create a connection instance and then close it, or use the 'with' scope
     with pika.BlockingConnection(parameters=params) as conn:
-        # create channel to the broker
+        # create channel to the broker, one unacknowledged request at a time
         channel = conn.channel()
+        channel.basic_qos(prefetch_count=1)
+        # upload retries run between the callbacks, one run at a time on this node
+        retry_queue.handoff = conn.add_callback_threadsafe
 
         # bind the keys we need to the exchange and predefined queues
         channel.exchange_declare(config.RMQ_EXCHANGE, exchange_type="topic", passive=True)
         
         #channel.queue_bind(queue=config.RMQ_QUEUE, exchange=config.RMQ_EXCHANGE, routing_key=BINDING_KEY)
-        logging.info("Waiting for messages")
+        logger.info("Waiting for messages")
+
+        def check_drain():
+            # runs between callbacks: the run in progress, if any, is over
+            if supervisor.draining:
+                logger.info("Drained, not consuming anymore")
+                channel.stop_consuming()
+            else:
+                conn.call_later(DRAIN_CHECK_INTERVAL, check_drain)
 
         try:
             # start listening and consuming messages
-            channel.basic_consume(queue=config.RMQ_QUEUE, on_message_callback=callback, auto_ack=True)
+            channel.basic_consume(queue=config.RMQ_QUEUE, on_message_callback=callback, auto_ack=False)
+            conn.call_later(DRAIN_CHECK_INTERVAL, check_drain)
             channel.start_consuming()
         except KeyboardInterrupt:
             channel.stop_consuming()
 
 
+async def async_derive_run(client, session, user_id: str, run_id: str, datatype_id: int, body, job: RetryJob):
+    """
+    asyncio counterpart of derive_run
+    """
+    from propagator.async_run_handler import AsyncPropagatorRunHandler
+
+    loop = asyncio.get_running_loop()
+    try:
+        overrides = validate_derive_request(body)
+    except RequestValidationException as exp:
+        logger.warning(f"Invalid derive request {run_id}: {exp}")
+        runner = AsyncPropagatorRunHandler(user_id, run_id, {}, datatype_id=datatype_id, client=client, session=session)
+        await runner.send_error_message_async('VALIDATION_ERROR', status_code=400, type='end', details=exp.errors)
+        return
+
+    stored_run = await loop.run_in_executor(None, find_stored_run, run_id)
+    if stored_run is None:
+        logger.warning(f"Derive request {run_id}: run not stored on this node")
+        runner = AsyncPropagatorRunHandler(user_id, run_id, {}, datatype_id=datatype_id, client=client, session=session)
+        await runner.send_error_message_async('RUN_NOT_FOUND', status_code=404, type='end')
+        return
+
+    try:
+        params = await loop.run_in_executor(None, derive_params, stored_run, overrides)
+        runner = AsyncPropagatorRunHandler(user_id, run_id, params, datatype_id=datatype_id, retry_job=job,
+                                           stored_run=stored_run, client=client, session=session)
+        await runner.derive_products_async()
+    except Exception as exp:
+        logger.exception(f"Error deriving {run_id}")
+        await loop.run_in_executor(None, get_retry_queue().retry, job,
+                                   classify_exception(exp, RetryStage.RUN), f'{run_id} error: {exp}', exp)
+
+
+async def async_callback(client, session, message):
+    """
+    asyncio counterpart of callback: blocking work runs in the default executor
+    """
+    from propagator.async_run_handler import AsyncPropagatorRunHandler
+
+    user_id = message.user_id
+    routing_key: str = message.routing_key
+    body = message.body
+
+    logger.info(f"Received message: user_id: {user_id}, routing_key: {routing_key}")
+
+    _, datatype, *run_id = routing_key.split('.')
+    if int(datatype) not in SUPPORTED_DATA_TYPES: return
+
+    run_id = '.'.join(run_id)
+    job = RetryJob.from_delivery(routing_key, user_id, body, int(datatype), message.headers)
+    user_id = job.user_id
+    with run_context(run_id), span('callback', headers=message.headers, run_id=run_id, routing_key=routing_key) as root_span:
+        record_queue_latency(root_span, message.timestamp)
+        loop = asyncio.get_running_loop()
+
+        if is_derive_request(routing_key):
+            await async_derive_run(client, session, user_id, run_id, int(datatype), body, job)
+            return
+
+        try:
+            await loop.run_in_executor(None, validate_request, body)
+        except RequestValidationException as exp:
+            logger.warning(f"Invalid request {run_id}: {exp}")
+            runner = AsyncPropagatorRunHandler(user_id, run_id, {}, datatype_id=int(datatype), client=client, session=session)
+            await runner.send_error_message_async('VALIDATION_ERROR', status_code=400, type='end', details=exp.errors)
+            return
+
+        try:
+            # in use from its creation, so that it isn't evicted before the run starts
+            with get_lifecycle_manager().running(run_dir(run_id, datatype)):
+                await loop.run_in_executor(None, write_message_file, run_id, datatype, body)
+
+                logger.info(f"run_id: {run_id}")
+
+                data = await loop.run_in_executor(None, parse_request_body, body)
+                runner = AsyncPropagatorRunHandler(user_id, run_id, data, datatype_id=int(datatype), retry_job=job,
+                                                   client=client, session=session)
+                await runner.run_propagator_async()
+        except Exception as exp:
+            logger.exception(f"Error handling request {run_id}")
+            await loop.run_in_executor(None, get_retry_queue().retry, job,
+                                       classify_exception(exp, RetryStage.RUN), f'{run_id} error: {exp}', exp)
+
+
+async def async_main():
+    """
+    asyncio runtime: one event loop consumes, supervises up to MAX_CONCURRENT_RUNS
+    simulations, publishes on a single channel and uploads with an async HTTP client.
+    The prefetch count is MAX_CONCURRENT_RUNS and a message is acked once its request is
+    handled, so the requests of a node that dies are redelivered (the broker consumer
+    timeout must be longer than a run). A request is requeued if the node doesn't have
+    the memory and disk expected for a run. On SIGTERM no message is taken anymore and
+    the runs in progress are drained.
+    """
+    import aiohttp
+
+    from framework.async_pika_client import AsyncPikaClient
+
+    config = RabbitMQConfig()
+    get_lifecycle_manager()
+    get_retry_queue()
+    supervisor = get_run_supervisor()
+    loop = asyncio.get_running_loop()
+    logger.info(f"Connecting to {config.RMQ_HOST}:{config.RMQ_PORT}/{config.RMQ_VHOST}")
+
+    tasks = set()
+    # refused requests waiting to be requeued
+    requeues = set()
+
+    async def handle(message):
+        try:
+            await async_callback(client, session, message)
+        except Exception:
+            logger.exception(f"Error handling message {message.routing_key}")
+        finally:
+            try:
+                await message.ack()
+            except Exception as exp:
+                logger.warning(f"Message {message.routing_key} not acked: {exp}")
+
+    async def on_cancel(message):
+        await loop.run_in_executor(None, on_cancel_message, message.routing_key)
+
+    async def requeue(message):
+        # the message holds its prefetch slot until it's requeued, the next ones are consumed meanwhile
+        await asyncio.sleep(ResourceLimitsConfig.ADMISSION_RETRY_DELAY)
+        try:
+            await message.nack(requeue=True)
+        except Exception as exp:
+            logger.warning(f"Message {message.routing_key} not requeued: {exp}")
+
+    def start(coroutine, pending: set):
+        task = asyncio.create_task(coroutine)
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    async def consume(queue):
+        async with queue.iterator() as messages:
+            async for message in messages:
+                # derive requests don't simulate
+                reason = None if is_derive_request(message.routing_key) else check_admission()
+                if reason is not None:
+                    logger.warning(f"Request {message.routing_key} not admitted: {reason}")
+                    start(requeue(message), requeues)
+                    continue
+
+                start(handle(message), tasks)
+
+    def drain():
+        supervisor.drain()
+        # the messages prefetched and not handled are requeued
+        consumer.cancel()
+
+    async with AsyncPikaClient(prefetch_count=PropagatorConfig.MAX_CONCURRENT_RUNS) as client, \
+            aiohttp.ClientSession() as session:
+        await client.get_exchange(config.RMQ_EXCHANGE)
+        await client.subscribe(config.RMQ_EXCHANGE, RunControlConfig.CANCEL_ROUTING_KEY + '.#', on_cancel)
+        queue = await client.get_queue(config.RMQ_QUEUE)
+        logger.info("Waiting for messages")
+
+        consumer = asyncio.create_task(consume(queue))
+        loop.add_signal_handler(signal.SIGTERM, drain)
+        try:
+            await consumer
+        except asyncio.CancelledError:
+            pass
+
+        # the supervisor stops the runs still in progress after the drain timeout
+        logger.info(f"Draining {len(tasks)} runs")
+        if tasks:
+            await asyncio.wait(tasks)
+        logger.info("Drained, not consuming anymore")
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='PROPAGATOR Intelligent Service')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='run the asyncio runtime (requires aio-pika and aiohttp)')
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.use_async:
+        try:
+            asyncio.run(async_main())
+        except KeyboardInterrupt:
+            pass
+    else:
+        main()
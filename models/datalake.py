@@ -1,9 +1,15 @@
 import json
 import logging
 import uuid
-from dataclasses import asdict, dataclass, field, is_dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
+try:
+    # optional, faster serialization of the metadata
+    import orjson
+except ImportError:
+    orjson = None
+
 PRIVATE = True
 IDENTIFICATION_RESOURCE_TYPE = "dataset"
 DATATYPE_ID = 35005
@@ -35,17 +41,58 @@ COORDINATE_SYSTEM_REFERENCE_CODE = "4326"
 COORDINATESYSTEMREFERENCE_CODESPACE ="EPSG"
 CHARACTER_ENCODING ="UTF-8"
 
-class DatalakeJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if is_dataclass(o):
-            return asdict(o)
-        if isinstance(o, datetime):
-            return o.isoformat()
+# constant fields of the package metadata, shared by all the runs
+PACKAGE_TEMPLATE = {
+    "private": PRIVATE,
+    "owner_org": OWNER_ORG,
+    "identification_ResourceType": IDENTIFICATION_RESOURCE_TYPE,
+    "identification_CoupledResource": IDENTIFICATION_COUPLED_RESOURCE,
+    "identification_ResourceLanguage": IDENTIFICATION_RESOURCE_LANGUAGE,
+    "classification_TopicCategory": CLASSIFICATION_TOPIC_CATEGORY,
+    "classification_SpatialDataServiceType": CLASSIFICATION_SPATIAL_DATA_SERVICE_TYPE,
+    "keyword_KeywordValue": KEYWORD_KEYWORD_VALUE,
+    "keyword_OriginatingControlledVocabulary": KEYWORD_ORIGINATING_CONTROLLED_VOCABULARY,
+    "quality_and_validity_lineage": QUALITY_AND_VALIDITY_LINEAGE,
+    "quality_and_validity_spatial_resolution_latitude": QUALITY_AND_VALIDITY_SPATIAL_RESOLUTION_LATITUDE,
+    "quality_and_validity_spatial_resolution_longitude": QUALITY_AND_VALIDITY_SPATIAL_RESOLUTION_LONGITUDE,
+    "quality_and_validity_spatial_resolution_scale": QUALITY_AND_VALIDITY_SPATIAL_RESOLUTION_SCALE,
+    "quality_and_validity_spatial_resolution_measureunit": QUALITY_AND_VALIDITY_SPATIAL_RESOLUTION_MEASUREUNIT,
+    "conformity_specification_title": CONFORMITY_SPECIFICATION_TITLE,
+    "conformity_specification_dateType": CONFORMITY_SPECIFICATION_DATETYPE,
+    "conformity_specification_date": CONFORMITY_SPECIFICATION_DATE,
+    "conformity_degree": CONFORMITY_DEGREE,
+    "constraints_conditions_for_access_and_use": CONSTRAINTS_CONDITIONS_FOR_ACCESS_AND_USE,
+    "constraints_limitation_on_public_access": CONSTRAINTS_LIMITATION_ON_PUBLIC_ACCESS,
+    "responsable_organization_name": RESPONSABLE_ORGANIZATION_NAME,
+    "responsable_organization_email": RESPONSABLE_ORGANIZATION_EMAIL,
+    "responsable_organization_role": RESPONSABLE_ORGANIZATION_ROLE,
+    "point_of_contact_name": POINT_OF_CONTACT_NAME,
+    "point_of_contact_email": POINT_OF_CONTACT_EMAIL,
+    "metadata_language": METADATA_LANGUAGE,
+    "coordinatesystemreference_code": COORDINATE_SYSTEM_REFERENCE_CODE,
+    "coordinatesystemreference_codespace": COORDINATESYSTEMREFERENCE_CODESPACE,
+    "character_encoding": CHARACTER_ENCODING,
+}
+
+
+def isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def dumps(data: dict) -> bytes:
+    """
+    Serializes a metadata dict to json bytes, with orjson if available
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
 
-        return super().default(o)
 
 @dataclass
 class DatalakeMetadata:
+    """
+    Variable fields of the package metadata of a run, merged into PACKAGE_TEMPLATE when serialized
+    """
     name: str = field(init=False, default_factory=lambda: str(uuid.uuid4()))
 
     title: str = field(init=True)
@@ -60,48 +107,32 @@ class DatalakeMetadata:
 
     external_attributes: dict = field(default_factory=dict, init=True)
 
-    private: bool = field(default=PRIVATE, init=False)
     datatype_id: int = field(default=DATATYPE_ID, init=True)
-    owner_org: str = field(default=OWNER_ORG, init=False)
-
-    identification_ResourceType: str = field(default=IDENTIFICATION_RESOURCE_TYPE, init=False)
-    identification_CoupledResource: str = field(default=IDENTIFICATION_COUPLED_RESOURCE, init=False)
-    identification_ResourceLanguage: str = field(default=IDENTIFICATION_RESOURCE_LANGUAGE, init=False)
-    classification_TopicCategory: str = field(default=CLASSIFICATION_TOPIC_CATEGORY, init=False)
-    classification_SpatialDataServiceType: str = field(default=CLASSIFICATION_SPATIAL_DATA_SERVICE_TYPE, init=False)
-    keyword_KeywordValue: str = field(default=KEYWORD_KEYWORD_VALUE, init=False)
-    keyword_OriginatingControlledVocabulary: str = field(default=KEYWORD_ORIGINATING_CONTROLLED_VOCABULARY, init=False)
-    quality_and_validity_lineage: str = field(default=QUALITY_AND_VALIDITY_LINEAGE, init=False)
-    quality_and_validity_spatial_resolution_latitude: int = field(default=QUALITY_AND_VALIDITY_SPATIAL_RESOLUTION_LATITUDE, init=False)
-    quality_and_validity_spatial_resolution_longitude: int = field(default=QUALITY_AND_VALIDITY_SPATIAL_RESOLUTION_LONGITUDE, init=False)
-    quality_and_validity_spatial_resolution_scale: int = field(default=QUALITY_AND_VALIDITY_SPATIAL_RESOLUTION_SCALE, init=False)
-    quality_and_validity_spatial_resolution_measureunit: str = field(default=QUALITY_AND_VALIDITY_SPATIAL_RESOLUTION_MEASUREUNIT, init=False)
-    conformity_specification_title: str = field(default=CONFORMITY_SPECIFICATION_TITLE, init=False)
-    conformity_specification_dateType: str = field(default=CONFORMITY_SPECIFICATION_DATETYPE, init=False)
-    conformity_specification_date: datetime = field(default=CONFORMITY_SPECIFICATION_DATE, init=False)
-    conformity_degree: bool = field(default=CONFORMITY_DEGREE, init=False)
-    constraints_conditions_for_access_and_use: str = field(default=CONSTRAINTS_CONDITIONS_FOR_ACCESS_AND_USE, init=False)
-    constraints_limitation_on_public_access: str = field(default=CONSTRAINTS_LIMITATION_ON_PUBLIC_ACCESS, init=False)
-    responsable_organization_name: str = field(default=RESPONSABLE_ORGANIZATION_NAME, init=False)
-    responsable_organization_email: str = field(default=RESPONSABLE_ORGANIZATION_EMAIL, init=False)
-    responsable_organization_role: str = field(default=RESPONSABLE_ORGANIZATION_ROLE, init=False)
-    point_of_contact_name: str = field(default=POINT_OF_CONTACT_NAME, init=False)
-    point_of_contact_email: str = field(default=POINT_OF_CONTACT_EMAIL, init=False)
-    metadata_language: str = field(default=METADATA_LANGUAGE, init=False)
-    coordinatesystemreference_code: int = field(default=COORDINATE_SYSTEM_REFERENCE_CODE, init=False)
-    coordinatesystemreference_codespace: str = field(default=COORDINATESYSTEMREFERENCE_CODESPACE, init=False)
-    character_encoding: str = field(default=CHARACTER_ENCODING, init=False)
-    
-
-
-    def as_json_string(self):
-        json_string = json.dumps(self, cls=DatalakeJSONEncoder)
-        return json_string
-
-    def as_json_dict(self):
-        data = json.loads(self.as_json_string())
+
+    def as_json_dict(self) -> dict:
+        data = {
+            "name": self.name,
+            "title": self.title,
+            "notes": self.notes,
+            "data_temporal_extent_begin_date": isoformat(self.data_temporal_extent_begin_date),
+            "data_temporal_extent_end_date": isoformat(self.data_temporal_extent_end_date),
+            "temporalReference_dateOfPublication": isoformat(self.temporalReference_dateOfPublication),
+            "temporalReference_dateOfLastRevision": isoformat(self.temporalReference_dateOfLastRevision),
+            "temporalReference_dateOfCreation": isoformat(self.temporalReference_dateOfCreation),
+            "temporalReference_date": isoformat(self.temporalReference_date),
+            "spatial": self.spatial,
+            "external_attributes": self.external_attributes,
+            "datatype_id": self.datatype_id,
+        }
+        data.update(PACKAGE_TEMPLATE)
         return data
 
+    def as_json_bytes(self) -> bytes:
+        return dumps(self.as_json_dict())
+
+    def as_json_string(self) -> str:
+        return self.as_json_bytes().decode()
+
 @dataclass
 class DatalakeResourceMetadata:
     notes:str = field(init=True)
@@ -113,11 +144,20 @@ class DatalakeResourceMetadata:
     request_code: str = field(init=True)
     datatype_resource: str = field(init=True)
 
-    def as_json_string(self):
-        json_string = json.dumps(self, cls=DatalakeJSONEncoder)
-        return json_string
+    def as_json_dict(self) -> dict:
+        return {
+            "notes": self.notes,
+            "package_id": self.package_id,
+            "file_date_start": isoformat(self.file_date_start),
+            "file_date_end": isoformat(self.file_date_end),
+            "name": self.name,
+            "format": self.format,
+            "request_code": self.request_code,
+            "datatype_resource": self.datatype_resource,
+        }
 
-    def as_json_dict(self):
-        data = json.loads(self.as_json_string())
-        return data
+    def as_json_bytes(self) -> bytes:
+        return dumps(self.as_json_dict())
 
+    def as_json_string(self) -> str:
+        return self.as_json_bytes().decode()
@@ -0,0 +1,284 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import aiohttp
+
+from config import PropagatorConfig
+from framework.async_data_uploader import (add_resources, patch_package,
+                                           publish)
+from framework.async_pika_client import AsyncPikaClient
+from framework.tracing import inject, span, traced
+from propagator.lifecycle import get_lifecycle_manager
+from propagator.resources import run_limits
+from propagator.retry import RetryStage, classify_exception, classify_exit
+from propagator.run_handler import PropagatorRunHandler, Product, UpdateType
+from propagator.supervisor import get_run_supervisor, run_timeout
+from propagator.wrapper import exit_error_code
+
+logger = logging.getLogger(__name__)
+
+STATUS_EXCHANGE = 'safers.b2b'
+
+
+@dataclass
+class AsyncPropagatorRunHandler(PropagatorRunHandler):
+    """
+    asyncio counterpart of PropagatorRunHandler: PROPAGATOR is supervised with
+    asyncio.create_subprocess_exec, messages are published on the shared client
+    and the blocking geo post-processing runs in the default executor.
+    """
+    client: AsyncPikaClient = field(default=None)
+    session: aiohttp.ClientSession = field(default=None)
+
+    def message_properties(self) -> dict:
+        return dict(
+            content_type=self._message_properties.content_type,
+            content_encoding=self._message_properties.content_encoding,
+            user_id=self._message_properties.user_id,
+            app_id=self._message_properties.app_id,
+            delivery_mode=self._message_properties.delivery_mode,
+            message_id=self._message_properties.message_id,
+            headers=inject(self._message_properties.headers),
+        )
+
+    def run_in_executor(self, function, *args):
+        """
+        Runs a blocking function in the default executor, in the current context (run_id, trace)
+        """
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, function, *args))
+
+    async def send_message_async(self,
+        message: str,
+        status_code: int=200,
+        datatype_id: int=None,
+        type: UpdateType='update',
+        urls:List[str]=[],
+        routing_key=None,
+        details:List[dict]=None
+        ):
+        """
+        Sends a message to the bus on the shared channel, see PropagatorRunHandler.send_message
+        """
+        routing_key, message = self.build_message(
+            message, status_code, datatype_id, type, urls, routing_key, details)
+        logger.info('Sending message on %s: %s', routing_key, message)
+
+        with span('send_message', routing_key=routing_key):
+            await self.client.write_message(
+                STATUS_EXCHANGE,
+                routing_key=routing_key,
+                message=json.dumps(message),
+                properties=self.message_properties()
+            )
+
+    async def send_error_message_async(self,
+        message: str,
+        exp:Exception=None,
+        status_code: int=500,
+        type: UpdateType = 'end',
+        details:List[dict]=None):
+        if exp is not None:
+            message = f'{message}: {exp}'
+
+        await self.send_message_async(message, status_code=status_code, type=type, details=details)
+
+    async def retry_or_fail_async(self, message: str, stage: Optional[RetryStage], exp: Exception = None):
+        """
+        Schedules the retry of a failed stage of the run, or ends the run with an error,
+        see PropagatorRunHandler.retry_or_fail
+        """
+        if exp is not None:
+            message = f'{message}: {exp}'
+
+        if self.retry_job is None:
+            await self.send_error_message_async(message, type='end')
+        elif await self.run_in_executor(self.schedule_retry, message, stage, exp):
+            await self.send_message_async(f'{message}, retrying', status_code=500, type='update')
+
+    async def notify_products_async(self, product_files: List[Tuple[Product, str]], urls: List[str]):
+        """
+        Notifies the products of the run and its end, see PropagatorRunHandler.notify_products
+        """
+        for message in self.completion_messages(product_files, urls):
+            await self.send_message_async(**message)
+
+    async def end_stopped_run_async(self, reason: str):
+        """
+        Ends a run stopped by the supervisor, see PropagatorRunHandler.stopped_run
+        """
+        self.failed = True
+        status = await self.run_in_executor(self.stopped_run, reason)
+        if status is not None:
+            message, status_code, type = status
+            await self.send_message_async(message, status_code=status_code, type=type)
+
+    @traced('run_end_callback')
+    async def run_end_callback_async(self):
+        """
+        Post-processes and uploads the outputs of the run, see PropagatorRunHandler.run_end_callback
+        """
+        if self.failed:
+            return
+
+        # a previous attempt may have published the products and failed to notify them
+        package = None
+        if self.retry_job is not None and self.retry_job.stage == RetryStage.UPLOAD.value:
+            package = await self.run_in_executor(self.load_package)
+
+        if package is None:
+            try:
+                isochrones_gdf, isochrone_file, footprint_geojson = await self.run_in_executor(self.prepare_isochrones)
+
+            except ValueError:
+                await self.send_error_message_async('LOW_PROBABILITY', type='end', status_code=500)
+                return
+
+        try:
+            if package is None:
+                product_files = await self.run_in_executor(
+                    self.prepare_product_files, isochrones_gdf, isochrone_file)
+
+                with span('upload', files=len(product_files)):
+                    metadata_id, urls = await publish(
+                        self.session, self.build_metadata(footprint_geojson), self.resource_files(product_files))
+                await self.run_in_executor(self.save_package, metadata_id, product_files, urls, footprint_geojson)
+            else:
+                product_files, urls = self.published_products(package)
+
+            await self.notify_products_async(product_files, urls)
+            self.compact_outputs(product_files)
+
+        except Exception as exp:
+            # upload retries run on the retry queue, from the outputs left on disk
+            await self.retry_or_fail_async(f'{self.run_id} error', classify_exception(exp, RetryStage.UPLOAD), exp)
+
+    @traced('derive_products')
+    async def derive_products_async(self):
+        """
+        Computes the products of the stored run for the parameters of the request and adds
+        them to its datalake package, see PropagatorRunHandler.derive_products
+        """
+        with get_lifecycle_manager().running(self.output_dir):
+            restored = not os.path.isdir(self.output_dir)
+            package = await self.run_in_executor(self.restore_stored_run)
+            if package is None:
+                await self.send_error_message_async('OUTPUTS_NOT_AVAILABLE', type='end', status_code=404)
+                return
+
+            derived = None
+            try:
+                derived = await self.publish_derived_products_async(package)
+            finally:
+                await self.run_in_executor(self.release_stored_run, restored, derived)
+
+    async def publish_derived_products_async(self, package: dict) -> Optional[dict]:
+        """
+        see PropagatorRunHandler.publish_derived_products
+        """
+        try:
+            isochrones_gdf, isochrone_file, footprint_geojson = await self.run_in_executor(self.prepare_isochrones)
+        except ValueError:
+            await self.send_error_message_async('LOW_PROBABILITY', type='end', status_code=500)
+            return None
+
+        try:
+            product_files, (published_files, published_urls) = await self.run_in_executor(
+                self.derive_product_files, package, isochrones_gdf, isochrone_file)
+
+            derived, urls = None, []
+            if product_files:
+                spatial = self.extended_extent(package, footprint_geojson)
+                with span('upload', files=len(product_files)):
+                    if spatial is not None:
+                        await patch_package(self.session, package['package_id'], spatial=spatial)
+                    urls = await add_resources(self.session, package['package_id'], self.resource_files(product_files))
+                derived = await self.run_in_executor(self.add_derived_products, package, product_files, urls, spatial)
+
+            await self.notify_products_async(published_files + product_files, published_urls + urls)
+            return derived
+
+        except Exception as exp:
+            await self.retry_or_fail_async(f'{self.run_id} error', classify_exception(exp, RetryStage.RUN), exp)
+            return None
+
+    async def _read_stdout(self, stream: asyncio.StreamReader):
+        async for line in stream:
+            line = line.decode(errors='replace')
+            logger.debug(line)
+            self.run_progress_callback(line)
+
+    async def run_propagator_async(self):
+        """
+        Runs PROPAGATOR as an asyncio subprocess, then post-processes its outputs
+        """
+        with span('run_propagator', run_id=self.run_id, datatype=self.datatype_id):
+            await self._run_propagator_async()
+
+    async def _run_propagator_async(self):
+        with get_lifecycle_manager().running(self.output_dir):
+            if await self.run_in_executor(self.reuse_simulation):
+                await self.run_end_callback_async()
+                return
+
+        param_file = await self.run_in_executor(self.write_param_file)
+        program_cmd = self.build_command(param_file)
+        logger.info(f'Executing command: {" ".join(program_cmd)}')
+
+        timeout = run_timeout((self.end_date - self.start_date).total_seconds() / 60)
+        with self.using_static_data(), \
+                get_lifecycle_manager().running(self.output_dir), \
+                get_run_supervisor().supervise(self.run_id, timeout) as self.control:
+            if self.control.stop_reason is not None:
+                # cancelled before it started
+                await self.end_stopped_run_async(self.control.stop_reason)
+                return
+
+            started = False
+            try:
+                with span('simulation') as simulation_span, run_limits() as limits:
+                    process = await asyncio.create_subprocess_exec(
+                        *program_cmd,
+                        cwd=PropagatorConfig.PROPAGATOR_DIR,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE
+                    )
+                    try:
+                        limits.apply(process.pid)
+                    except Exception:
+                        # not left running without its limits and unsupervised
+                        process.kill()
+                        await process.wait()
+                        raise
+                    started = True
+                    # the supervisor signals the process from its own thread
+                    loop = asyncio.get_running_loop()
+                    self.control.attach(lambda sig: loop.call_soon_threadsafe(process.send_signal, sig))
+                    # read both pipes concurrently so a full stderr pipe can't block the child
+                    _, stderr = await asyncio.gather(self._read_stdout(process.stdout), process.stderr.read())
+                    returncode = await process.wait()
+                    if simulation_span is not None:
+                        simulation_span.set_attribute('returncode', returncode)
+
+                if self.control.stop_reason is not None:
+                    await self.end_stopped_run_async(self.control.stop_reason)
+                elif returncode != 0:
+                    stderr = stderr.decode(errors='replace')
+                    logger.warning('Error in simulation:\n{}'.format(stderr))
+                    error_code = exit_error_code(returncode)
+                    self.failed = True
+                    await self.retry_or_fail_async(
+                        f'{self.run_id} error: Error running simulation: {error_code.name}',
+                        classify_exit(error_code, returncode, stderr))
+
+            finally:
+                # a simulation that didn't start has no outputs, the caller retries or
+                # dead-letters the request and ends the run
+                if started:
+                    await self.run_end_callback_async()
@@ -0,0 +1,71 @@
+import json
+from typing import List, Tuple
+
+import numpy as np
+from shapely.geometry import MultiPolygon, Polygon, shape
+
+# fill value of the cells never reached
+NOT_REACHED = -1
+
+
+def contour_polygons(geometry: dict) -> MultiPolygon:
+    """
+    Returns the area enclosed by an isochrone, written as a MultiLineString of rings
+    """
+    return MultiPolygon([Polygon(ring) for ring in shape(geometry).geoms])
+
+
+def read_contours(isochrone_files: List[Tuple[int, str]], value_field: str = 'value') -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reads the isochrones of all the timesteps
+    @param isochrone_files: (minutes, path) of each timestep
+    @param value_field: property with the probability of the contour
+    @return: arrays of contour polygons, times (minutes) and probabilities
+    """
+    polygons, times, values = [], [], []
+    for minutes, path in isochrone_files:
+        with open(path) as fp:
+            collection = json.load(fp)
+        for feature in collection['features']:
+            polygons.append(contour_polygons(feature['geometry']))
+            times.append(minutes)
+            values.append(feature['properties'][value_field])
+
+    return np.asarray(polygons, dtype=object), np.asarray(times, dtype=np.int32), np.asarray(values, dtype=np.float32)
+
+
+def rasterize_ordered(polygons: np.ndarray, values: np.ndarray, descending: bool,
+                      out_shape: tuple, transform, fill: float) -> np.ndarray:
+    """
+    Rasterizes the polygons in one pass, keeping the lowest (or highest) value per cell: the
+    shapes are burnt in sorted order with replace, so that the value to keep is burnt last
+    """
+    from rasterio import features
+
+    order = np.argsort(values, kind='stable')
+    if not descending:
+        # lowest value last
+        order = order[::-1]
+
+    return features.rasterize(
+        zip(polygons[order], values[order].tolist()),
+        out_shape=out_shape,
+        fill=fill,
+        transform=transform,
+        all_touched=True,
+        dtype=values.dtype
+    )
+
+
+def first_arrival(polygons: np.ndarray, times: np.ndarray, out_shape: tuple, transform) -> np.ndarray:
+    """
+    @return: first time (minutes) each cell is inside a contour, NOT_REACHED elsewhere
+    """
+    return rasterize_ordered(polygons, times, False, out_shape, transform, NOT_REACHED)
+
+
+def max_probability(polygons: np.ndarray, values: np.ndarray, out_shape: tuple, transform) -> np.ndarray:
+    """
+    @return: highest probability of the contours covering each cell, 0 elsewhere
+    """
+    return rasterize_ordered(polygons, values, True, out_shape, transform, 0)
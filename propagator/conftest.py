@@ -0,0 +1,62 @@
+"""
+The original implementation of the propagator strings, which PROPAGATOR parses, and of
+their parser: the optimized code must give the same results
+"""
+from types import SimpleNamespace
+
+import pytest
+
+
+def geometry_string(coordinates, geometry_type):
+    propagator_type = {'Point': 'POINT', 'LineString': 'LINE', 'Polygon': 'POLYGON'}[geometry_type]
+    if propagator_type == 'POINT':
+        lon, lat = coordinates
+        return f'{propagator_type}:{lat};{lon}'
+    if propagator_type == 'POLYGON':
+        # skip holes
+        coordinates = coordinates[0]
+    lons, lats = list(zip(*coordinates))
+    return f"{propagator_type}: [{' '.join(map(str, lats))}];[{' '.join(map(str, lons))}]"
+
+
+def propagator_strings(feature):
+    if feature['type'] in ('GeometryCollection', 'FeatureCollection'):
+        return [string for child in feature['geometries'] for string in propagator_strings(child)]
+    multi = {'MultiPolygon': 'Polygon', 'MultiLineString': 'LineString', 'MultiPoint': 'Point'}
+    if feature['type'] in multi:
+        return [geometry_string(part, multi[feature['type']]) for part in feature['coordinates']]
+    return [geometry_string(feature['coordinates'], feature['type'])]
+
+
+def read_actions(imp_points_string):
+    strings = imp_points_string.split('\n')
+
+    polys, lines, points = [], [], []
+
+    for s in strings:
+        f_type, values = s.split(':')
+        values = values.replace('[', '').replace(']', '')
+        if f_type == 'POLYGON':
+            s_lats, s_lons = values.split(';')
+            lats = [float(sv) for sv in s_lats.split()]
+            lons = [float(sv) for sv in s_lons.split()]
+            polys.append((lats, lons))
+
+        elif f_type == 'LINE':
+            s_lats, s_lons = values.split(';')
+            lats = [float(sv) for sv in s_lats.split()]
+            lons = [float(sv) for sv in s_lons.split()]
+            lines.append((lats, lons))
+
+        elif f_type == 'POINT':
+            s_lat, s_lon = values.split(';')
+            lat, lon = float(s_lat), float(s_lon)
+            points.append((lat, lon))
+
+    return polys, lines, points
+
+
+@pytest.fixture
+def original():
+    return SimpleNamespace(geometry_string=geometry_string, propagator_strings=propagator_strings,
+                           read_actions=read_actions)
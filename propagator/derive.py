@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+from typing import Optional
+
+from config import DeriveConfig, PropagatorConfig
+from propagator.lifecycle import (MESSAGE_FILE, PACKAGE_FILE, read_run_file,
+                                  run_entries)
+from propagator.utils import parse_request_body
+from propagator.validation import RequestValidationException
+
+logger = logging.getLogger(__name__)
+
+# request parameters a derive request can change, the others are those of the stored run
+DERIVE_PARAMETERS = ('probabilityRange',)
+
+
+def is_derive_request(routing_key: str) -> bool:
+    return routing_key.split('.', 1)[0] == DeriveConfig.ROUTING_KEY
+
+
+def validate_derive_request(body) -> dict:
+    """
+    Validates the body of a derive request
+    @param body: raw message body, a json object with the parameters to change
+    @return: the parameters to change
+    @raise RequestValidationException: with the list of errors found
+    """
+    try:
+        data = json.loads(body or '{}')
+    except ValueError as exp:
+        raise RequestValidationException([{'field': 'body', 'error': f'invalid json: {exp}'}])
+    if not isinstance(data, dict):
+        raise RequestValidationException([{'field': 'body', 'error': 'not a json object'}])
+
+    errors = [
+        {'field': field, 'error': f'not a derive parameter, expected one of {", ".join(DERIVE_PARAMETERS)}'}
+        for field in data if field not in DERIVE_PARAMETERS
+    ]
+    probability = data.get('probabilityRange')
+    if probability is not None:
+        if isinstance(probability, bool) or not isinstance(probability, (int, float)) or not 0 < probability <= 1:
+            errors.append({'field': 'probabilityRange', 'error': f'not a probability: {probability}'})
+        else:
+            # the products are named after it, e.g. isochrone_1.0.geojson
+            data['probabilityRange'] = float(probability)
+    if errors:
+        raise RequestValidationException(errors)
+    return data
+
+
+def find_stored_run(run_id: str) -> Optional[str]:
+    """
+    Returns the run directory of a published run, compacted or not, preferring the ones not
+    compacted (they keep every timestep)
+    @return: the run directory, None if the run is not stored on this node
+    """
+    entries = sorted(run_entries(PropagatorConfig.WORK_DIR, run_id), key=lambda run_dir: not os.path.isdir(run_dir))
+    for run_dir in entries:
+        try:
+            if read_run_file(run_dir, PACKAGE_FILE) is not None and read_run_file(run_dir, MESSAGE_FILE) is not None:
+                return run_dir
+        except Exception as exp:
+            logger.warning(f'Run {run_dir} not readable: {exp}')
+    return None
+
+
+def derive_params(run_dir: str, overrides: dict) -> dict:
+    """
+    Returns the parameters of a stored run, with the ones changed by the derive request
+    """
+    params = parse_request_body(read_run_file(run_dir, MESSAGE_FILE))
+    params.update(overrides)
+    return params
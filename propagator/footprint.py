@@ -0,0 +1,98 @@
+import logging
+from typing import Sequence
+
+import numpy as np
+import shapely
+from shapely.errors import UnsupportedGEOSVersionError
+
+logger = logging.getLogger(__name__)
+
+FOOTPRINT_METHODS = ('bbox', 'convex', 'concave')
+
+# simplification attempts before falling back to the bounding box
+MAX_SIMPLIFY_STEPS = 20
+
+# tolerance of the simplifications, relative to the extent of the isochrones
+RELATIVE_TOLERANCE = 1e-3
+
+
+def count_vertices(geometry: shapely.Geometry) -> int:
+    return int(shapely.get_num_coordinates(geometry))
+
+
+def hull(points: shapely.Geometry, method: str, ratio: float) -> shapely.Geometry:
+    """
+    Returns the convex or concave hull of a set of points
+    @param points: multipoint of the isochrone vertices
+    @param method: convex or concave
+    @param ratio: concave hull ratio, 1 is the convex hull, lower values are tighter
+    """
+    if method == 'concave':
+        try:
+            return shapely.concave_hull(points, ratio=ratio)
+        except UnsupportedGEOSVersionError:
+            logger.warning('Concave hulls require GEOS 3.11, using the convex hull')
+    return shapely.convex_hull(points)
+
+
+def grow(geometry: shapely.Geometry, distance: float) -> shapely.Geometry:
+    # mitred corners add no vertices
+    return shapely.buffer(geometry, distance, quad_segs=1, join_style='mitre')
+
+
+def limit_vertices(polygon: shapely.Geometry, max_vertices: int, tolerance: float) -> shapely.Geometry:
+    """
+    Simplifies a polygon to at most max_vertices vertices. The simplified polygon is
+    grown by the simplification tolerance, so that it still covers the original one.
+    @param tolerance: initial simplification tolerance, doubled until the budget is met
+    @return: the simplified polygon, its bounding box if the budget can't be met
+    """
+    if max_vertices <= 0 or count_vertices(polygon) <= max_vertices:
+        return polygon
+
+    bbox = shapely.box(*shapely.bounds(polygon))
+    for _ in range(MAX_SIMPLIFY_STEPS):
+        simplified = grow(shapely.simplify(polygon, tolerance, preserve_topology=True), tolerance)
+        if simplified.area >= bbox.area:
+            # no tighter than the bounding box anymore
+            break
+        if count_vertices(simplified) <= max_vertices and simplified.covers(polygon):
+            return simplified
+        tolerance *= 2
+
+    return bbox
+
+
+def footprint(geometries: Sequence[shapely.Geometry], method: str = 'convex',
+              max_vertices: int = 0, ratio: float = 0.3) -> shapely.Geometry:
+    """
+    Computes the footprint of the isochrones
+    @param geometries: isochrone geometries
+    @param method: bbox, convex (hull) or concave (hull)
+    @param max_vertices: vertex budget of the footprint, 0 for no limit
+    @param ratio: concave hull ratio
+    @return: footprint polygon
+    """
+    if method not in FOOTPRINT_METHODS:
+        raise ValueError(f'Unknown footprint method: {method}')
+
+    geometries = np.asarray(geometries, dtype=object)
+    bounds = shapely.total_bounds(geometries)
+    if method == 'bbox':
+        return shapely.box(*bounds)
+
+    tolerance = max(bounds[2] - bounds[0], bounds[3] - bounds[1]) * RELATIVE_TOLERANCE
+    if method == 'concave':
+        # the concave hull is quadratic in the number of points: the fronts are simplified
+        # first, and the hull grown by the tolerance to still cover them
+        geometries = shapely.simplify(geometries, tolerance)
+
+    points = shapely.multipoints(shapely.get_coordinates(geometries))
+    polygon = hull(points, method, ratio)
+    if shapely.get_type_id(polygon) != shapely.GeometryType.POLYGON:
+        # degenerate isochrones (a single point or line)
+        return shapely.box(*bounds)
+    if method == 'concave':
+        polygon = grow(polygon, tolerance)
+
+    return limit_vertices(polygon, max_vertices, tolerance)
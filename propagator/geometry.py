@@ -0,0 +1,390 @@
+import math
+from dataclasses import dataclass
+from typing import Iterator, List, Sequence, Tuple, Union
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+# metres per degree of latitude, used to convert metric tolerances for EPSG:4326 geometries
+METERS_PER_DEGREE = 111320.0
+
+PROPAGATOR_TYPES = {
+    'Point': 'POINT',
+    'LineString': 'LINE',
+    'Polygon': 'POLYGON',
+}
+
+MULTI_TYPES = {
+    'MultiPoint': 'Point',
+    'MultiLineString': 'LineString',
+    'MultiPolygon': 'Polygon',
+}
+
+
+def meters_to_degrees(meters: float) -> float:
+    """
+    Converts a metric distance to an (approximate) distance in degrees
+    @param meters: distance in metres
+    @return: distance in degrees
+    """
+    return meters / METERS_PER_DEGREE
+
+
+def format_geometry(coordinates: Union[np.ndarray, Sequence], propagator_type: str) -> str:
+    """
+    Formats lon/lat positions as a propagator string
+    @param coordinates: positions (lon, lat[, z]), as a list or an array with lon, lat columns
+    @param propagator_type: one of POINT, LINE, POLYGON
+    @return: propagator string
+    """
+    if isinstance(coordinates, np.ndarray):
+        coordinates = coordinates.reshape(-1, coordinates.shape[-1]).tolist()
+
+    # the values are formatted one by one with str() like the original implementation:
+    # PROPAGATOR expects the shortest repr of the floats and the ints of the JSON as they
+    # are, and numpy has no bulk conversion that is faster and gives the same strings
+    columns = list(zip(*coordinates))
+    lons, lats = columns[0], columns[1]
+    if propagator_type == 'POINT':
+        return f'{propagator_type}:{lats[0]};{lons[0]}'
+
+    return f"{propagator_type}: [{' '.join(map(str, lats))}];[{' '.join(map(str, lons))}]"
+
+
+def geojson_parts(geometry: dict) -> Iterator[Tuple[str, Sequence]]:
+    """
+    Yields the simple parts of a GeoJSON geometry as (propagator type, coordinates)
+    @param geometry: GeoJSON geometry, multi-geometry or collection
+    """
+    geometry_type = geometry['type']
+
+    if geometry_type in ('GeometryCollection', 'FeatureCollection'):
+        for child in geometry['geometries']:
+            yield from geojson_parts(child)
+        return
+
+    if geometry_type in MULTI_TYPES:
+        part_type = MULTI_TYPES[geometry_type]
+        for coordinates in geometry['coordinates']:
+            yield from geojson_parts({'type': part_type, 'coordinates': coordinates})
+        return
+
+    if geometry_type not in PROPAGATOR_TYPES:
+        raise ValueError(f'Unknown geometry type: {geometry_type}')
+
+    coordinates = geometry['coordinates']
+    if geometry_type == 'Polygon':
+        # skip holes
+        coordinates = coordinates[0]
+    elif geometry_type == 'Point':
+        coordinates = [coordinates]
+
+    yield PROPAGATOR_TYPES[geometry_type], coordinates
+
+
+def shapely_parts(geom) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    Yields the simple parts of a shapely geometry as (propagator type, coordinates)
+    @param geom: shapely geometry
+    """
+    for part in shapely.get_parts(geom):
+        geometry_type = part.geom_type
+        if geometry_type in MULTI_TYPES or geometry_type == 'GeometryCollection':
+            yield from shapely_parts(part)
+            continue
+
+        if geometry_type == 'LinearRing':
+            geometry_type = 'LineString'
+        if geometry_type not in PROPAGATOR_TYPES:
+            raise ValueError(f'Unknown geometry type: {geometry_type}')
+        if part.is_empty:
+            continue
+
+        if geometry_type == 'Polygon':
+            # skip holes
+            part = part.exterior
+
+        yield PROPAGATOR_TYPES[geometry_type], shapely.get_coordinates(part)
+
+
+def simplify(geom, tolerance: float):
+    """
+    Simplifies a shapely geometry, keeping the original when simplification would empty it
+    @param geom: shapely geometry (EPSG:4326)
+    @param tolerance: tolerance in metres
+    @return: simplified geometry
+    """
+    simplified = shapely.simplify(geom, meters_to_degrees(tolerance), preserve_topology=True)
+    if simplified.is_empty:
+        return geom
+    return simplified
+
+
+def to_propagator_strings(geometry, tolerance: float = 0) -> List[str]:
+    """
+    Transforms a geometry to propagator strings, one for each simple part
+    @param geometry: GeoJSON geometry dict or shapely geometry
+    @param tolerance: optional simplification tolerance in metres (0 disables it)
+    @return: propagator string array
+    """
+    if tolerance and tolerance > 0:
+        if isinstance(geometry, dict):
+            geometry = geojson_to_shapely(geometry)
+        geometry = simplify(geometry, tolerance)
+
+    if isinstance(geometry, dict):
+        parts = geojson_parts(geometry)
+    else:
+        parts = shapely_parts(geometry)
+
+    return [format_geometry(coordinates, propagator_type) for propagator_type, coordinates in parts]
+
+
+def geojson_to_shapely(geometry: dict):
+    """
+    Builds a shapely geometry from a GeoJSON geometry or geometry collection
+    @param geometry: GeoJSON geometry dict
+    @return: shapely geometry
+    """
+    if geometry['type'] in ('GeometryCollection', 'FeatureCollection'):
+        return shapely.GeometryCollection([geojson_to_shapely(g) for g in geometry['geometries']])
+    return shape(geometry)
+
+
+def wkt_to_propagator_strings(wkt_string: str, tolerance: float = 0) -> List[str]:
+    """
+    Transforms a wkt string to propagator strings
+    @param wkt_string: wkt string
+    @param tolerance: optional simplification tolerance in metres (0 disables it)
+    @return: propagator string array
+    """
+    return to_propagator_strings(shapely.from_wkt(wkt_string), tolerance)
+
+
+def explode(geom) -> np.ndarray:
+    """
+    Returns the simple (non multi, non collection) parts of a shapely geometry
+    @param geom: shapely geometry
+    @return: array of shapely geometries
+    """
+    parts = shapely.get_parts(geom)
+    nested = shapely.get_type_id(parts) >= 4
+    if not nested.any():
+        return parts
+    return np.concatenate([parts[~nested]] + [explode(p) for p in parts[nested]])
+
+
+def utm_crs(geom) -> str:
+    """
+    Returns the UTM zone of the centre of a geometry, the metric CRS of the model grid
+    @param geom: shapely geometry (EPSG:4326)
+    @return: EPSG code of the zone
+    """
+    lonmin, latmin, lonmax, latmax = shapely.bounds(geom).tolist()
+    lon, lat = (lonmin + lonmax) / 2, (latmin + latmax) / 2
+    zone = int((lon + 180) // 6) % 60 + 1
+    return f'EPSG:{(32600 if lat >= 0 else 32700) + zone}'
+
+
+def reproject(geoms, src_crs: str, dst_crs: str):
+    """
+    Reprojects an array of shapely geometries
+    """
+    from pyproj import Transformer
+
+    transformer = Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+    return shapely.transform(geoms, lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
+
+
+def keep_unchanged(parts: np.ndarray, processed: np.ndarray) -> np.ndarray:
+    """
+    Returns the processed parts, keeping the original of those that lost no vertex
+    (or collapsed on the grid)
+    """
+    unchanged = shapely.is_empty(processed) | \
+        (shapely.get_num_coordinates(processed) == shapely.get_num_coordinates(parts))
+    return np.where(unchanged, parts, processed)
+
+
+def merge_overlapping(polygons: np.ndarray) -> list:
+    """
+    Merges the polygons overlapping another one, the others are returned as they are
+    """
+    left, right = shapely.STRtree(polygons).query(polygons, predicate='intersects')
+    overlapping = np.zeros(len(polygons), dtype=bool)
+    overlapping[left[left != right]] = True
+    if not overlapping.any():
+        return list(polygons)
+    return list(polygons[~overlapping]) + list(explode(shapely.union_all(polygons[overlapping])))
+
+
+def preprocess_geometry(geom, resolution: float, tolerance: float = 0) -> Tuple[object, int]:
+    """
+    Prepares a geometry for the model grid: parts are simplified and their vertices snapped
+    to the grid (which also drops repeated vertices), overlapping polygons are merged and
+    duplicate points are removed. Snapping is done in the UTM zone of the geometry, on a grid
+    of the model resolution. Parts losing no vertex, or collapsing on the grid, are kept
+    unchanged, and so is the geometry when no vertex is removed.
+    @param geom: shapely geometry (EPSG:4326)
+    @param resolution: grid resolution in metres
+    @param tolerance: simplification tolerance in metres, defaults to half the resolution
+    @return: the processed geometry and the number of removed vertices
+    """
+    tolerance = tolerance or resolution / 2
+
+    parts = explode(geom)
+    parts = parts[~shapely.is_empty(parts)]
+    if not len(parts):
+        return geom, 0
+
+    crs = utm_crs(geom)
+    metric = reproject(parts, 'EPSG:4326', crs)
+    type_ids = shapely.get_type_id(parts)
+    is_polygon = type_ids == 3
+    is_line = (type_ids == 1) | (type_ids == 2)
+
+    processed = metric.copy()
+    processed[is_polygon] = shapely.simplify(metric[is_polygon], tolerance, preserve_topology=True)
+    processed[is_line] = shapely.simplify(metric[is_line], tolerance)
+    processed = shapely.set_precision(processed, resolution)
+    processed = keep_unchanged(parts, reproject(processed, crs, 'EPSG:4326'))
+
+    result = []
+    if is_polygon.any():
+        result.extend(merge_overlapping(processed[is_polygon]))
+    result.extend(processed[is_line])
+
+    points = type_ids == 0
+    if points.any():
+        # one point per grid cell
+        _, first = np.unique(shapely.get_coordinates(shapely.set_precision(metric[points], resolution)),
+                             axis=0, return_index=True)
+        result.extend(parts[points][np.sort(first)])
+
+    removed = int(shapely.get_num_coordinates(geom) - sum(shapely.get_num_coordinates(result)))
+    if removed <= 0:
+        return geom, 0
+
+    return shapely.GeometryCollection(result), removed
+
+
+def parse_coordinates(values: str) -> np.ndarray:
+    """
+    Parses the lat/lon blocks of a propagator string in bulk
+    @param values: '[lat lat ...];[lon lon ...]' or 'lat;lon'
+    @return: array of shape (n, 2) with lon, lat columns
+    """
+    s_lats, s_lons = values.replace('[', ' ').replace(']', ' ').split(';')
+    lats = np.array(s_lats.split(), dtype=float)
+    lons = np.array(s_lons.split(), dtype=float)
+    if len(lats) == 0 or len(lats) != len(lons):
+        raise ValueError(f'Invalid coordinates: {values}')
+
+    return np.column_stack((lons, lats))
+
+
+@dataclass
+class PropagatorActions:
+    """
+    Compact representation of a set of propagator strings: the coordinates of all the
+    geometries are stored in one flat (n, 2) lon/lat array, polygons first, then lines
+    and points. Each geometry type has an offsets array delimiting its geometries.
+    """
+    coordinates: np.ndarray
+    polygon_offsets: np.ndarray
+    line_offsets: np.ndarray
+    point_offsets: np.ndarray
+
+    @classmethod
+    def parse(cls, actions_string: str) -> 'PropagatorActions':
+        """
+        Parses newline separated propagator strings
+        @param actions_string: propagator strings
+        """
+        blocks = {'POLYGON': [], 'LINE': [], 'POINT': []}
+
+        for s in actions_string.split('\n'):
+            if not s.strip():
+                continue
+            f_type, values = s.split(':')
+            f_type = f_type.strip()
+            if f_type not in blocks:
+                continue
+            blocks[f_type].append(parse_coordinates(values))
+
+        offsets = []
+        start = 0
+        for f_type in ('POLYGON', 'LINE', 'POINT'):
+            lengths = [len(c) for c in blocks[f_type]]
+            offsets.append(start + np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))))
+            start = offsets[-1][-1]
+
+        arrays = blocks['POLYGON'] + blocks['LINE'] + blocks['POINT']
+        coordinates = np.concatenate(arrays) if arrays else np.empty((0, 2))
+
+        return cls(coordinates, *offsets)
+
+    def _split(self, offsets: np.ndarray) -> List[np.ndarray]:
+        return [self.coordinates[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    @property
+    def polygons(self) -> List[np.ndarray]:
+        return self._split(self.polygon_offsets)
+
+    @property
+    def lines(self) -> List[np.ndarray]:
+        return self._split(self.line_offsets)
+
+    @property
+    def points(self) -> np.ndarray:
+        return self.coordinates[self.point_offsets[0]:self.point_offsets[-1]]
+
+    def _geometry_indices(self, offsets: np.ndarray) -> np.ndarray:
+        return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    def to_shapely(self):
+        """
+        Builds the shapely geometries of the actions
+        @return: arrays of polygons, lines and points
+        """
+        polygon_coordinates = self.coordinates[self.polygon_offsets[0]:self.polygon_offsets[-1]]
+        line_coordinates = self.coordinates[self.line_offsets[0]:self.line_offsets[-1]]
+
+        polygons = shapely.polygons(shapely.linearrings(
+            polygon_coordinates, indices=self._geometry_indices(self.polygon_offsets)))
+        lines = shapely.linestrings(line_coordinates, indices=self._geometry_indices(self.line_offsets))
+        points = shapely.points(self.points)
+
+        return polygons, lines, points
+
+    def to_strings(self) -> List[str]:
+        """
+        Formats the actions back to propagator strings
+        """
+        strings = [format_geometry(c, 'POLYGON') for c in self.polygons]
+        strings += [format_geometry(c, 'LINE') for c in self.lines]
+        strings += [format_geometry(c, 'POINT') for c in self.points]
+        return strings
+
+    def as_lists(self):
+        """
+        Returns the actions as nested lists: polygons and lines as (lats, lons), points as (lat, lon)
+        """
+        polys = [(c[:, 1].tolist(), c[:, 0].tolist()) for c in self.polygons]
+        lines = [(c[:, 1].tolist(), c[:, 0].tolist()) for c in self.lines]
+        points = [(lat, lon) for lon, lat in self.points.tolist()]
+        return polys, lines, points
+
+
+def domain_bbox(geom, buffer: float) -> Tuple[float, float, float, float]:
+    """
+    Returns the lon/lat bounding box of a geometry expanded by a metric buffer
+    @param geom: shapely geometry (EPSG:4326)
+    @param buffer: buffer in metres
+    @return: lonmin, latmin, lonmax, latmax
+    """
+    lonmin, latmin, lonmax, latmax = shapely.bounds(geom).tolist()
+    lat_buffer = meters_to_degrees(buffer)
+    lon_buffer = lat_buffer / max(math.cos(math.radians((latmin + latmax) / 2)), 1e-6)
+    return (lonmin - lon_buffer, latmin - lat_buffer, lonmax + lon_buffer, latmax + lat_buffer)
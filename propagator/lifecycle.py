@@ -0,0 +1,382 @@
+import logging
+import os
+import queue
+import re
+import shutil
+import tarfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import LifecycleConfig, PropagatorConfig
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+ARCHIVE_SUFFIX = '.tar.gz'
+
+# run directories are named <run_id>.<datatype>, their archives <run_id>.<datatype>.tar.gz
+RUN_ENTRY_PATTERN = re.compile(r'.+\.\d+(\.tar\.gz)?$')
+
+# datalake package of a run, with the urls of its products
+PACKAGE_FILE = 'datalake.json'
+
+# request of a run, as received
+MESSAGE_FILE = 'message.json'
+
+# files kept when a run is compacted, besides the uploaded products
+RUN_FILES = (MESSAGE_FILE, PACKAGE_FILE)
+
+
+def disk_usage(path: str) -> int:
+    """
+    Returns the size in bytes of a file or directory tree
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def archive_path(run_dir: str) -> str:
+    return run_dir.rstrip(os.sep) + ARCHIVE_SUFFIX
+
+
+def timestep_outputs(run_dir: str, prefix: str, output_type: str = None) -> List[Tuple[int, str]]:
+    """
+    Returns the outputs written by PROPAGATOR for each timestep of a variable (<prefix>_<minutes>.<type>),
+    the files derived from them (e.g. masked or filtered copies) are not timestep outputs
+    @param output_type: extension of the outputs, any if None
+    @return: list of (minutes, file path) in time order
+    """
+    extension = re.escape(output_type) if output_type else r'\w+'
+    pattern = re.compile(rf'^{re.escape(prefix)}_(\d+)\.{extension}$')
+    files = []
+    for name in os.listdir(run_dir):
+        match = pattern.match(name)
+        if match:
+            files.append((int(match.group(1)), os.path.join(run_dir, name)))
+    return sorted(files)
+
+
+def last_outputs(run_dir: str, prefixes: Iterable[str]) -> List[str]:
+    """
+    Returns the output files of the last timestep of each prefix, the previous
+    timesteps are intermediate outputs
+    """
+    last = []
+    for prefix in prefixes:
+        outputs = timestep_outputs(run_dir, prefix)
+        if outputs:
+            last_minutes = outputs[-1][0]
+            last += [path for minutes, path in outputs if minutes == last_minutes]
+    return last
+
+
+def run_entries(work_dir: str, run_id: str) -> List[str]:
+    """
+    Returns the run directories of a run id, one per requested datatype, including the
+    compacted ones (as the path of the directory they are restored to)
+    """
+    if not os.path.isdir(work_dir):
+        return []
+    pattern = re.compile(rf'^{re.escape(run_id)}\.\d+(\.tar\.gz)?$')
+    entries = {
+        os.path.abspath(os.path.join(work_dir, name)).removesuffix(ARCHIVE_SUFFIX)
+        for name in os.listdir(work_dir) if pattern.match(name)
+    }
+    return sorted(entries)
+
+
+def pack_run(run_dir: str, keep: Iterable[str]) -> str:
+    """
+    Packs the files to keep of a run into a temporary compressed archive
+    @return: path of the temporary archive
+    """
+    run_name = os.path.basename(run_dir.rstrip(os.sep))
+    tmp_archive = archive_path(run_dir) + '.tmp'
+
+    with tarfile.open(tmp_archive, 'w:gz') as tar:
+        for path in sorted(set(keep)):
+            if os.path.isfile(path):
+                tar.add(path, arcname=os.path.join(run_name, os.path.basename(path)))
+    return tmp_archive
+
+
+def replace_run(run_dir: str, tmp_archive: str) -> str:
+    """
+    Replaces a run directory with its packed archive
+    @return: path of the archive
+    """
+    archive = archive_path(run_dir)
+    os.replace(tmp_archive, archive)
+    shutil.rmtree(run_dir, ignore_errors=True)
+    return archive
+
+
+def compact_run(run_dir: str, keep: Iterable[str]) -> str:
+    """
+    Packs the files to keep of a finished run into a compressed archive and removes
+    the run directory (intermediate timesteps, masked copies...)
+    @param run_dir: run directory
+    @param keep: paths of the files to keep
+    @return: path of the archive
+    """
+    return replace_run(run_dir, pack_run(run_dir, keep))
+
+
+def read_run_file(run_dir: str, name: str) -> Optional[bytes]:
+    """
+    Reads a file of a run from its directory, or from its archive if compacted, without
+    restoring it
+    @return: the content of the file, None if the run doesn't have it
+    """
+    try:
+        with open(os.path.join(run_dir, name), 'rb') as fp:
+            return fp.read()
+    except FileNotFoundError:
+        pass
+
+    archive = archive_path(run_dir)
+    if not os.path.exists(archive):
+        return None
+    run_name = os.path.basename(run_dir.rstrip(os.sep))
+    with tarfile.open(archive, 'r:gz') as tar:
+        try:
+            member = tar.extractfile(f'{run_name}/{name}')
+        except KeyError:
+            return None
+        return member.read() if member is not None else None
+
+
+def restore_run(run_dir: str) -> bool:
+    """
+    Extracts the archive of a compacted run back into its run directory
+    @return: True if the run directory is available
+    """
+    if os.path.isdir(run_dir):
+        return True
+
+    archive = archive_path(run_dir)
+    if not os.path.exists(archive):
+        return False
+
+    with tarfile.open(archive, 'r:gz') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(os.path.dirname(run_dir), filter='data')
+        else:
+            tar.extractall(os.path.dirname(run_dir))
+    return True
+
+
+class LifecycleManager:
+    """
+    Background manager of WORK_DIR: compacts finished runs after their upload, evicts
+    runs (oldest first) when WORK_DIR exceeds its quota or they exceed the maximum age,
+    and reports the disk usage. The run directories in use (a run in progress, a retry,
+    a derive request or another run reusing its outputs) are never compacted or evicted:
+    their compaction waits until they are released. The runs retained by a pending retry
+    are not evicted either. A run directory is removed under the lock of the manager, so it
+    can't be taken in the meanwhile.
+    """
+    def __init__(self, work_dir: str, quota: int, max_age: float, interval: float):
+        self.work_dir = work_dir
+        self.quota = quota
+        self.max_age = max_age
+        self.interval = interval
+        # number of users of each run directory in use
+        self.active: Dict[str, int] = {}
+        # compactions waiting for their run directory to be released
+        self.deferred: Dict[str, List[str]] = {}
+        # number of pending retries of each run id, its run directories are not evicted
+        self.retained: Dict[str, int] = {}
+        self.jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.loop, name='work-dir-lifecycle', daemon=True)
+            self._thread.start()
+
+    def loop(self):
+        next_check = 0
+        while True:
+            timeout = max(next_check - time.monotonic(), 0)
+            try:
+                run_dir, keep = self.jobs.get(timeout=timeout)
+            except queue.Empty:
+                self.enforce()
+                next_check = time.monotonic() + self.interval
+                continue
+
+            try:
+                self.compact(run_dir, keep)
+            except Exception as exp:
+                logger.warning(f'Error compacting {run_dir}: {exp}')
+
+    def compact(self, run_dir: str, keep: List[str]):
+        """
+        Compacts a run directory, or defers it to its release if it is in use. The archive
+        is packed outside the lock, the run directory may be taken in the meanwhile.
+        """
+        with self._lock:
+            if run_dir in self.active:
+                self.deferred[run_dir] = keep
+                return
+        if not os.path.isdir(run_dir):
+            # evicted or already compacted
+            return
+
+        tmp_archive = pack_run(run_dir, keep)
+        with self._lock:
+            if run_dir in self.active:
+                os.remove(tmp_archive)
+                self.deferred[run_dir] = keep
+                return
+            archive = replace_run(run_dir, tmp_archive)
+        logger.info(f'Compacted {run_dir} into {archive}')
+
+    @contextmanager
+    def running(self, run_dir: str):
+        """
+        Marks a run directory as in use for the duration of the context, the contexts
+        of a run directory can be nested or concurrent
+        """
+        run_dir = os.path.abspath(run_dir)
+        with self._lock:
+            self.active[run_dir] = self.active.get(run_dir, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active[run_dir] -= 1
+                if not self.active[run_dir]:
+                    del self.active[run_dir]
+                    if run_dir in self.deferred:
+                        self.jobs.put((run_dir, self.deferred.pop(run_dir)))
+
+    def retain(self, run_id: str):
+        """
+        Keeps the run directories of a run id (any datatype) from eviction until released,
+        e.g. while a retry of the run is pending
+        """
+        with self._lock:
+            self.retained[run_id] = self.retained.get(run_id, 0) + 1
+
+    def release(self, run_id: str):
+        with self._lock:
+            self.retained[run_id] -= 1
+            if not self.retained[run_id]:
+                del self.retained[run_id]
+
+    def is_running(self, run_dir: str) -> bool:
+        with self._lock:
+            return os.path.abspath(run_dir) in self.active
+
+    def schedule_compaction(self, run_dir: str, keep: Iterable[str]):
+        self.jobs.put((os.path.abspath(run_dir), list(keep)))
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        Returns (mtime, size, path) of the runs and archives in WORK_DIR
+        """
+        entries = []
+        if not os.path.isdir(self.work_dir):
+            return entries
+
+        for name in os.listdir(self.work_dir):
+            path = os.path.abspath(os.path.join(self.work_dir, name))
+            if not RUN_ENTRY_PATTERN.match(name):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), disk_usage(path), path))
+            except OSError:
+                # removed in the meanwhile
+                continue
+        return entries
+
+    def usage(self) -> dict:
+        """
+        Returns the disk usage of WORK_DIR in bytes
+        """
+        entries = self.entries()
+        archives = sum(size for _, size, path in entries if path.endswith(ARCHIVE_SUFFIX))
+        runs = sum(size for _, size, path in entries if not path.endswith(ARCHIVE_SUFFIX))
+        return {
+            'runs': runs,
+            'archives': archives,
+            'total': disk_usage(self.work_dir) if os.path.isdir(self.work_dir) else 0,
+            'free': shutil.disk_usage(self.work_dir).free if os.path.isdir(self.work_dir) else 0,
+        }
+
+    def evict(self, path: str) -> bool:
+        """
+        Removes a run directory or archive from WORK_DIR, unless its run is in use or retained
+        @return: True if it was removed
+        """
+        run_dir = path.removesuffix(ARCHIVE_SUFFIX)
+        run_id = os.path.basename(run_dir).rsplit('.', 1)[0]
+        with self._lock:
+            if run_dir in self.active or run_id in self.retained:
+                return False
+            logger.info(f'Evicting {path} from WORK_DIR')
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        return True
+
+    def enforce(self):
+        """
+        Evicts the runs older than the maximum age, then the oldest runs until WORK_DIR fits its quota
+        """
+        entries = sorted(self.entries())
+
+        if self.max_age > 0:
+            cutoff = time.time() - self.max_age * 3600
+            entries = [e for e in entries if e[0] >= cutoff or not self.evict(e[2])]
+
+        usage = self.usage()
+        if self.quota > 0:
+            total = usage['runs'] + usage['archives']
+            for _, size, path in entries:
+                if total <= self.quota:
+                    break
+                if self.evict(path):
+                    total -= size
+            usage = self.usage()
+
+        logger.info(
+            f"WORK_DIR usage: {usage['total'] // MB} MB "
+            f"(runs {usage['runs'] // MB} MB, archives {usage['archives'] // MB} MB, "
+            f"{usage['free'] // MB} MB free)"
+        )
+
+
+_manager = None
+
+
+def get_lifecycle_manager() -> LifecycleManager:
+    """
+    Returns the WORK_DIR lifecycle manager of the service, starting it on first use
+    """
+    global _manager
+    if _manager is None:
+        _manager = LifecycleManager(
+            PropagatorConfig.WORK_DIR,
+            LifecycleConfig.QUOTA * MB,
+            LifecycleConfig.MAX_AGE,
+            LifecycleConfig.CHECK_INTERVAL
+        )
+        _manager.start()
+    return _manager
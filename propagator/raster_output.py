@@ -0,0 +1,188 @@
+import os
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as rio_copy
+
+from config import RasterOutputConfig
+
+INTEGER_DTYPES = ['uint8', 'int8', 'uint16', 'int16', 'uint32', 'int32']
+
+
+def narrowest_dtype(values: np.ndarray, nodata: float, source_dtype: str = 'float64') -> str:
+    """
+    Returns the narrowest dtype that stores the values and the nodata value without loss
+    @param values: valid values of the raster
+    @param nodata: nodata value that will be written outside the valid area
+    @param source_dtype: dtype declared by the source raster
+    @return: the dtype name
+    """
+    if values.size == 0:
+        values = np.zeros(1)
+
+    finite = np.isfinite(values).all()
+    if finite and (np.issubdtype(np.dtype(source_dtype), np.integer) or np.all(np.mod(values, 1) == 0)):
+        lower, upper = min(values.min(), nodata), max(values.max(), nodata)
+        for dtype in INTEGER_DTYPES:
+            info = np.iinfo(dtype)
+            if info.min <= lower and upper <= info.max:
+                return dtype
+
+    if np.dtype(source_dtype).itemsize <= 4:
+        return 'float32'
+
+    values_32 = values.astype(np.float32)
+    if np.array_equal(values_32.astype(values.dtype), values, equal_nan=True):
+        return 'float32'
+
+    return 'float64'
+
+
+def cog_profile(profile: dict, dtype: str, count: int = 1, nodata: float = None) -> dict:
+    """
+    Builds a tiled and compressed GeoTIFF profile from a source profile
+    @param profile: profile of the source raster
+    @param dtype: dtype of the output raster
+    @param count: number of bands
+    @param nodata: nodata value of the output raster
+    @return: the output profile
+    """
+    is_float = np.issubdtype(np.dtype(dtype), np.floating)
+    compress = RasterOutputConfig.COMPRESS.upper()
+
+    out_profile = {
+        'driver': 'GTiff',
+        'width': profile['width'],
+        'height': profile['height'],
+        'crs': profile['crs'],
+        'transform': profile['transform'],
+        'count': count,
+        'dtype': dtype,
+        'nodata': RasterOutputConfig.NODATA if nodata is None else nodata,
+        'tiled': True,
+        'blockxsize': RasterOutputConfig.BLOCKSIZE,
+        'blockysize': RasterOutputConfig.BLOCKSIZE,
+        'compress': compress,
+        'predictor': 3 if is_float else 2,
+        'interleave': 'band',
+        'BIGTIFF': 'IF_SAFER',
+    }
+    if compress == 'DEFLATE':
+        out_profile['zlevel'] = RasterOutputConfig.COMPRESS_LEVEL
+    elif compress == 'ZSTD':
+        out_profile['zstd_level'] = RasterOutputConfig.COMPRESS_LEVEL
+
+    return out_profile
+
+
+def overview_factors(width: int, height: int):
+    """
+    Returns the overview decimation factors down to RasterOutputConfig.OVERVIEW_MIN_SIZE
+    """
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= RasterOutputConfig.OVERVIEW_MIN_SIZE:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+@contextmanager
+def open_cog(output_file: str, profile: dict):
+    """
+    Opens a tiled GeoTIFF for writing and converts it to a Cloud-Optimized GeoTIFF on exit.
+    Bands can be written one at a time, so memory stays bounded by a single band.
+    @param output_file: path of the Cloud-Optimized GeoTIFF
+    @param profile: output profile, see cog_profile
+    """
+    tmp_file = f'{output_file}.tmp'
+    try:
+        with rio.open(tmp_file, 'w', **profile) as dst:
+            yield dst
+
+            factors = overview_factors(dst.width, dst.height)
+            if factors:
+                resampling = Resampling[RasterOutputConfig.OVERVIEW_RESAMPLING]
+                dst.build_overviews(factors, resampling)
+                dst.update_tags(ns='rio_overview', resampling=resampling.name)
+
+        # rewrite with overviews stored before the full resolution data (COG layout)
+        creation_options = {k: v for k, v in profile.items()
+                            if k not in ('driver', 'width', 'height', 'count', 'dtype', 'crs', 'transform', 'nodata')}
+        rio_copy(tmp_file, output_file, driver='GTiff', copy_src_overviews=True, **creation_options)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def valid_data(values: np.ndarray, nodata: float) -> np.ndarray:
+    """
+    Returns the mask of the cells with data (not nodata nor NaN)
+    """
+    valid = np.ones(values.shape, dtype=bool)
+    if nodata is not None:
+        valid &= values != nodata
+    if np.issubdtype(values.dtype, np.floating):
+        valid &= ~np.isnan(values)
+    return valid
+
+
+def write_masked_raster(output_file: str, values: np.ndarray, valid: np.ndarray, profile: dict) -> str:
+    """
+    Writes a single band raster as Cloud-Optimized GeoTIFF, using nodata outside the valid area
+    @param output_file: path of the output raster
+    @param values: band values
+    @param valid: boolean mask of the valid cells
+    @param profile: profile of the source raster
+    @return: path of the output raster
+    """
+    nodata = RasterOutputConfig.NODATA
+    dtype = narrowest_dtype(values[valid], nodata, profile['dtype'])
+
+    band = np.full(values.shape, nodata, dtype=dtype)
+    band[valid] = values[valid]
+
+    with open_cog(output_file, cog_profile(profile, dtype, nodata=nodata)) as dst:
+        dst.write(band, 1)
+
+    return output_file
+
+
+def write_time_series(output_file: str, bands: List[Tuple[dict, str]],
+                      mask: Callable[[tuple, object], np.ndarray] = None) -> str:
+    """
+    Stacks single band rasters of the same grid (e.g. the timesteps of a variable) into one
+    multi-band Cloud-Optimized GeoTIFF. Bands are read and written one at a time, so memory
+    stays bounded by a single band whatever the number of timesteps.
+    @param output_file: path of the output raster
+    @param bands: (band tags, path of the source raster) in band order
+    @param mask: optional function (shape, transform) -> boolean mask of the cells to keep,
+    computed once for all the bands
+    @return: path of the output raster
+    """
+    with rio.open(bands[0][1]) as src:
+        profile = src.profile
+    # the values of all the bands are not known in advance: floats keep every source dtype
+    dtype = 'float64' if np.dtype(profile['dtype']).itemsize > 4 else 'float32'
+    nodata = RasterOutputConfig.NODATA
+    keep = mask((profile['height'], profile['width']), profile['transform']) if mask is not None else None
+
+    with open_cog(output_file, cog_profile(profile, dtype, count=len(bands), nodata=nodata)) as dst:
+        for index, (tags, path) in enumerate(bands, start=1):
+            with rio.open(path) as src:
+                if (src.height, src.width) != (profile['height'], profile['width']):
+                    raise ValueError(f'{path} is not on the grid of {bands[0][1]}')
+                values = src.read(1)
+                valid = valid_data(values, src.nodata)
+
+            if keep is not None:
+                valid &= keep
+
+            dst.write(np.where(valid, values, nodata).astype(dtype), index)
+            dst.update_tags(index, **tags)
+            dst.set_band_description(index, '_'.join(str(value) for value in tags.values()))
+
+    return output_file
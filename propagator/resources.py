@@ -0,0 +1,146 @@
+import logging
+import os
+import resource
+import shutil
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from config import PropagatorConfig, ResourceLimitsConfig
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+@dataclass
+class RunLimits:
+    """
+    Resource limits of a simulation process
+    @param memory: address space limit in bytes, 0 for unlimited
+    @param cpu_time: CPU time limit in seconds, 0 for unlimited
+    @param cpus: cores the process is pinned on, empty for no pinning
+    """
+    memory: int = 0
+    cpu_time: int = 0
+    cpus: List[int] = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+    def apply(self, pid: int):
+        """
+        Applies the limits to a started simulation process. They are not applied between
+        fork and exec (preexec_fn), which is not safe in the threaded service process.
+        """
+        try:
+            apply_limits(pid, self)
+        except (ProcessLookupError, PermissionError) as exp:
+            # the process already ended, or the limits can't be set on this system
+            logger.warning(f'Resource limits not applied to the simulation (pid {pid}): {exp}')
+
+
+def apply_limits(pid: int, limits: RunLimits):
+    """
+    Applies the limits to a process (prlimit, sched_setaffinity)
+    """
+    if limits.memory > 0:
+        resource.prlimit(pid, resource.RLIMIT_AS, (limits.memory, limits.memory))
+    if limits.cpu_time > 0:
+        # SIGXCPU at the soft limit, SIGKILL a few seconds later
+        resource.prlimit(pid, resource.RLIMIT_CPU, (limits.cpu_time, limits.cpu_time + 5))
+    if limits.cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(pid, limits.cpus)
+
+
+class CoreAllocator:
+    """
+    Assigns disjoint sets of cores to the simulations running at the same time
+    """
+    def __init__(self, cpus: List[int]):
+        self.free = sorted(cpus)
+        self._lock = threading.Lock()
+
+    def acquire(self, count: int) -> List[int]:
+        """
+        @return: the assigned cores, empty if not enough cores are free
+        """
+        with self._lock:
+            if count <= 0 or count > len(self.free):
+                return []
+            cpus, self.free = self.free[:count], self.free[count:]
+            return cpus
+
+    def release(self, cpus: List[int]):
+        with self._lock:
+            self.free = sorted(self.free + list(cpus))
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+_allocator = CoreAllocator(available_cpus())
+
+
+@contextmanager
+def run_limits():
+    """
+    Reserves the resources of a simulation for the duration of the context
+    @return: the RunLimits to apply to the simulation process
+    """
+    cpus = _allocator.acquire(ResourceLimitsConfig.CPUS_PER_RUN)
+    if ResourceLimitsConfig.CPUS_PER_RUN > 0 and not cpus:
+        logger.warning('Not enough free cores to pin the simulation, running unpinned')
+
+    limits = RunLimits(
+        memory=ResourceLimitsConfig.MEMORY * MB,
+        cpu_time=ResourceLimitsConfig.CPU_TIME,
+        cpus=cpus
+    )
+    try:
+        yield limits
+    finally:
+        _allocator.release(cpus)
+
+
+def available_memory() -> int:
+    """
+    Returns the memory available for new processes in bytes (MemAvailable on Linux)
+    """
+    try:
+        with open('/proc/meminfo') as fp:
+            for line in fp:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def available_disk(path: str) -> int:
+    """
+    Returns the free disk space in bytes of the filesystem holding path
+    """
+    while not os.path.exists(path):
+        path = os.path.dirname(os.path.abspath(path))
+    return shutil.disk_usage(path).free
+
+
+def check_admission() -> Optional[str]:
+    """
+    Checks whether the node can take a new simulation, given its expected footprint
+    @return: None if the run can be admitted, the reason otherwise
+    """
+    memory = available_memory()
+    if memory < ResourceLimitsConfig.EXPECTED_MEMORY * MB:
+        return f'{memory // MB} MB of memory available, {ResourceLimitsConfig.EXPECTED_MEMORY} MB expected'
+
+    disk = available_disk(PropagatorConfig.WORK_DIR)
+    if disk < ResourceLimitsConfig.EXPECTED_DISK * MB:
+        return f'{disk // MB} MB of disk available in WORK_DIR, {ResourceLimitsConfig.EXPECTED_DISK} MB expected'
+
+    return None
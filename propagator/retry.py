@@ -0,0 +1,469 @@
+import enum
+import functools
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from dataclasses import asdict, dataclass, field, replace
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from config import PropagatorConfig, RetryConfig
+from propagator.lifecycle import (LifecycleManager, get_lifecycle_manager,
+                                  restore_run)
+from propagator.wrapper import ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+# headers of a request republished for a retry
+ATTEMPT_HEADER = 'x-retry-attempt'
+ERRORS_HEADER = 'x-retry-errors'
+USER_HEADER = 'x-retry-user-id'
+
+# pending retries, reloaded when the service restarts
+QUEUE_FILE = 'retry_queue.json'
+
+# fraction of the delay drawn at random, so that the nodes don't retry all together
+JITTER = 0.2
+
+# simulation errors caused by the request inputs: a rerun fails the same way
+INPUT_ERROR_CODES = (ErrorCodes.DOMAIN_ERROR, ErrorCodes.IGNITIONS_ERROR, ErrorCodes.BC_ERROR)
+
+# signals of a simulation killed for the resources it used (by the kernel OOM killer or the
+# CPU time limit) and error of a simulation out of memory (address space limit): a rerun
+# with the same inputs and limits runs out of them again
+RESOURCE_SIGNALS = (signal.SIGKILL, signal.SIGXCPU)
+RESOURCE_ERROR = 'MemoryError'
+
+
+class RetryStage(enum.Enum):
+    # the simulation failed: the request is republished and runs again from scratch
+    RUN = 'run'
+    # the post-processing or the upload failed: they are redone from the outputs on disk
+    UPLOAD = 'upload'
+
+
+def transient_exceptions() -> tuple:
+    """
+    Returns the exception types of the failures that may not happen again (broker,
+    authentication and network errors); datalake errors tell if they are transient
+    """
+    import requests
+    from pika.exceptions import AMQPError
+
+    from framework.tools import AuthenticationException
+
+    exceptions = [
+        ConnectionError, TimeoutError, requests.RequestException, AMQPError, AuthenticationException,
+    ]
+    try:
+        import aiohttp
+        exceptions.append(aiohttp.ClientError)
+    except ImportError:
+        pass
+    return tuple(exceptions)
+
+
+def is_transient(exp: BaseException) -> bool:
+    """
+    Returns True if the exception, or one of the exceptions that caused it, is transient
+    """
+    from framework.data_uploader import DatalakeException
+
+    transient = transient_exceptions()
+    seen = set()
+    while exp is not None and id(exp) not in seen:
+        if isinstance(exp, DatalakeException):
+            # e.g. a 4xx response of CKAN fails again
+            return exp.transient
+        if isinstance(exp, transient):
+            return True
+        seen.add(id(exp))
+        exp = exp.__cause__ or exp.__context__
+    return False
+
+
+def classify_exit(error_code: ErrorCodes, returncode: int = None, stderr: str = '') -> Optional[RetryStage]:
+    """
+    @param error_code: exit error code of the simulation
+    @param returncode: exit status of the simulation, negative if killed by a signal
+    @param stderr: error output of the simulation
+    @return: RUN if the simulation may succeed when run again, None if the inputs are wrong or
+    the simulation ran out of memory or CPU time
+    """
+    if error_code in INPUT_ERROR_CODES:
+        return None
+    if returncode is not None and returncode < 0 and -returncode in RESOURCE_SIGNALS:
+        return None
+    if RESOURCE_ERROR in (stderr or ''):
+        return None
+    return RetryStage.RUN
+
+
+def classify_exception(exp: BaseException, stage: RetryStage) -> Optional[RetryStage]:
+    """
+    @return: the stage to retry if the exception is transient, None otherwise
+    """
+    return stage if is_transient(exp) else None
+
+
+@dataclass
+class RetryJob:
+    """
+    A request of the service with its failed attempts
+    """
+    routing_key: str
+    user_id: str
+    body: str
+    datatype_id: int
+    attempt: int = 0
+    errors: List[str] = field(default_factory=list)
+    stage: str = None
+    # epoch seconds of the next attempt
+    due: float = 0
+
+    @property
+    def run_id(self) -> str:
+        _, _, *run_id = self.routing_key.split('.')
+        return '.'.join(run_id)
+
+    @classmethod
+    def from_delivery(cls, routing_key: str, user_id: str, body, datatype_id: int, headers: dict = None) -> 'RetryJob':
+        """
+        Builds the job of a request received from the broker, with the attempts of a republished request
+        """
+        headers = {
+            key: value.decode() if isinstance(value, bytes) else value
+            for key, value in (headers or {}).items()
+        }
+        return cls(
+            routing_key=routing_key,
+            user_id=headers.get(USER_HEADER, user_id),
+            body=body.decode() if isinstance(body, bytes) else body,
+            datatype_id=datatype_id,
+            attempt=int(headers.get(ATTEMPT_HEADER, 0)),
+            errors=json.loads(headers.get(ERRORS_HEADER, '[]')),
+        )
+
+    def diagnostics(self, reason: str, exp: BaseException = None) -> dict:
+        """
+        Returns the dead letter record of the job
+        """
+        try:
+            request = json.loads(self.body)
+        except ValueError:
+            request = self.body
+
+        record = {
+            'reason': reason,
+            'run_id': self.run_id,
+            'routing_key': self.routing_key,
+            'user_id': self.user_id,
+            'datatype_id': self.datatype_id,
+            'stage': self.stage,
+            'attempts': self.attempt,
+            'errors': self.errors,
+            'host': socket.gethostname(),
+            'dead_lettered_at': datetime.now().isoformat(),
+            'request': request,
+        }
+        if exp is not None:
+            record['traceback'] = ''.join(traceback.format_exception(type(exp), exp, exp.__traceback__))
+        return record
+
+
+class RetryQueue:
+    """
+    Bounded queue of the failed requests waiting for a retry, with an exponential delay
+    between the attempts. A background thread runs the retries when they are due: upload
+    failures redo the post-processing and the upload of the outputs left on disk, without
+    running the simulation again; simulation failures republish the request, so that the
+    rerun goes through the admission control. Requests that can't be retried, or that run
+    out of attempts, are dead-lettered with their diagnostics and end with an error status.
+    If a handoff is set (e.g. the add_callback_threadsafe of the consumer connection), the
+    upload retries are passed to the consumer thread, which runs them when the run in
+    progress is over, rather than alongside it: the queue goes on meanwhile. The runs of the
+    pending retries are retained by the lifecycle manager, if given, so that their outputs
+    are not evicted.
+    """
+    def __init__(self, queue_file: str, dead_letter_dir: str, max_retries: int,
+                 base_delay: float, max_delay: float, max_pending: int,
+                 lifecycle_manager: LifecycleManager = None):
+        self.queue_file = queue_file
+        self.dead_letter_dir = dead_letter_dir
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.lifecycle_manager = lifecycle_manager
+        self.pending = []
+        # retries being executed or waiting for the consumer, by sequence number, saved with
+        # the pending ones in case the service stops
+        self.in_flight: Dict[int, RetryJob] = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        # schedules a callable on the consumer thread
+        self.handoff: Callable[[Callable[[], None]], None] = None
+
+    def start(self):
+        if self._thread is None:
+            self.load()
+            self._thread = threading.Thread(target=self.loop, name='retry-queue', daemon=True)
+            self._thread.start()
+
+    def load(self):
+        """
+        Reloads the retries pending when the service stopped
+        """
+        if not os.path.exists(self.queue_file):
+            return
+        try:
+            with open(self.queue_file) as fp:
+                jobs = [RetryJob(**job) for job in json.load(fp)]
+        except (OSError, ValueError, TypeError) as exp:
+            logger.warning(f'Pending retries not reloaded from {self.queue_file}: {exp}')
+            return
+
+        with self._condition:
+            for job in jobs:
+                self.retain(job)
+                heapq.heappush(self.pending, (job.due, next(self._counter), job))
+        logger.info(f'{len(jobs)} pending retries reloaded')
+
+    def save(self):
+        # called with the lock held
+        tmp_file = self.queue_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as fp:
+                jobs = [job for _, _, job in self.pending] + list(self.in_flight.values())
+                json.dump([asdict(job) for job in jobs], fp)
+            os.replace(tmp_file, self.queue_file)
+        except OSError as exp:
+            logger.warning(f'Pending retries not saved to {self.queue_file}: {exp}')
+
+    def delay(self, attempt: int) -> float:
+        """
+        Returns the delay before an attempt (1 is the first retry)
+        """
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * random.uniform(1 - JITTER, 1)
+
+    def retry(self, job: RetryJob, stage: Optional[RetryStage], error: str, exp: BaseException = None) -> bool:
+        """
+        Schedules the retry of a failed request, or dead-letters it
+        @param job: the failed request
+        @param stage: stage to retry, None if the failure is not retryable
+        @param error: description of the failure
+        @param exp: exception of the failure, for the diagnostics
+        @return: True if a retry is scheduled
+        """
+        job = replace(job, attempt=job.attempt + 1, errors=job.errors + [error],
+                      stage=stage.value if stage is not None else job.stage)
+        if stage is None:
+            self.dead_letter(job, 'not retryable', exp)
+            return False
+        if job.attempt > self.max_retries:
+            self.dead_letter(job, 'retries exhausted', exp)
+            return False
+
+        with self._condition:
+            if len(self.pending) >= self.max_pending:
+                full = True
+            else:
+                full = False
+                delay = self.delay(job.attempt)
+                job.due = time.time() + delay
+                self.retain(job)
+                heapq.heappush(self.pending, (job.due, next(self._counter), job))
+                self.save()
+                self._condition.notify()
+        if full:
+            self.dead_letter(job, 'retry queue full', exp)
+            return False
+
+        logger.warning(f'Retry {job.attempt}/{self.max_retries} of {job.run_id} ({job.stage}) in {delay:.0f} s: {error}')
+        return True
+
+    def dead_letter(self, job: RetryJob, reason: str, exp: BaseException = None) -> str:
+        """
+        Stores a request that won't be retried with its diagnostics, and publishes them on
+        the dead letter routing key if configured
+        @return: path of the dead letter record
+        """
+        record = job.diagnostics(reason, exp)
+        os.makedirs(self.dead_letter_dir, exist_ok=True)
+        path = os.path.join(self.dead_letter_dir, f'{job.run_id}.{job.datatype_id}.{int(time.time() * 1000)}.json')
+        with open(path, 'w') as fp:
+            json.dump(record, fp, indent=2)
+        logger.error(f'Request {job.run_id} dead-lettered ({reason}) after {job.attempt} attempts: {path}')
+
+        try:
+            notify_failure(job, reason)
+        except Exception as notify_exp:
+            logger.warning(f'Error status of {job.run_id} not sent: {notify_exp}')
+
+        if RetryConfig.DEAD_LETTER_ROUTING_KEY:
+            try:
+                from framework.pika_client import PikaClient
+                with PikaClient() as client:
+                    client.write_message(RetryConfig.DEAD_LETTER_ROUTING_KEY, json.dumps(record))
+            except Exception as publish_exp:
+                logger.warning(f'Dead letter of {job.run_id} not published: {publish_exp}')
+        return path
+
+    def loop(self):
+        while True:
+            with self._condition:
+                while not self.pending or self.pending[0][0] > time.time():
+                    timeout = self.pending[0][0] - time.time() if self.pending else None
+                    self._condition.wait(timeout)
+                _, key, job = heapq.heappop(self.pending)
+                self.in_flight[key] = job
+
+            self.execute(key, job)
+
+    def discard(self, run_id: str) -> int:
+        """
+        Drops the pending retries of a run (e.g. cancelled)
+        @return: number of retries dropped
+        """
+        with self._condition:
+            pending = [entry for entry in self.pending if entry[2].run_id != run_id]
+            discarded = len(self.pending) - len(pending)
+            for _, _, job in self.pending:
+                if job.run_id == run_id:
+                    self.release(job)
+            if discarded:
+                self.pending = pending
+                heapq.heapify(self.pending)
+                self.save()
+        return discarded
+
+    def retain(self, job: RetryJob):
+        """
+        Retains the run of a job from eviction, from the time it's queued until its retry is over
+        """
+        if self.lifecycle_manager is not None:
+            self.lifecycle_manager.retain(job.run_id)
+
+    def release(self, job: RetryJob):
+        if self.lifecycle_manager is not None:
+            self.lifecycle_manager.release(job.run_id)
+
+    def execute(self, key: int, job: RetryJob):
+        """
+        Runs a retry, on the consumer thread if it's an upload and a handoff is set
+        @param key: sequence number of the retry in flight
+        """
+        if job.stage != RetryStage.UPLOAD.value:
+            self.complete(key, job, republish)
+            return
+
+        if self.handoff is not None:
+            try:
+                # the job stays in flight (and saved) until the consumer has run it
+                self.handoff(functools.partial(self.complete, key, job, retry_upload))
+                return
+            except Exception as exp:
+                # the consumer is gone, no run is in progress
+                logger.warning(f'Consumer unavailable, retrying {job.run_id} on the retry thread: {exp}')
+        self.complete(key, job, retry_upload)
+
+    def complete(self, key: int, job: RetryJob, function: Callable[[RetryJob], None]):
+        """
+        Runs a retry in flight, scheduling the next attempt if it fails
+        """
+        try:
+            function(job)
+        except Exception as exp:
+            logger.exception(f'Retry of {job.run_id} failed')
+            self.retry(job, classify_exception(exp, RetryStage(job.stage)), str(exp), exp)
+        finally:
+            with self._condition:
+                self.in_flight.pop(key, None)
+                self.release(job)
+                self.save()
+
+
+def retry_upload(job: RetryJob):
+    """
+    Post-processes and uploads again the outputs of a run, skipping the simulation
+    """
+    from framework.logging_setup import run_context
+    from propagator.run_handler import PropagatorRunHandler
+    from propagator.utils import parse_request_body
+
+    with run_context(job.run_id):
+        runner = PropagatorRunHandler(job.user_id, job.run_id, parse_request_body(job.body),
+                                      datatype_id=job.datatype_id, retry_job=job)
+        with get_lifecycle_manager().running(runner.output_dir):
+            if not restore_run(runner.output_dir):
+                get_retry_queue().dead_letter(job, 'run outputs not available')
+                return
+
+            logger.info(f'Retrying the upload of {job.run_id} (attempt {job.attempt})')
+            runner.run_end_callback()
+
+
+def notify_failure(job: RetryJob, reason: str):
+    """
+    Ends the run of a dead-lettered request with an error status
+    """
+    from propagator.run_handler import PropagatorRunHandler
+
+    error = job.errors[-1] if job.errors else f'{job.run_id} error'
+    runner = PropagatorRunHandler(job.user_id, job.run_id, {}, datatype_id=job.datatype_id)
+    runner.send_error_message(f'{error} ({reason})', type='end')
+
+
+def republish(job: RetryJob):
+    """
+    Republishes a request on the broker, with its attempts in the headers
+    """
+    from pika.spec import BasicProperties
+
+    from framework.pika_client import PikaClient
+
+    properties = BasicProperties(
+        content_type='application/json',
+        delivery_mode=2,
+        timestamp=int(time.time()),
+        headers={
+            ATTEMPT_HEADER: job.attempt,
+            ERRORS_HEADER: json.dumps(job.errors),
+            USER_HEADER: job.user_id,
+        }
+    )
+    with PikaClient() as client:
+        client.write_message(job.routing_key, job.body, properties)
+    logger.info(f'Request {job.run_id} republished (attempt {job.attempt})')
+
+
+_queue = None
+
+
+def get_retry_queue() -> RetryQueue:
+    """
+    Returns the retry queue of the service, starting it on first use
+    """
+    global _queue
+    if _queue is None:
+        _queue = RetryQueue(
+            os.path.join(PropagatorConfig.WORK_DIR, QUEUE_FILE),
+            RetryConfig.DEAD_LETTER_DIR,
+            RetryConfig.MAX_RETRIES,
+            RetryConfig.BASE_DELAY,
+            RetryConfig.MAX_DELAY,
+            RetryConfig.MAX_PENDING,
+            get_lifecycle_manager()
+        )
+        _queue.start()
+    return _queue
@@ -1,25 +1,45 @@
+import copy
+import itertools
 import json
 import logging
 import os
 import shutil
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from os.path import getmtime
-from typing import List, Tuple, Union
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
 
-import geopandas as gpd
-import rasterio as rio
 import shapely
 from pika.spec import BasicProperties
 
-from config import PropagatorConfig
-from framework.data_uploader import (DataUploadException, upload,
-                                     upload_metadata)
+from config import (BurnRastersConfig, FootprintConfig, LifecycleConfig,
+                    PropagatorConfig, TimeSeriesConfig, VectorTilesConfig)
+from framework.data_uploader import DatalakeClient, resource_metadata
 
 from framework.pika_client import PikaClient
-from models.datalake import DatalakeMetadata
-from propagator.utils import mask_on_cutoff
-from propagator.wrapper import Wrapper
+from framework.tracing import inject, span, traced
+from models.datalake import DatalakeMetadata, DatalakeResourceMetadata
+from propagator.footprint import footprint
+from propagator.static_cache import get_static_data_cache
+from propagator.supervisor import (CANCELLED, CANCELLED_STATUS, DRAINED,
+                                   ActiveRun, get_run_supervisor, release_run,
+                                   run_timeout)
+from propagator.lifecycle import (MESSAGE_FILE, PACKAGE_FILE, RUN_FILES,
+                                  get_lifecycle_manager, last_outputs,
+                                  read_run_file, restore_run, run_entries,
+                                  timestep_outputs)
+from propagator.resources import run_limits
+from propagator.retry import (RetryJob, RetryStage, classify_exception,
+                              classify_exit, get_retry_queue)
+from propagator.utils import cutoff_mask, mask_on_cutoff, parse_request_body
+from propagator.vector_tiles import write_vector_tiles
+from propagator.warm_pool import get_warm_pool
+from propagator.wrapper import ErrorCodes, Wrapper
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_RUN_LENGHT = 72
 
@@ -30,6 +50,60 @@ UpdateType = Union['start','update','end','layer']
 class RunException(Exception):
     pass
 
+@dataclass(frozen=True)
+class Product:
+    datatype_id: int
+    output_prefix: str
+    format: str
+
+# products uploaded for a run, in upload order
+PRODUCTS = [
+    Product(35007, 'isochrone', 'GeoJSON'),
+    Product(35010, 'RoS_mean', 'tiff'),
+    Product(35011, 'RoS_max', 'tiff'),
+    Product(35008, 'fireline_intensity_max', 'tiff'),
+    Product(35009, 'fireline_intensity_mean', 'tiff'),
+]
+
+if VectorTilesConfig.ENABLED:
+    PRODUCTS.append(Product(VectorTilesConfig.DATATYPE, 'isochrone', 'MBTiles'))
+
+TIME_SERIES_PREFIX = 'timeseries'
+
+if TimeSeriesConfig.ENABLED:
+    PRODUCTS.append(Product(TimeSeriesConfig.DATATYPE, TIME_SERIES_PREFIX, 'tiff'))
+
+ARRIVAL_TIME_PREFIX = 'arrival_time'
+BURN_PROBABILITY_PREFIX = 'burn_probability'
+
+if BurnRastersConfig.ENABLED:
+    PRODUCTS.append(Product(BurnRastersConfig.ARRIVAL_TIME_DATATYPE, ARRIVAL_TIME_PREFIX, 'tiff'))
+    PRODUCTS.append(Product(BurnRastersConfig.PROBABILITY_DATATYPE, BURN_PROBABILITY_PREFIX, 'tiff'))
+
+# request parameters that don't change the simulation outputs
+OUTPUT_INDEPENDENT_PARAMS = ('name', 'title', 'description', 'datatype_id', 'probabilityRange', 'static_data')
+
+
+def simulation_signature(params: dict) -> str:
+    """
+    Returns the parameters of a request that determine the simulation outputs, serialized:
+    two requests with the same signature give the same outputs
+    """
+    return json.dumps({key: value for key, value in params.items() if key not in OUTPUT_INDEPENDENT_PARAMS},
+                      sort_keys=True, default=str)
+
+
+def stored_signature(run_dir: str) -> Optional[str]:
+    """
+    Returns the simulation signature of the request stored with a run, None if not readable
+    """
+    try:
+        message = read_run_file(run_dir, MESSAGE_FILE)
+        return simulation_signature(parse_request_body(message)) if message is not None else None
+    except Exception as exp:
+        logger.warning(f'Request of {run_dir} not readable: {exp}')
+        return None
+
 @dataclass
 class PropagatorRunHandler:
     user_id: str
@@ -37,6 +111,10 @@ class PropagatorRunHandler:
     params: dict
     
     datatype_id: field(default=DEFAULT_DATATYPE_ID, init=True)
+    # the request with its previous attempts, failures are retried or dead-lettered if set
+    retry_job: RetryJob = None
+    # directory of a published run, the products of a derive request are computed from its outputs
+    stored_run: str = None
 
     output_dir: str = field(init=False)
     title: str = field(init=False)
@@ -44,6 +122,10 @@ class PropagatorRunHandler:
     start_date: datetime = field(init=False)
     end_date: datetime = field(init=False)
     probability_range: float = field(init=False)
+    # the simulation failed, there are no outputs to upload
+    failed: bool = field(init=False, default=False)
+    # supervision of the simulation in progress
+    control: ActiveRun = field(init=False, default=None)
     
 
     _message_properties: BasicProperties = field(init=False)
@@ -51,9 +133,9 @@ class PropagatorRunHandler:
     def __post_init__(self):
         output_dir_rel = os.path.join(PropagatorConfig.WORK_DIR, self.run_id + '.' + str(self.datatype_id))
 
-        self.output_dir = os.path.abspath(output_dir_rel)
+        self.output_dir = os.path.abspath(self.stored_run or output_dir_rel)
 
-        print('output_dir', self.output_dir)
+        logger.debug('output_dir %s', self.output_dir)
 
         
         self.start_date = datetime.now()
@@ -82,22 +164,18 @@ class PropagatorRunHandler:
             message_id=self.run_id
         )
 
-    def send_message(self, 
+    def build_message(self, 
         message: str, 
         status_code: int=200,
         datatype_id: int=None, 
         type: UpdateType='update', 
         urls:List[str]=[],
-        routing_key=None
+        routing_key=None,
+        details:List[dict]=None
         ):
         """
-        Sends a message to the bus
-        @param message: the message to send
-        @param status_code: the status code of the message
-        @param datatype_id: the datatype id
-        @param type: the type of the message
-        @param urls: optional urls
-        @param routing_key: the routing key to use
+        Builds a bus message, see send_message
+        @return: the routing key and the message
         """
         if datatype_id is None:
             datatype_id = self.datatype_id
@@ -112,70 +190,233 @@ class PropagatorRunHandler:
             'urls': urls,
             'message': message
         }
-        logging.info('Sending message', message)
+        if details is not None:
+            message['details'] = details
 
-        with PikaClient(exchange='safers.b2b') as client:
+        return routing_key, message
+
+    def send_message(self, 
+        message: str, 
+        status_code: int=200,
+        datatype_id: int=None, 
+        type: UpdateType='update', 
+        urls:List[str]=[],
+        routing_key=None,
+        details:List[dict]=None
+        ):
+        """
+        Sends a message to the bus
+        @param message: the message to send
+        @param status_code: the status code of the message
+        @param datatype_id: the datatype id
+        @param type: the type of the message
+        @param urls: optional urls
+        @param routing_key: the routing key to use
+        @param details: optional structured details (e.g. validation errors)
+        """
+        routing_key, message = self.build_message(
+            message, status_code, datatype_id, type, urls, routing_key, details)
+        logger.info('Sending message on %s: %s', routing_key, message)
+
+        with span('send_message', routing_key=routing_key), PikaClient(exchange='safers.b2b') as client:
             client.write_message(
                 routing_key=routing_key,
                 message=json.dumps(message),
-                properties=self._message_properties
+                properties=self.message_properties_with_trace()
             )            
 
+    def message_properties_with_trace(self) -> BasicProperties:
+        """
+        Returns the message properties with the trace context in the headers
+        """
+        headers = inject(self._message_properties.headers)
+        if not headers:
+            return self._message_properties
+
+        properties = copy.copy(self._message_properties)
+        properties.headers = headers
+        return properties
+
     def send_error_message(self, 
         message: str, 
         exp:Exception=None, 
         status_code: int=500,
-        type: UpdateType = 'end'):
+        type: UpdateType = 'end',
+        details:List[dict]=None):
         """
         Sends an error message to the bus
         @param message: the message to send
         @param exp: the exception that caused the error
         @param type: the type of the message
+        @param details: optional structured details of the error
         """
         if exp is not None:
             message = f'{message}: {exp}'
 
-        self.send_message(message, status_code=status_code, type=type)
-
-    def upload_and_notify(
-            self, 
-            metadata_id: str, 
-            file_path: str, 
-            start_date: datetime, 
-            end_date: datetime, 
-            format: str,
-            datatype_resource: int
-        ) -> str:
-        """
-        Uploads a file to the datalake and notifies the bus about it
-        @param metadata_id: the metadata id of the file
-        @param file_path: the path of the file to upload
-        @param start_date: the start date of the file
-        @param end_date: the end date of the file
-        @param file_type: the file type
-        @param datatype_resource: the datatype resource
-        @return: the url of the uploaded file
-        """
-        url = upload(
-            metadata_id, 
-            file_path, 
-            start_date,
-            end_date, 
-            format, 
-            request_code=self.run_id, 
-            datatype_resource=datatype_resource
-        )
+        self.send_message(message, status_code=status_code, type=type, details=details)
 
-        data_routing_key = f'status.propagator.{datatype_resource}.{self.run_id}'
-        self.send_message(
+    def schedule_retry(self, message: str, stage: Optional[RetryStage], exp: Exception = None) -> bool:
+        """
+        Schedules the retry of a failed stage of the run, the request is dead-lettered if it
+        can't be retried
+        @param message: description of the failure
+        @param stage: stage to retry, None if the failure is not retryable
+        @param exp: exception of the failure
+        @return: True if a retry is scheduled
+        """
+        if self.retry_job is None:
+            return False
+        return get_retry_queue().retry(self.retry_job, stage, message, exp)
+
+    def retry_or_fail(self, message: str, stage: Optional[RetryStage], exp: Exception = None):
+        """
+        Schedules the retry of a failed stage of the run, or ends the run with an error
+        """
+        if exp is not None:
+            message = f'{message}: {exp}'
+
+        if self.retry_job is None:
+            self.send_error_message(message, type='end')
+        elif self.schedule_retry(message, stage, exp):
+            self.send_message(f'{message}, retrying', status_code=500, type='update')
+        # otherwise the request is dead-lettered, the retry queue ends the run with the error
+
+    def stopped_run(self, reason: str) -> Optional[Tuple[str, int, UpdateType]]:
+        """
+        Cancels, releases or fails a run whose simulation was stopped by the supervisor
+        @param reason: CANCELLED, DRAINED or the timeout
+        @return: message, status code and type of the status message to send, None if the
+        request is dead-lettered (the retry queue sends the error)
+        """
+        message = f'{self.run_id} error: {reason}'
+        if reason == CANCELLED:
+            return CANCELLED, CANCELLED_STATUS, 'end'
+        if self.retry_job is None:
+            return message, 500, 'end'
+        if reason == DRAINED:
+            if release_run(self.retry_job):
+                return f'{self.run_id} released for another node', 503, 'update'
+            # neither republished nor queued: dead-lettered
+            return None
+
+        # not retried: a simulation past its timeout would likely get stuck again
+        self.schedule_retry(message, None)
+        return None
+
+    def end_stopped_run(self, reason: str):
+        status = self.stopped_run(reason)
+        if status is not None:
+            message, status_code, type = status
+            self.send_message(message, status_code=status_code, type=type)
+
+    def resource_files(self, product_files: List[Tuple[Product, str]]) -> List[Tuple[str, DatalakeResourceMetadata]]:
+        """
+        Returns the datalake resource metadata of each product file
+        @param product_files: list of (product, file path)
+        @return: list of (file path, resource metadata)
+        """
+        return [
+            (product_file, resource_metadata(
+                product_file,
+                self.start_date,
+                self.end_date,
+                format=product.format,
+                request_code=self.run_id,
+                datatype_resource=product.datatype_id
+            ))
+            for product, product_file in product_files
+        ]
+
+    def package_resources(self, product_files: List[Tuple[Product, str]], urls: List[str]) -> List[dict]:
+        return [
+            {
+                'datatype_id': product.datatype_id,
+                'file': os.path.basename(product_file),
+                'url': url,
+                'probability_range': self.probability_range,
+            }
+            for (product, product_file), url in zip(product_files, urls)
+        ]
+
+    def save_package(self, package_id: str, product_files: List[Tuple[Product, str]], urls: List[str],
+                     spatial: dict = None):
+        """
+        Stores the datalake package of the run and the urls of its products in the run directory
+        @param spatial: spatial extent of the package
+        """
+        self.write_package({
+            'package_id': package_id,
+            'spatial': spatial,
+            'resources': self.package_resources(product_files, urls)
+        })
+
+    def write_package(self, package: dict):
+        with open(os.path.join(self.output_dir, PACKAGE_FILE), 'w') as fp:
+            json.dump(package, fp)
+
+    def load_package(self) -> Optional[dict]:
+        """
+        Returns the datalake package stored in the run directory, None if the run is not published
+        """
+        package_file = os.path.join(self.output_dir, PACKAGE_FILE)
+        if not os.path.exists(package_file):
+            return None
+        with open(package_file) as fp:
+            return json.load(fp)
+
+    def published_products(self, package: dict) -> Tuple[List[Tuple[Product, str]], List[str]]:
+        """
+        Returns the products of a stored package
+        @return: list of (product, file path) and the urls of the products
+        """
+        products = {product.datatype_id: product for product in PRODUCTS}
+        product_files = [
+            (products[resource['datatype_id']], os.path.join(self.output_dir, resource['file']))
+            for resource in package['resources']
+        ]
+        return product_files, [resource['url'] for resource in package['resources']]
+
+    def product_message(self, datatype_resource: int, url: str) -> dict:
+        """
+        Returns the arguments of send_message notifying that a product of the run is available
+        @param datatype_resource: the datatype of the product
+        @param url: the url of the uploaded file
+        """
+        return dict(
             message=f'{self.run_id} completed',
             datatype_id=datatype_resource,
             type='end',
             status_code=200,
-            routing_key=data_routing_key,
+            routing_key=f'status.propagator.{datatype_resource}.{self.run_id}',
             urls=[url]
         )
-        return url
+
+    def completion_messages(self, product_files: List[Tuple[Product, str]], urls: List[str]) -> List[dict]:
+        """
+        Returns the arguments of send_message for the products of the run, then for the end
+        of the run when the default datatype was requested
+        @param product_files: list of (product, file path) uploaded
+        @param urls: the urls of the products
+        """
+        messages = [self.product_message(product.datatype_id, url) for (product, _), url in zip(product_files, urls)]
+        if self.datatype_id == DEFAULT_DATATYPE_ID:
+            messages.append(dict(message=f'{self.run_id} completed', urls=urls, status_code=200, type='end'))
+        return messages
+
+    def notify_product(self, datatype_resource: int, url: str):
+        """
+        Notifies the bus that a product of the run is available
+        @param datatype_resource: the datatype of the product
+        @param url: the url of the uploaded file
+        """
+        self.send_message(**self.product_message(datatype_resource, url))
+
+    def notify_products(self, product_files: List[Tuple[Product, str]], urls: List[str]):
+        """
+        Notifies the products of the run and its end, see completion_messages
+        """
+        for message in self.completion_messages(product_files, urls):
+            self.send_message(**message)
 
     def run_progress_callback(self, progress_message: str):
         """
@@ -185,84 +426,465 @@ class PropagatorRunHandler:
         #self.send_message(progress_message, type='update')
         pass
 
+    def requested_products(self) -> List[Product]:
+        """
+        Returns the products to compute and upload for the requested datatype
+        """
+        return [
+            product for product in PRODUCTS
+            if self.datatype_id == DEFAULT_DATATYPE_ID or self.datatype_id == product.datatype_id
+        ]
+
+    @traced()
+    def prepare_isochrones(self):
+        """
+        Extracts the isochrones for the requested probability and their footprint
+        @return: isochrones geodataframe, isochrones file and footprint geojson
+        @raise ValueError: if no isochrone is available for the requested probability
+        """
+        isochrone_file = self.get_last_file('isochrone', 'geojson')
+        # extract isochrone file for value threshold
+        isochrones_gdf, isochrone_file = self.extract_isochrones(isochrone_file)
+        footprint_geojson = self.get_footprint(isochrones_gdf)
+
+        return isochrones_gdf, isochrone_file, footprint_geojson
+
+    def prepare_product_files(self, isochrones_gdf: 'gpd.GeoDataFrame', isochrone_file: str,
+                              products: List[Product] = None) -> List[Tuple[Product, str]]:
+        """
+        Computes the files of the requested products (rasters and time series are masked on
+        the isochrones, vector tiles and burn rasters are generated from them)
+        @param isochrones_gdf: isochrones for the requested probability
+        @param isochrone_file: path to the filtered isochrones file
+        @param products: products to compute, the requested ones by default
+        @return: list of (product, file path)
+        """
+        product_files = []
+        burn_rasters = None
+        for product in products if products is not None else self.requested_products():
+            if product.format == 'GeoJSON':
+                product_file = isochrone_file
+            elif product.format == 'MBTiles':
+                try:
+                    with span('vector_tiles', datatype=product.datatype_id):
+                        product_file = self.write_vector_tiles(isochrones_gdf)
+                except ImportError as exp:
+                    logger.warning(f'Vector tiles skipped, mapbox_vector_tile is not available: {exp}')
+                    continue
+            elif product.output_prefix == TIME_SERIES_PREFIX:
+                with span('time_series', datatype=product.datatype_id):
+                    product_file = self.write_time_series(isochrones_gdf)
+            elif product.output_prefix in (ARRIVAL_TIME_PREFIX, BURN_PROBABILITY_PREFIX):
+                if burn_rasters is None:
+                    # both rasters come from the same contours, read once
+                    with span('burn_rasters', datatype=product.datatype_id):
+                        burn_rasters = self.write_burn_rasters()
+                product_file = burn_rasters[product.output_prefix]
+            else:
+                product_file = self.get_last_file(product.output_prefix, 'tiff')
+                with span('mask_on_cutoff', datatype=product.datatype_id):
+                    product_file = mask_on_cutoff(
+                        product_file, isochrones_gdf, self.probability_range, self.cutoff_file(product_file))
+            product_files.append((product, product_file))
+
+        return product_files
+
+    def cutoff_file(self, values_file: str) -> Optional[str]:
+        """
+        Returns the path of the masked copy of a raster, None for the default one
+        """
+        if self.stored_run is None:
+            return None
+        # derived products carry their probability, so that the published ones are not replaced
+        root, ext = os.path.splitext(values_file)
+        return f'{root}_cutoff_{self.probability_range}{ext}'
+
+    def write_vector_tiles(self, isochrones_gdf: 'gpd.GeoDataFrame') -> str:
+        """
+        Packages the isochrones as vector tiles in an MBTiles archive
+        @return: path of the archive
+        """
+        return write_vector_tiles(
+            f'{self.output_dir}/isochrone_{self.probability_range}.mbtiles',
+            isochrones_gdf.geometry.to_numpy(),
+            isochrones_gdf.drop(columns=isochrones_gdf.geometry.name).to_dict('records'),
+            name=f'{self.run_id} isochrones',
+            min_zoom=VectorTilesConfig.MIN_ZOOM,
+            max_zoom=VectorTilesConfig.MAX_ZOOM,
+            extent=VectorTilesConfig.EXTENT,
+            buffer=VectorTilesConfig.BUFFER
+        )
+
+    def timestep_files(self, output_prefix: str, output_type: str = 'tiff') -> List[Tuple[int, str]]:
+        """
+        Returns the outputs written by PROPAGATOR for each timestep of a variable
+        @param output_prefix: prefix of the variable
+        @param output_type: extension of the outputs
+        @return: list of (minutes, file path) in time order
+        """
+        return timestep_outputs(self.output_dir, output_prefix, output_type)
+
+    def source_prefixes(self) -> List[str]:
+        """
+        Returns the simulation outputs the requested products are computed from
+        """
+        # every product is cut on the isochrones
+        prefixes = {'isochrone'}
+        for product in self.requested_products():
+            if product.output_prefix == TIME_SERIES_PREFIX:
+                prefixes.update(TimeSeriesConfig.VARIABLES)
+            elif product.output_prefix in (ARRIVAL_TIME_PREFIX, BURN_PROBABILITY_PREFIX):
+                prefixes.add(BurnRastersConfig.GRID_VARIABLE)
+            elif product.format == 'tiff':
+                prefixes.add(product.output_prefix)
+        return sorted(prefixes)
+
+    def needs_all_timesteps(self) -> bool:
+        """
+        Returns True if a requested product is computed from every timestep of the outputs,
+        which the compaction of a run doesn't keep
+        """
+        return any(
+            product.output_prefix in (TIME_SERIES_PREFIX, ARRIVAL_TIME_PREFIX, BURN_PROBABILITY_PREFIX)
+            for product in self.requested_products()
+        )
+
+    def reuse_simulation(self) -> bool:
+        """
+        Links in the output directory the outputs of a completed simulation of the same run,
+        requested for another datatype with the same simulation parameters, so that the
+        requested products are computed without simulating again
+        @return: True if the outputs are available
+        """
+        lifecycle_manager = get_lifecycle_manager()
+        prefixes = self.source_prefixes()
+        signature = simulation_signature(self.params)
+        for run_dir in run_entries(PropagatorConfig.WORK_DIR, self.run_id):
+            if run_dir == self.output_dir or lifecycle_manager.is_running(run_dir):
+                continue
+            if stored_signature(run_dir) != signature:
+                # resubmitted with other ignitions, duration or weather
+                continue
+
+            with lifecycle_manager.running(run_dir):
+                # compacted runs are extracted for the time of the copy, their archive stays
+                archived = not os.path.isdir(run_dir)
+                if archived and self.needs_all_timesteps():
+                    continue
+                try:
+                    if not restore_run(run_dir) or not os.path.exists(os.path.join(run_dir, PACKAGE_FILE)):
+                        # not completed
+                        continue
+                    outputs = [timestep_outputs(run_dir, prefix) for prefix in prefixes]
+                    if not all(outputs):
+                        continue
+
+                    os.makedirs(self.output_dir, exist_ok=True)
+                    for _, path in itertools.chain.from_iterable(outputs):
+                        target = os.path.join(self.output_dir, os.path.basename(path))
+                        if os.path.exists(target):
+                            continue
+                        try:
+                            os.link(path, target)
+                        except OSError:
+                            shutil.copy2(path, target)
+                finally:
+                    if archived:
+                        shutil.rmtree(run_dir, ignore_errors=True)
+
+            logger.info(f'Outputs of {run_dir} reused for datatype {self.datatype_id}')
+            return True
+        return False
+
+    def write_time_series(self, isochrones_gdf: 'gpd.GeoDataFrame') -> str:
+        """
+        Stacks all the timesteps of the time series variables in one multi-band raster,
+        masked on the isochrones; each band is tagged with its variable and time
+        @return: path of the time series raster
+        """
+        from propagator.raster_output import write_time_series
+
+        bands = [
+            ({
+                'variable': output_prefix,
+                'minutes': minutes,
+                'time': (self.start_date + timedelta(minutes=minutes)).isoformat(),
+            }, path)
+            for output_prefix in TimeSeriesConfig.VARIABLES
+            for minutes, path in self.timestep_files(output_prefix)
+        ]
+        if not bands:
+            raise ValueError('No timestep outputs for the time series')
+
+        return write_time_series(
+            f'{self.output_dir}/{TIME_SERIES_PREFIX}_{self.probability_range}.tiff',
+            bands,
+            mask=lambda shape, transform: cutoff_mask(isochrones_gdf, shape, transform)
+        )
+
+    def write_burn_rasters(self) -> dict:
+        """
+        Rasterizes the isochrones of all the timesteps on the simulation grid: the first
+        arrival time (minutes) of the fire at the requested probability and the maximum
+        probability reached by each cell
+        @return: path of the rasters by output prefix
+        """
+        import numpy as np
+        import rasterio as rio
+
+        from propagator.burn_rasters import (NOT_REACHED, first_arrival,
+                                             max_probability, read_contours)
+        from propagator.raster_output import write_masked_raster
+
+        grid_files = self.timestep_files(BurnRastersConfig.GRID_VARIABLE)
+        if not grid_files:
+            raise ValueError(f'No {BurnRastersConfig.GRID_VARIABLE} output for the burn rasters grid')
+        with rio.open(grid_files[-1][1]) as src:
+            profile = src.profile
+
+        out_shape = (profile['height'], profile['width'])
+        polygons, times, values = read_contours(self.timestep_files('isochrone', 'geojson'))
+        at_probability = np.isclose(values, self.probability_range)
+
+        arrival = first_arrival(polygons[at_probability], times[at_probability], out_shape, profile['transform'])
+        probability = max_probability(polygons, values, out_shape, profile['transform'])
+
+        return {
+            ARRIVAL_TIME_PREFIX: write_masked_raster(
+                f'{self.output_dir}/{ARRIVAL_TIME_PREFIX}_{self.probability_range}.tiff',
+                arrival, arrival != NOT_REACHED, dict(profile, dtype=arrival.dtype.name)
+            ),
+            BURN_PROBABILITY_PREFIX: write_masked_raster(
+                f'{self.output_dir}/{BURN_PROBABILITY_PREFIX}.tiff',
+                probability, probability > 0, dict(profile, dtype=probability.dtype.name)
+            ),
+        }
+
+    def build_metadata(self, footprint_geojson: dict) -> DatalakeMetadata:
+        """
+        Builds the datalake metadata of the run
+        @param footprint_geojson: spatial extent of the run
+        """
+        return DatalakeMetadata(
+            title=self.title, 
+            notes=self.notes,
+            data_temporal_extent_begin_date=self.start_date,
+            data_temporal_extent_end_date=self.end_date,
+            temporalReference_dateOfPublication=datetime.now(),
+            temporalReference_dateOfLastRevision=datetime.now(),
+            temporalReference_dateOfCreation=datetime.now(),
+            temporalReference_date=self.start_date,
+            spatial=footprint_geojson,
+            external_attributes={
+                'request_code': self.run_id
+            }
+        )
+
+    @traced()
     def run_end_callback(self):
         """
         Callback to be called when the run is finished
-        """            
-        try:
-            isochrone_file = self.get_last_file('isochrone', 'geojson')
-            # extract isochrone file for value threshold
-            isochrones_gdf, isochrone_file = self.extract_isochrones(isochrone_file)
-            bbox_geojson = self.get_bbox(isochrones_gdf)
+        """
+        if self.control is not None and self.control.stop_reason is not None:
+            self.end_stopped_run(self.control.stop_reason)
+            return
 
-        except ValueError:
-            message = 'LOW_PROBABILITY'
-            self.send_error_message(message, type='end', status_code=500)
+        if self.failed:
+            # the simulation error is already retried or reported
             return
+
+        # a previous attempt may have published the products and failed to notify them
+        package = None
+        if self.retry_job is not None and self.retry_job.stage == RetryStage.UPLOAD.value:
+            package = self.load_package()
+
+        if package is None:
+            try:
+                isochrones_gdf, isochrone_file, footprint_geojson = self.prepare_isochrones()
+
+            except ValueError:
+                message = 'LOW_PROBABILITY'
+                self.send_error_message(message, type='end', status_code=500)
+                return
         
         try:
-
-            metadata = DatalakeMetadata(
-                title=self.title, 
-                notes=self.notes,
-                data_temporal_extent_begin_date=self.start_date,
-                data_temporal_extent_end_date=self.end_date,
-                temporalReference_dateOfPublication=datetime.now(),
-                temporalReference_dateOfLastRevision=datetime.now(),
-                temporalReference_dateOfCreation=datetime.now(),
-                temporalReference_date=self.start_date,
-                spatial=bbox_geojson,
-                external_attributes={
-                    'request_code': self.run_id
-                }
-            )
-            metadata_id = upload_metadata(metadata)
-
-            urls = []
-
-            if self.datatype_id == DEFAULT_DATATYPE_ID or self.datatype_id == 35007:
-                isochrone_res_url = self.upload_and_notify(metadata_id, isochrone_file, self.start_date,
-                                        self.end_date, 'GeoJSON', datatype_resource=35007)
-                urls.append(isochrone_res_url)
-
-            if self.datatype_id == DEFAULT_DATATYPE_ID or self.datatype_id == 35010:
-                ros_mean_file = self.get_last_file('RoS_mean', 'tiff')
-                ros_mean_file = mask_on_cutoff(ros_mean_file, isochrones_gdf, self.probability_range)
-                ros_mean_res_url = self.upload_and_notify(metadata_id, ros_mean_file, self.start_date, self.end_date, 'tiff', datatype_resource=35010)
-                urls.append(ros_mean_res_url)
-
-            if self.datatype_id == DEFAULT_DATATYPE_ID or self.datatype_id == 35010:
-                ros_max_file = self.get_last_file('RoS_max', 'tiff')
-                ros_max_file = mask_on_cutoff(ros_max_file, isochrones_gdf, self.probability_range)
-                ros_max_res_url = self.upload_and_notify(metadata_id, ros_max_file, self.start_date, self.end_date, 'tiff', datatype_resource=35011)
-                urls.append(ros_max_res_url)
-
-            if self.datatype_id == DEFAULT_DATATYPE_ID or self.datatype_id == 35008:
-                fireline_intensity_max_file = self.get_last_file('fireline_intensity_max', 'tiff')
-                fireline_intensity_max_file = mask_on_cutoff(fireline_intensity_max_file, isochrones_gdf, self.probability_range)
-                intensity_mean_res_url = self.upload_and_notify(metadata_id, fireline_intensity_max_file, self.start_date, self.end_date, 'tiff', datatype_resource=35008)
-                urls.append(intensity_mean_res_url)
-
-            if self.datatype_id == DEFAULT_DATATYPE_ID or self.datatype_id == 35009:
-                fireline_intensity_mean_file = self.get_last_file('fireline_intensity_mean', 'tiff')
-                fireline_intensity_mean_file = mask_on_cutoff(fireline_intensity_mean_file, isochrones_gdf, self.probability_range)
-                intensity_max_res_url = self.upload_and_notify(metadata_id, fireline_intensity_mean_file, self.start_date, self.end_date, 'tiff', datatype_resource=35009)
-                urls.append(intensity_max_res_url)
-
-            if self.datatype_id == DEFAULT_DATATYPE_ID:                
-                message = f'{self.run_id} completed'
-                self.send_message(message, urls=urls, status_code=200, type='end')
+            if package is None:
+                product_files = self.prepare_product_files(isochrones_gdf, isochrone_file)
+
+                metadata = self.build_metadata(footprint_geojson)
+                with span('upload', files=len(product_files)):
+                    metadata_id, urls = DatalakeClient().publish(metadata, self.resource_files(product_files))
+                self.save_package(metadata_id, product_files, urls, footprint_geojson)
+            else:
+                product_files, urls = self.published_products(package)
+
+            self.notify_products(product_files, urls)
+            self.compact_outputs(product_files)
         
         except Exception as exp:
-            message = f'{self.run_id} error: {exp}'
-            self.send_error_message(message, exp=exp, type='end')
+            # the outputs stay on disk: a retry only redoes the post-processing and the upload
+            self.retry_or_fail(f'{self.run_id} error', classify_exception(exp, RetryStage.UPLOAD), exp)
+
+    def compact_outputs(self, product_files: List[Tuple[Product, str]]):
+        """
+        Schedules the compaction of the run directory once its products are uploaded:
+        the request, the parameters, the uploaded files and the last output of each
+        product are archived, intermediate timesteps are dropped
+        @param product_files: list of (product, file path) uploaded
+        """
+        if not LifecycleConfig.COMPACT:
+            return
+
+        keep = [product_file for _, product_file in product_files]
+        keep += [os.path.join(self.output_dir, name) for name in RUN_FILES + (self.run_id + '.json',)]
+        keep += last_outputs(self.output_dir, [product.output_prefix for product in PRODUCTS])
+        get_lifecycle_manager().schedule_compaction(self.output_dir, keep)
 
-    def run_error_callback(self, error):
+    def restore_stored_run(self) -> Optional[dict]:
         """
-        Callback for error: sends error message to the queue
+        Restores the published run the products of a derive request are computed from
+        @return: its datalake package, None if the outputs needed are not available
+        """
+        if not os.path.isdir(self.output_dir) and self.needs_all_timesteps():
+            # the compaction kept the last timestep only
+            return None
+        if not restore_run(self.output_dir):
+            return None
+        return self.load_package()
+
+    def derive_product_files(self, package: dict, isochrones_gdf: 'gpd.GeoDataFrame', isochrone_file: str
+                             ) -> Tuple[List[Tuple[Product, str]], Tuple[List[Tuple[Product, str]], List[str]]]:
+        """
+        Computes the requested products that the package of the stored run doesn't have yet
+        @return: list of (product, file path) to upload, and the requested products already
+        published with their urls
+        """
+        requested = self.requested_products()
+        published = {(resource['datatype_id'], resource.get('probability_range')) for resource in package['resources']}
+        product_files = self.prepare_product_files(isochrones_gdf, isochrone_file, [
+            product for product in requested if (product.datatype_id, self.probability_range) not in published
+        ])
+
+        # products that don't depend on the parameters (e.g. the burn probability) are the published ones
+        published_files = {resource['file'] for resource in package['resources']}
+        computed_files = {os.path.basename(product_file) for _, product_file in product_files}
+        datatypes = {product.datatype_id for product in requested}
+        reused = [
+            resource for resource in package['resources']
+            if resource['datatype_id'] in datatypes and (
+                resource.get('probability_range') == self.probability_range or resource['file'] in computed_files)
+        ]
+        product_files = [
+            (product, product_file) for product, product_file in product_files
+            if os.path.basename(product_file) not in published_files
+        ]
+        return product_files, self.published_products({'resources': reused})
+
+    def extended_extent(self, package: dict, footprint_geojson: dict) -> Optional[dict]:
+        """
+        Returns the spatial extent of the package grown to cover the derived products,
+        None if it covers them already
+        """
+        if package.get('spatial') is None:
+            # the extent of a package stored before it was recorded is not known
+            return None
+        current = shapely.geometry.shape(package['spatial'])
+        derived = shapely.geometry.shape(footprint_geojson)
+        if current.covers(derived):
+            return None
+        return self.footprint_geojson([current, derived])
+
+    def add_derived_products(self, package: dict, product_files: List[Tuple[Product, str]], urls: List[str],
+                             spatial: dict = None) -> dict:
+        """
+        Stores the derived products in the package of the stored run
+        @return: the updated package
+        """
+        package = dict(package, resources=package['resources'] + self.package_resources(product_files, urls))
+        if spatial is not None:
+            package['spatial'] = spatial
+        self.write_package(package)
+        return package
+
+    def release_stored_run(self, restored: bool, package: dict = None):
+        """
+        Compacts the stored run again once derived products are added to its package, or drops
+        the copy restored from its archive if nothing was added
+        @param restored: the run directory was restored from its archive
+        @param package: the updated package, None if nothing was added
+        """
+        if package is not None:
+            self.compact_outputs(self.published_products(package)[0])
+        elif restored:
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    @traced('derive_products')
+    def derive_products(self):
+        """
+        Computes the requested products from the outputs of the stored run, for the parameters
+        of the request, and adds them to its datalake package: the simulation is not run again
+        """
+        with get_lifecycle_manager().running(self.output_dir):
+            restored = not os.path.isdir(self.output_dir)
+            package = self.restore_stored_run()
+            if package is None:
+                self.send_error_message('OUTPUTS_NOT_AVAILABLE', type='end', status_code=404)
+                return
+
+            derived = None
+            try:
+                derived = self.publish_derived_products(package)
+            finally:
+                self.release_stored_run(restored, derived)
+
+    def publish_derived_products(self, package: dict) -> Optional[dict]:
+        """
+        Computes and uploads the derived products, then notifies them with the requested
+        products already published
+        @return: the updated package, None if no product was added
+        """
+        try:
+            isochrones_gdf, isochrone_file, footprint_geojson = self.prepare_isochrones()
+        except ValueError:
+            self.send_error_message('LOW_PROBABILITY', type='end', status_code=500)
+            return None
+
+        try:
+            product_files, (published_files, published_urls) = self.derive_product_files(
+                package, isochrones_gdf, isochrone_file)
+
+            derived, urls = None, []
+            if product_files:
+                client = DatalakeClient()
+                spatial = self.extended_extent(package, footprint_geojson)
+                with span('upload', files=len(product_files)):
+                    if spatial is not None:
+                        client.patch_package(package['package_id'], spatial=spatial)
+                    urls = client.add_resources(package['package_id'], self.resource_files(product_files))
+                derived = self.add_derived_products(package, product_files, urls, spatial)
+
+            self.notify_products(published_files + product_files, published_urls + urls)
+            return derived
+
+        except Exception as exp:
+            # a retry republishes the request, which is derived again
+            self.retry_or_fail(f'{self.run_id} error', classify_exception(exp, RetryStage.RUN), exp)
+            return None
+
+    def run_error_callback(self, error, error_code: ErrorCodes = ErrorCodes.GENERIC_ERROR,
+                           returncode: int = None, stderr: str = ''):
+        """
+        Callback for error: retries the run or sends error message to the queue
         @param error: error message
+        @param error_code: exit error code of the simulation
+        @param returncode: exit status of the simulation
+        @param stderr: error output of the simulation
         """
-        self.send_error_message(f'{self.run_id} error: {error}', type='end')
+        self.failed = True
+        if self.control is not None and self.control.stop_reason is not None:
+            # stopped by the supervisor, handled at the end of the run
+            return
+        self.retry_or_fail(f'{self.run_id} error: {error}', classify_exit(error_code, returncode, stderr))
 
 
     def get_last_file(self, output_prefix: str, output_type: str):
@@ -271,19 +893,12 @@ class PropagatorRunHandler:
         @param output_prefix: prefix of the file
         @param output_type: type of the file
         """
-        output_files = os.listdir(self.output_dir)
-        
-        files = list(
-            map(lambda f: f'{self.output_dir}/{f}',
-                filter(lambda f: f.startswith(output_prefix) and f.endswith(output_type), 
-                output_files
-        )))
-
-        files.sort(key=lambda f: getmtime(f))
+        # the last timestep, files derived from the outputs (e.g. masked copies) are excluded
+        files = self.timestep_files(output_prefix, output_type)
         if len(files) == 0:
             raise ValueError()
 
-        last_file = files[-1]
+        _, last_file = files[-1]
         return last_file
 
     def extract_isochrones(self, isochrone_file: str):
@@ -291,6 +906,8 @@ class PropagatorRunHandler:
         Extracts isochrones with desired value from the isochrone file and saves them to a new file
         @param isochrone_file: path to the isochrone file
         """
+        import geopandas as gpd
+
         gdf = gpd.read_file(isochrone_file)
         # filter out features with property 'value' == self.probabilityRange
         try:
@@ -306,39 +923,99 @@ class PropagatorRunHandler:
 
         return gdf, isochrone_file
 
-    def get_bbox(self, gdf: gpd.GeoDataFrame):
+    def get_footprint(self, gdf: 'gpd.GeoDataFrame') -> dict:
         """
-        Returns bounding box of the isochrones
+        Returns the footprint of the isochrones, with the method configured for the datatype
         """
-        # save filtered features to new file
-        lonmin, latmin, lonmax, latmax = gdf.total_bounds            
-        shapely_polygon = shapely.geometry.box(lonmin, latmin, lonmax, latmax)
-        bbox_geojson = shapely.geometry.mapping(shapely_polygon)            
-
-        return bbox_geojson
+        return self.footprint_geojson(gdf.geometry.to_numpy())
+
+    def footprint_geojson(self, geometries) -> dict:
+        method = FootprintConfig.METHODS.get(self.datatype_id, FootprintConfig.METHOD)
+        polygon = footprint(
+            geometries,
+            method,
+            max_vertices=FootprintConfig.MAX_VERTICES,
+            ratio=FootprintConfig.CONCAVE_RATIO
+        )
+        return shapely.geometry.mapping(polygon)
 
-    def run_propagator(self):
+    def write_param_file(self) -> str:
+        """
+        Creates the output directory and writes the PROPAGATOR parameter file
+        @return: path to the parameter file
+        """
         os.makedirs(self.output_dir, exist_ok=True)
 
+        static_data_cache = get_static_data_cache()
+        if static_data_cache is not None and 'domain_bbox' in self.params:
+            try:
+                self.params['static_data'] = static_data_cache.acquire(self.params['domain_bbox'])
+            except Exception as exp:
+                logger.warning(f'Static data cache unavailable, using PROPAGATOR defaults: {exp}')
+
         param_file = os.path.join(self.output_dir, self.run_id + '.json')
         with open(param_file, 'w') as fp:
             json.dump(self.params, fp)
 
+        return param_file
+
+    @contextmanager
+    def using_static_data(self):
+        """
+        Releases the static data crops acquired for the parameter file at the end of the context,
+        once the simulation is over
+        """
+        try:
+            yield
+        finally:
+            static_data = self.params.pop('static_data', None)
+            if static_data is not None:
+                get_static_data_cache().release(static_data)
+
+    def build_command(self, param_file: str) -> List[str]:
+        """
+        Builds the PROPAGATOR command line
+        @param param_file: path to the parameter file
+        """
         propagator_main = os.path.join(PropagatorConfig.PROPAGATOR_DIR, 'main.py')
 
-        wrapper = Wrapper(
-            program_cmd=[
-                PropagatorConfig.PYTHON_PATH,
-                '-u', propagator_main,
-                '-id', self.run_id,
-                '-f', param_file,
-                '-of', self.output_dir,
-                '-tl', str((self.end_date - self.start_date).seconds//3600)
-            ], 
-            cwd=PropagatorConfig.PROPAGATOR_DIR,
-            end_callback=self.run_end_callback,
-            progress_callback=self.run_progress_callback,
-            error_callback=self.run_error_callback
-        )
+        return [
+            PropagatorConfig.PYTHON_PATH,
+            '-u', propagator_main,
+            '-id', self.run_id,
+            '-f', param_file,
+            '-of', self.output_dir,
+            '-tl', str((self.end_date - self.start_date).seconds//3600)
+        ]
 
-        wrapper.start()
+    def run_propagator(self):
+        with span('run_propagator', run_id=self.run_id, datatype=self.datatype_id):
+            with get_lifecycle_manager().running(self.output_dir):
+                if self.reuse_simulation():
+                    self.run_end_callback()
+                    return
+
+            param_file = self.write_param_file()
+            timeout = run_timeout((self.end_date - self.start_date).total_seconds() / 60)
+
+            with self.using_static_data(), \
+                    get_lifecycle_manager().running(self.output_dir), \
+                    get_run_supervisor().supervise(self.run_id, timeout) as self.control, \
+                    run_limits() as limits:
+                if self.control.stop_reason is not None:
+                    # cancelled before it started
+                    self.end_stopped_run(self.control.stop_reason)
+                    return
+
+                wrapper = Wrapper(
+                    program_cmd=self.build_command(param_file), 
+                    cwd=PropagatorConfig.PROPAGATOR_DIR,
+                    end_callback=self.run_end_callback,
+                    progress_callback=self.run_progress_callback,
+                    error_callback=self.run_error_callback,
+                    pool=get_warm_pool(),
+                    limits=limits,
+                    control=self.control
+                )
+
+                wrapper.start()
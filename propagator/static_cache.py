@@ -0,0 +1,212 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import PropagatorConfig, StaticDataConfig
+
+logger = logging.getLogger(__name__)
+
+BBox = Tuple[float, float, float, float]
+
+
+def snap_bbox(bbox: BBox, tile_size: float) -> BBox:
+    """
+    Expands a lon/lat bounding box to the tile grid, so that runs in the same area share the crops
+    @param bbox: lonmin, latmin, lonmax, latmax
+    @param tile_size: tile size in degrees
+    """
+    lonmin, latmin, lonmax, latmax = bbox
+    return (
+        math.floor(lonmin / tile_size) * tile_size,
+        math.floor(latmin / tile_size) * tile_size,
+        math.ceil(lonmax / tile_size) * tile_size,
+        math.ceil(latmax / tile_size) * tile_size,
+    )
+
+
+class StaticDataCache:
+    """
+    Local cache of the static inputs of PROPAGATOR (DEM, fuel, vegetation...) cropped on
+    the domain of the runs. Crops are stored as memory-mappable .npy arrays with a json
+    sidecar (transform, crs, nodata), keyed by layer, domain tile and resolution, and
+    evicted in least recently used order when the cache exceeds its disk budget. The crops
+    acquired by the runs in progress are not evicted until released.
+    """
+    def __init__(self, cache_dir: str, layers: Dict[str, str], budget: int, tile_size: float):
+        self.cache_dir = cache_dir
+        self.layers = layers
+        self.budget = budget
+        self.tile_size = tile_size
+        # crops in use, with the number of runs using them
+        self.active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_key(self, source: str, bbox: BBox, resolution: Tuple[float, float]) -> str:
+        signature = json.dumps([os.path.abspath(source), os.path.getmtime(source), bbox, resolution])
+        return hashlib.sha1(signature.encode()).hexdigest()
+
+    def crop(self, source: str, bbox: BBox, array_file: str) -> dict:
+        """
+        Crops a source raster on a lon/lat bounding box and stores it as .npy
+        @return: the sidecar metadata
+        """
+        import rasterio as rio
+        from rasterio.warp import transform_bounds
+        from rasterio.windows import Window, from_bounds
+
+        with rio.open(source) as src:
+            bounds = transform_bounds('EPSG:4326', src.crs, *bbox) if src.crs else bbox
+            window = from_bounds(*bounds, transform=src.transform).round_offsets().round_lengths()
+            window = window.intersection(Window(0, 0, src.width, src.height))
+
+            tmp_file = f'{array_file}.{os.getpid()}.{threading.get_ident()}.tmp.npy'
+            data = np.lib.format.open_memmap(
+                tmp_file, mode='w+', dtype=src.dtypes[0], shape=(int(window.height), int(window.width)))
+            src.read(1, window=window, out=data)
+            data.flush()
+            del data
+            os.replace(tmp_file, array_file)
+
+            return {
+                'path': array_file,
+                'shape': [int(window.height), int(window.width)],
+                'dtype': src.dtypes[0],
+                'transform': list(src.window_transform(window))[:6],
+                'crs': src.crs.to_wkt() if src.crs else None,
+                'nodata': src.nodata,
+            }
+
+    def entry(self, layer: str, bbox: BBox) -> Tuple[str, BBox, str, str]:
+        """
+        Returns the source of a layer and the tile bbox, array and metadata files of its crop
+        for a domain
+        @param layer: layer name
+        @param bbox: lon/lat domain bounding box
+        """
+        source = self.layers[layer]
+        if not os.path.isabs(source):
+            source = os.path.join(PropagatorConfig.PROPAGATOR_DIR, source)
+
+        import rasterio as rio
+
+        tile_bbox = snap_bbox(bbox, self.tile_size)
+        with rio.open(source) as src:
+            resolution = src.res
+
+        key = self.entry_key(source, tile_bbox, resolution)
+        array_file = os.path.join(self.cache_dir, f'{layer}_{key}.npy')
+        meta_file = os.path.join(self.cache_dir, f'{layer}_{key}.json')
+        return source, tile_bbox, array_file, meta_file
+
+    def get(self, layer: str, source: str, tile_bbox: BBox, array_file: str, meta_file: str) -> dict:
+        """
+        Returns the cached crop of a layer, creating it if needed
+        @return: metadata of the crop (path of the .npy array, shape, transform, crs, nodata)
+        """
+        if os.path.exists(array_file) and os.path.exists(meta_file):
+            # refresh the LRU position
+            os.utime(array_file)
+            with open(meta_file) as fp:
+                return json.load(fp)
+
+        logger.info(f'Static data cache miss: {layer} {tile_bbox}')
+        meta = self.crop(source, tile_bbox, array_file)
+        # written aside and renamed, a crash can't leave a truncated sidecar
+        tmp_file = f'{meta_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_file, 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(tmp_file, meta_file)
+
+        return meta
+
+    def acquire(self, bbox: BBox) -> Dict[str, dict]:
+        """
+        Returns the cached crops of all the configured layers for a domain, creating them if
+        needed. They are in use, and not evicted, until released.
+        """
+        entries = {layer: self.entry(layer, bbox) for layer in self.layers}
+        paths = [array_file for _, _, array_file, _ in entries.values()]
+        # in use before they are looked up, an eviction can't remove them in between
+        self.use(paths, 1)
+        try:
+            static_data = {layer: self.get(layer, *entry) for layer, entry in entries.items()}
+        except Exception:
+            self.use(paths, -1)
+            raise
+
+        self.evict()
+        return static_data
+
+    def release(self, static_data: Dict[str, dict]):
+        """
+        Releases the crops acquired for a run, once the simulation is over
+        """
+        self.use([meta['path'] for meta in static_data.values()], -1)
+
+    def use(self, paths: List[str], count: int):
+        with self._lock:
+            for path in paths:
+                self.active[path] = self.active.get(path, 0) + count
+                if self.active[path] <= 0:
+                    del self.active[path]
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npy') or name.endswith('.tmp.npy'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def usage(self) -> int:
+        """
+        Returns the disk usage of the cache in bytes
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Removes the least recently used crops not in use until the cache fits its budget
+        """
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.budget:
+                    break
+                if path in self.active:
+                    continue
+                logger.info(f'Static data cache eviction: {path}')
+                for file in (path, path[:-len('.npy')] + '.json'):
+                    if os.path.exists(file):
+                        os.remove(file)
+                total -= size
+
+
+_cache = None
+
+
+def get_static_data_cache() -> StaticDataCache:
+    """
+    Returns the static data cache of the service, None if no static layer is configured
+    """
+    global _cache
+    if not StaticDataConfig.LAYERS:
+        return None
+    if _cache is None:
+        _cache = StaticDataCache(
+            StaticDataConfig.CACHE_DIR,
+            StaticDataConfig.LAYERS,
+            StaticDataConfig.CACHE_BUDGET,
+            StaticDataConfig.TILE_SIZE
+        )
+    return _cache
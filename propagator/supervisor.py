@@ -0,0 +1,283 @@
+import logging
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+from config import RabbitMQConfig, RunControlConfig
+
+logger = logging.getLogger(__name__)
+
+# reasons a simulation is stopped by the supervisor
+CANCELLED = 'CANCELLED'
+TIMEOUT = 'TIMEOUT'
+DRAINED = 'DRAINED'
+
+# status code of a cancelled run (client closed request)
+CANCELLED_STATUS = 499
+
+# seconds between two checks of the watchdog
+CHECK_INTERVAL = 1
+
+# seconds between two connections of the cancellation listener
+RECONNECT_DELAY = 10
+
+
+@dataclass
+class ActiveRun:
+    """
+    A simulation in progress on this node
+    @param deadline: monotonic time of its timeout, 0 for none
+    """
+    run_id: str
+    timeout: float = 0
+    deadline: float = 0
+    stop_reason: str = None
+    stopped_at: float = None
+    killed: bool = False
+    _send_signal: Callable[[int], None] = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def attach(self, send_signal: Callable[[int], None]):
+        """
+        Attaches the simulation process, stopping it right away if the run was stopped before it started
+        @param send_signal: sends a signal to the process
+        """
+        with self._lock:
+            self._send_signal = send_signal
+            stopped = self.stop_reason is not None
+        if stopped:
+            self.signal(signal.SIGTERM)
+
+    def signal(self, sig: int):
+        with self._lock:
+            send_signal = self._send_signal
+        if send_signal is None:
+            return
+        try:
+            send_signal(sig)
+        except (ProcessLookupError, OSError) as exp:
+            # the process already ended
+            logger.debug(f'Signal {sig} not sent to {self.run_id}: {exp}')
+
+    def stop(self, reason: str):
+        """
+        Stops the simulation: SIGTERM now, SIGKILL from the watchdog if it doesn't end in time
+        """
+        with self._lock:
+            if self.stop_reason is not None:
+                return
+            self.stop_reason = reason
+            self.stopped_at = time.monotonic()
+        logger.warning(f'Stopping the simulation of {self.run_id}: {reason}')
+        self.signal(signal.SIGTERM)
+
+
+class RunSupervisor:
+    """
+    Supervises the simulations running on this node: a watchdog thread stops the ones
+    exceeding their wall-clock timeout, killing them if they ignore SIGTERM, runs can be
+    cancelled by run id, and in drain mode (SIGTERM of the service) no new run is taken
+    while the runs in progress have DRAIN_TIMEOUT seconds to end, before being stopped and
+    released to the other nodes.
+    """
+    def __init__(self, kill_grace: float, drain_timeout: float, cancel_ttl: float):
+        self.kill_grace = kill_grace
+        self.drain_timeout = drain_timeout
+        self.cancel_ttl = cancel_ttl
+        self.active: Dict[str, ActiveRun] = {}
+        # runs cancelled before they started, with the time of the cancellation
+        self.cancelled: Dict[str, float] = {}
+        self.draining = False
+        self.drain_deadline = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.loop, name='run-supervisor', daemon=True)
+            self._thread.start()
+
+    def loop(self):
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Error checking the simulations in progress')
+
+    def check(self):
+        """
+        Stops the runs past their deadline, kills the stopped runs still alive after the grace period
+        """
+        now = time.monotonic()
+        with self._lock:
+            runs = list(self.active.values())
+            drain_expired = self.drain_deadline is not None and now > self.drain_deadline
+            self.cancelled = {
+                run_id: cancelled_at for run_id, cancelled_at in self.cancelled.items()
+                if now - cancelled_at < self.cancel_ttl
+            }
+
+        for run in runs:
+            if run.stop_reason is None:
+                if drain_expired:
+                    run.stop(DRAINED)
+                elif run.deadline and now > run.deadline:
+                    run.stop(f'{TIMEOUT} after {run.timeout:.0f} s')
+            elif not run.killed and now > run.stopped_at + self.kill_grace:
+                logger.warning(f'Killing the simulation of {run.run_id}, still running {self.kill_grace:.0f} s after SIGTERM')
+                run.killed = True
+                run.signal(signal.SIGKILL)
+
+    @contextmanager
+    def supervise(self, run_id: str, timeout: float = 0):
+        """
+        Registers a run for the duration of the context
+        @param timeout: wall-clock timeout in seconds, 0 for none
+        @return: the ActiveRun, to attach the simulation process to
+        """
+        run = ActiveRun(run_id, timeout, time.monotonic() + timeout if timeout > 0 else 0)
+        with self._lock:
+            self.active[run_id] = run
+            if self.cancelled.pop(run_id, None) is not None:
+                # cancelled before it started: the simulation is not launched
+                run.stop_reason, run.stopped_at = CANCELLED, time.monotonic()
+        try:
+            yield run
+        finally:
+            with self._lock:
+                self.active.pop(run_id, None)
+
+    def cancel(self, run_id: str) -> bool:
+        """
+        Cancels a run: stops its simulation if in progress, it won't start otherwise
+        @return: True if the run is in progress on this node
+        """
+        from propagator.retry import get_retry_queue
+
+        with self._lock:
+            run = self.active.get(run_id)
+            if run is None:
+                self.cancelled[run_id] = time.monotonic()
+
+        discarded = get_retry_queue().discard(run_id)
+        if discarded:
+            logger.info(f'{discarded} pending retries of {run_id} discarded')
+
+        if run is None:
+            return False
+        run.stop(CANCELLED)
+        return True
+
+    def drain(self, *args):
+        """
+        Enters drain mode, can be installed as signal handler
+        """
+        with self._lock:
+            if self.draining:
+                return
+            self.draining = True
+            self.drain_deadline = time.monotonic() + self.drain_timeout
+            running = len(self.active)
+        logger.warning(f'Draining: {running} runs in progress, stopped in {self.drain_timeout:.0f} s if not done')
+
+    def running(self) -> int:
+        with self._lock:
+            return len(self.active)
+
+
+def run_timeout(time_limit: float) -> float:
+    """
+    Returns the wall-clock timeout of a simulation, 0 for none
+    @param time_limit: simulated time in minutes
+    """
+    if RunControlConfig.TIMEOUT_BASE <= 0 and RunControlConfig.TIMEOUT_PER_HOUR <= 0:
+        return 0
+    return RunControlConfig.TIMEOUT_BASE + RunControlConfig.TIMEOUT_PER_HOUR * time_limit / 60
+
+
+def cancelled_run_id(routing_key: str) -> Optional[str]:
+    """
+    Returns the run id of a cancellation routing key (CANCEL_ROUTING_KEY.<run_id>)
+    """
+    prefix = RunControlConfig.CANCEL_ROUTING_KEY + '.'
+    if not routing_key.startswith(prefix):
+        return None
+    return routing_key[len(prefix):] or None
+
+
+def on_cancel_message(routing_key: str):
+    run_id = cancelled_run_id(routing_key)
+    if run_id is None:
+        return
+    running = get_run_supervisor().cancel(run_id)
+    logger.info(f'Cancellation of {run_id} received, ' + ('simulation stopped' if running else 'not running on this node'))
+
+
+def listen_cancellations():
+    """
+    Consumes the cancellation messages on a queue of this node, reconnecting on errors
+    (runs in its own thread with its own connection)
+    """
+    import pika
+
+    from framework.pika_client import connection_parameters
+
+    binding = RunControlConfig.CANCEL_ROUTING_KEY + '.#'
+    while True:
+        try:
+            with pika.BlockingConnection(parameters=connection_parameters()) as conn:
+                channel = conn.channel()
+                queue = channel.queue_declare('', exclusive=True, auto_delete=True).method.queue
+                channel.queue_bind(queue, RabbitMQConfig.RMQ_EXCHANGE, routing_key=binding)
+                channel.basic_consume(
+                    queue=queue,
+                    on_message_callback=lambda ch, method, properties, body: on_cancel_message(method.routing_key),
+                    auto_ack=True
+                )
+                logger.info(f'Listening for cancellations on {binding}')
+                channel.start_consuming()
+        except Exception as exp:
+            logger.warning(f'Cancellation listener disconnected, reconnecting in {RECONNECT_DELAY} s: {exp}')
+            time.sleep(RECONNECT_DELAY)
+
+
+def start_cancellation_listener():
+    threading.Thread(target=listen_cancellations, name='cancel-listener', daemon=True).start()
+
+
+def release_run(job) -> bool:
+    """
+    Republishes the request of a run stopped by the drain, for the other nodes
+    @param job: RetryJob of the request
+    @return: True if the request is republished or queued for this node's restart
+    """
+    from propagator.retry import RetryStage, get_retry_queue, republish
+
+    try:
+        republish(job)
+        return True
+    except Exception as exp:
+        logger.warning(f'{job.run_id} not republished, kept for the restart: {exp}')
+        return get_retry_queue().retry(job, RetryStage.RUN, f'{job.run_id} {DRAINED}')
+
+
+_supervisor = None
+
+
+def get_run_supervisor() -> RunSupervisor:
+    """
+    Returns the run supervisor of the service, starting it on first use
+    """
+    global _supervisor
+    if _supervisor is None:
+        _supervisor = RunSupervisor(
+            RunControlConfig.KILL_GRACE,
+            RunControlConfig.DRAIN_TIMEOUT,
+            RunControlConfig.CANCEL_TTL
+        )
+        _supervisor.start()
+    return _supervisor
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from config import PropagatorConfig
+from propagator.async_run_handler import AsyncPropagatorRunHandler
+from propagator.resources import RunLimits
+
+PARAMS = {'init_date': '202301021851', 'time_limit': 60, 'ignitions': ['POINT:42.450671;9.271048']}
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    monkeypatch.setattr(PropagatorConfig, 'WORK_DIR', str(tmp_path))
+    monkeypatch.setattr(PropagatorConfig, 'PROPAGATOR_DIR', str(tmp_path))
+    runner = AsyncPropagatorRunHandler('user', 'run-1', dict(PARAMS), datatype_id=35006)
+    runner.ended = []
+
+    async def run_end_callback_async():
+        runner.ended.append(runner.failed)
+
+    monkeypatch.setattr(runner, 'run_end_callback_async', run_end_callback_async)
+    return runner
+
+
+def test_simulation_ended(runner, tmp_path, monkeypatch):
+    (tmp_path / 'main.py').write_text('print("done")\n')
+    monkeypatch.setattr(PropagatorConfig, 'PYTHON_PATH', sys.executable)
+
+    asyncio.run(runner.run_propagator_async())
+
+    assert runner.ended == [False]
+
+
+def test_simulation_not_started(runner, tmp_path, monkeypatch):
+    monkeypatch.setattr(PropagatorConfig, 'PYTHON_PATH', str(tmp_path / 'missing' / 'python'))
+
+    # the caller retries or dead-letters the request, the run is not ended here too
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(runner.run_propagator_async())
+    assert runner.ended == []
+
+
+def test_simulation_killed_if_limits_fail(runner, tmp_path, monkeypatch):
+    (tmp_path / 'main.py').write_text('import time\ntime.sleep(60)\n')
+    monkeypatch.setattr(PropagatorConfig, 'PYTHON_PATH', sys.executable)
+    pids = []
+
+    def apply(limits, pid):
+        pids.append(pid)
+        raise ValueError('not allowed to raise maximum limit')
+
+    monkeypatch.setattr(RunLimits, 'apply', apply)
+
+    with pytest.raises(ValueError):
+        asyncio.run(runner.run_propagator_async())
+    assert runner.ended == []
+    pid, = pids
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
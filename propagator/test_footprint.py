@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import shapely
+
+from propagator.footprint import footprint
+
+
+def front(lon, lat, radius, vertices=500, noise=0.2, seed=0):
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = radius * (1 + noise * np.random.default_rng(seed).random(vertices))
+    return shapely.Polygon(np.column_stack((lon + radii * np.cos(angles), lat + radii * np.sin(angles))))
+
+
+ISOCHRONES = [front(9.25, 42.43, 0.01), front(9.26, 42.44, 0.02, seed=1), front(9.24, 42.42, 0.03, seed=2)]
+
+
+def test_bbox_is_the_bounding_box():
+    # the extent published before the footprint methods (get_bbox)
+    lonmin, latmin, lonmax, latmax = shapely.total_bounds(ISOCHRONES)
+    expected = shapely.geometry.mapping(shapely.geometry.box(lonmin, latmin, lonmax, latmax))
+    assert shapely.geometry.mapping(footprint(ISOCHRONES, 'bbox')) == expected
+
+
+@pytest.mark.parametrize('method', ['convex', 'concave'])
+def test_hull_covers_isochrones(method):
+    polygon = footprint(ISOCHRONES, method, max_vertices=64)
+    assert polygon.geom_type == 'Polygon'
+    assert shapely.get_num_coordinates(polygon) <= 64
+    assert polygon.covers(shapely.union_all(ISOCHRONES))
+    assert polygon.area < footprint(ISOCHRONES, 'bbox').area
+
+
+def test_degenerate_isochrones():
+    polygon = footprint([shapely.LineString([(9.25, 42.43), (9.26, 42.44)])], 'convex')
+    assert polygon.geom_type == 'Polygon'
+    assert polygon.bounds == (9.25, 42.43, 9.26, 42.44)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        footprint(ISOCHRONES, 'circle')
@@ -0,0 +1,47 @@
+import numpy as np
+import shapely
+
+from propagator.geometry import preprocess_geometry, utm_crs
+
+TRIANGLE = shapely.Polygon([(9.271048, 42.450671), (9.227102, 42.418248), (9.306205, 42.424734)])
+
+
+def circle(lon, lat, radius, vertices=2000):
+    angles = np.linspace(0, 2 * np.pi, vertices)
+    return shapely.Polygon(np.column_stack((lon + radius * np.cos(angles), lat + radius * np.sin(angles))))
+
+
+def test_utm_zone():
+    assert utm_crs(TRIANGLE) == 'EPSG:32632'
+    assert utm_crs(shapely.Point(-70.5, -33.4)) == 'EPSG:32719'
+
+
+def test_nothing_removed_keeps_geometry():
+    geom, removed = preprocess_geometry(TRIANGLE, 20)
+    assert removed == 0
+    assert geom is TRIANGLE
+
+
+def test_dense_polygon_simplified():
+    dense = circle(9.25, 42.43, 0.01)
+    far = shapely.Polygon([(10.27, 43.45), (10.22, 43.41), (10.30, 43.42)])
+    geom, removed = preprocess_geometry(shapely.GeometryCollection([dense, far]), 20)
+    assert removed > 1000
+    assert shapely.is_valid(geom)
+    # the part losing no vertex is left as it was
+    assert any(part.equals_exact(far, 0) for part in geom.geoms)
+    assert shapely.area(shapely.symmetric_difference(geom.geoms[0], dense)) < 0.01 * dense.area
+
+
+def test_overlapping_polygons_merged():
+    geom, removed = preprocess_geometry(shapely.GeometryCollection([circle(9.25, 42.43, 0.01), TRIANGLE]), 20)
+    assert removed > 0
+    assert [part.geom_type for part in geom.geoms] == ['Polygon']
+
+
+def test_duplicate_points_removed():
+    points = shapely.MultiPoint([(9.25, 42.43), (9.25000001, 42.43000001), (9.26, 42.44)])
+    line = shapely.LineString([(9.2, 42.4), (9.3, 42.5)])
+    geom, removed = preprocess_geometry(shapely.GeometryCollection([points, line]), 20)
+    assert removed == 1
+    assert geom.equals_exact(shapely.GeometryCollection([line, shapely.Point(9.25, 42.43), shapely.Point(9.26, 42.44)]), 0)
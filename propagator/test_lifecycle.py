@@ -0,0 +1,71 @@
+import os
+
+from propagator.lifecycle import (ARCHIVE_SUFFIX, LifecycleManager,
+                                  compact_run, read_run_file)
+
+
+def make_run(work_dir, name='r1.35006', files=('message.json', 'isochrone_60.geojson')):
+    run_dir = os.path.join(work_dir, name)
+    os.makedirs(run_dir)
+    for file in files:
+        with open(os.path.join(run_dir, file), 'w') as fp:
+            fp.write('{}')
+    return run_dir
+
+
+def manager(work_dir, quota=0):
+    return LifecycleManager(str(work_dir), quota, 0, 600)
+
+
+def test_compaction_deferred_while_in_use(tmp_path):
+    run_dir = make_run(tmp_path)
+    lifecycle = manager(tmp_path)
+    keep = [os.path.join(run_dir, 'message.json')]
+
+    with lifecycle.running(run_dir):
+        with lifecycle.running(run_dir):
+            pass
+        lifecycle.compact(run_dir, keep)
+        assert os.path.isdir(run_dir)
+        assert lifecycle.jobs.empty()
+
+    # released: queued again for the background thread
+    queued_dir, queued_keep = lifecycle.jobs.get_nowait()
+    lifecycle.compact(queued_dir, queued_keep)
+    assert not os.path.exists(run_dir)
+    assert read_run_file(run_dir, 'message.json') == b'{}'
+    assert read_run_file(run_dir, 'isochrone_60.geojson') is None
+
+
+def test_eviction_skips_runs_in_use(tmp_path):
+    old_dir = make_run(tmp_path, 'r1.35006')
+    archived_dir = make_run(tmp_path, 'r2.35006')
+    compact_run(archived_dir, [os.path.join(archived_dir, 'message.json')])
+    os.utime(old_dir, (0, 0))
+    os.utime(archived_dir + ARCHIVE_SUFFIX, (0, 0))
+    lifecycle = manager(tmp_path, quota=1)
+
+    with lifecycle.running(old_dir), lifecycle.running(archived_dir):
+        lifecycle.enforce()
+        assert os.path.isdir(old_dir)
+        assert os.path.exists(archived_dir + ARCHIVE_SUFFIX)
+
+    lifecycle.enforce()
+    assert os.listdir(tmp_path) == []
+
+
+def test_eviction_skips_retained_runs(tmp_path):
+    retried_dir = make_run(tmp_path, 'r.1.35006')
+    other_datatype_dir = make_run(tmp_path, 'r.1.35007')
+    other_dir = make_run(tmp_path, 'r.2.35006')
+    for run_dir in (retried_dir, other_datatype_dir, other_dir):
+        os.utime(run_dir, (0, 0))
+    lifecycle = LifecycleManager(str(tmp_path), 0, 1, 600)
+
+    lifecycle.retain('r.1')
+    lifecycle.enforce()
+    assert sorted(os.listdir(tmp_path)) == ['r.1.35006', 'r.1.35007']
+
+    lifecycle.release('r.1')
+    lifecycle.enforce()
+    assert os.listdir(tmp_path) == []
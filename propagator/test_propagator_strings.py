@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from propagator.utils import (get_geometry_string,
+                              transform_features_to_propagator_strings,
+                              wkt_to_propagator_strings)
+
+
+def ring(lon, lat, vertices, seed):
+    rng = random.Random(seed)
+    points = [[lon + rng.random() / 10, lat + rng.random() / 10] for _ in range(vertices)]
+    return points + [points[0]]
+
+
+GEOMETRIES = [
+    {'type': 'Point', 'coordinates': [9.271048, 42.450671]},
+    {'type': 'Point', 'coordinates': [9, 42]},
+    {'type': 'LineString', 'coordinates': [[9.244365, 42.445386], [9.266281, 42.414662], [9.3, 42.4]]},
+    {'type': 'LineString', 'coordinates': [[9, 42], [9.5, 42.000001], [1e-05, 1e16]]},
+    {'type': 'Polygon', 'coordinates': [ring(9.2, 42.4, 1000, 0)]},
+    {'type': 'Polygon', 'coordinates': [ring(9.2, 42.4, 10, 1), ring(9.22, 42.42, 4, 2)]},
+    {'type': 'MultiPolygon', 'coordinates': [[ring(9.2, 42.4, 50, 3)], [ring(10.2, 43.4, 20, 4)]]},
+    {'type': 'MultiLineString', 'coordinates': [ring(9.2, 42.4, 5, 5), ring(9.3, 42.5, 5, 6)]},
+    {'type': 'MultiPoint', 'coordinates': [[9.1, 42.1], [9.2, 42.2]]},
+]
+
+
+@pytest.mark.parametrize('geometry', GEOMETRIES, ids=lambda geometry: geometry['type'])
+def test_geojson_strings(original, geometry):
+    assert transform_features_to_propagator_strings(geometry) == original.propagator_strings(geometry)
+
+
+def test_collection_strings(original):
+    collection = {'type': 'GeometryCollection', 'geometries': GEOMETRIES}
+    assert transform_features_to_propagator_strings(collection) == original.propagator_strings(collection)
+
+
+def test_elevation_ignored():
+    line = [[9.244365, 42.445386], [9.266281, 42.414662], [9, 42]]
+    with_elevation = [[9.244365, 42.445386, 120.5], [9.266281, 42.414662], [9, 42, 7]]
+    assert transform_features_to_propagator_strings({'type': 'LineString', 'coordinates': with_elevation}) == \
+        transform_features_to_propagator_strings({'type': 'LineString', 'coordinates': line})
+    assert get_geometry_string([9.27, 42.45, 100], 'Point') == 'POINT:42.45;9.27'
+
+
+@pytest.mark.parametrize('geometry', [g for g in GEOMETRIES if g['type'] in ('Point', 'LineString', 'Polygon')],
+                         ids=lambda geometry: geometry['type'])
+def test_geometry_string(original, geometry):
+    assert get_geometry_string(geometry['coordinates'], geometry['type']) == \
+        original.geometry_string(geometry['coordinates'], geometry['type'])
+
+
+@pytest.mark.parametrize('wkt_string', [
+    'POINT (9.271048 42.450671)',
+    'LINESTRING (9.244365 42.445386, 9.266281 42.414662)',
+    'POLYGON ((9.271048 42.450671, 9.227102 42.418248, 9.306205 42.424734, 9.271048 42.450671))',
+    'MULTIPOLYGON (((9.2 42.4, 9.3 42.4, 9.3 42.5, 9.2 42.4)), ((10.2 43.4, 10.3 43.4, 10.3 43.5, 10.2 43.4)))',
+])
+def test_wkt_strings(original, wkt_string):
+    wkt = pytest.importorskip('geomet.wkt')
+    assert wkt_to_propagator_strings(wkt_string) == original.propagator_strings(wkt.loads(wkt_string))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.transform import from_origin
+
+from config import RasterOutputConfig
+from propagator.raster_output import narrowest_dtype, write_masked_raster
+
+NODATA = RasterOutputConfig.NODATA
+
+
+@pytest.mark.parametrize('values, source_dtype, dtype', [
+    ([0, 1, 100], 'float64', 'int16'),
+    ([0, 1, 100], 'uint8', 'int16'),
+    ([0, 1, 100], 'int32', 'int16'),
+    ([0, 70000], 'float64', 'int32'),
+    ([0.5, 0.25], 'float64', 'float32'),
+    ([0.5, 0.25], 'float32', 'float32'),
+    ([0.1, 0.2], 'float64', 'float64'),
+    ([0.1, 0.2], 'float32', 'float32'),
+    ([1, np.nan], 'float64', 'float32'),
+    ([], 'float64', 'int16'),
+])
+def test_narrowest_dtype(values, source_dtype, dtype):
+    assert narrowest_dtype(np.array(values, dtype=float), NODATA, source_dtype) == dtype
+
+
+def test_narrowest_dtype_positive_nodata():
+    assert narrowest_dtype(np.array([0., 1.]), 255) == 'uint8'
+
+
+@pytest.fixture
+def profile():
+    return {'width': 600, 'height': 500, 'crs': 'EPSG:32632', 'dtype': 'float64',
+            'transform': from_origin(500000, 4700000, 20, 20)}
+
+
+@pytest.mark.parametrize('scale, dtype', [(1, 'int16'), (0.1, 'float64')])
+def test_write_masked_raster(tmp_path, profile, scale, dtype):
+    values = np.arange(500 * 600, dtype='float64').reshape(500, 600) % 1000 * scale
+    valid = np.zeros(values.shape, dtype=bool)
+    valid[100:400, 50:550] = True
+    output_file = str(tmp_path / 'output.tif')
+
+    assert write_masked_raster(output_file, values, valid, profile) == output_file
+
+    with rio.open(output_file) as src:
+        assert src.dtypes == (dtype,)
+        assert src.nodata == NODATA
+        assert src.crs == profile['crs']
+        assert src.transform == profile['transform']
+        assert src.profile['tiled']
+        assert src.overviews(1) == [2]
+        band = src.read(1)
+    np.testing.assert_array_equal(band[valid], values[valid])
+    assert (band[~valid] == NODATA).all()
+    assert not (tmp_path / 'output.tif.tmp').exists()
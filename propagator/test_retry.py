@@ -0,0 +1,254 @@
+import heapq
+import json
+import os
+import signal
+import threading
+
+import pytest
+import requests
+
+import framework.pika_client
+from config import RetryConfig
+from framework.data_uploader import (DataUploadException,
+                                     MetadataUploadException, upload_errors)
+from propagator import retry
+from propagator.lifecycle import LifecycleManager
+from propagator.retry import (ATTEMPT_HEADER, ERRORS_HEADER, USER_HEADER,
+                              RetryJob, RetryQueue, RetryStage,
+                              classify_exception, classify_exit)
+from propagator.wrapper import ErrorCodes
+
+BODY = json.dumps({'geometry': {'type': 'Point', 'coordinates': [9.27, 42.45]}})
+
+
+@pytest.fixture
+def job():
+    return RetryJob('request.user.run.1', 'user', BODY, 35006)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return RetryQueue(str(tmp_path / 'retry_queue.json'), str(tmp_path / 'dead_letter'),
+                      max_retries=2, base_delay=10, max_delay=60, max_pending=1)
+
+
+@pytest.fixture
+def failures(monkeypatch):
+    notified = []
+    monkeypatch.setattr(retry, 'notify_failure', lambda job, reason: notified.append((job, reason)))
+    return notified
+
+
+class RecordingClient:
+    messages = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def write_message(self, routing_key, body, properties=None):
+        self.messages.append((routing_key, body))
+
+
+@pytest.mark.parametrize('error_code', [ErrorCodes.DOMAIN_ERROR, ErrorCodes.IGNITIONS_ERROR, ErrorCodes.BC_ERROR])
+def test_input_errors_not_retried(error_code):
+    assert classify_exit(error_code) is None
+
+
+def test_generic_error_reruns():
+    assert classify_exit(ErrorCodes.GENERIC_ERROR) is RetryStage.RUN
+
+
+@pytest.mark.parametrize('returncode, stderr', [
+    (-signal.SIGKILL, ''),
+    (-signal.SIGXCPU, ''),
+    (1, 'Traceback (most recent call last):\nMemoryError'),
+])
+def test_out_of_resources_not_retried(returncode, stderr):
+    assert classify_exit(ErrorCodes.GENERIC_ERROR, returncode, stderr) is None
+
+
+def test_crash_reruns():
+    assert classify_exit(ErrorCodes.GENERIC_ERROR, -signal.SIGSEGV, '') is RetryStage.RUN
+    assert classify_exit(ErrorCodes.GENERIC_ERROR, 1, 'Traceback (most recent call last):\nOSError') is RetryStage.RUN
+
+
+@pytest.mark.parametrize('exp, stage', [
+    (DataUploadException('connection reset'), RetryStage.UPLOAD),
+    (DataUploadException('bad gateway', status=502), RetryStage.UPLOAD),
+    (MetadataUploadException('too many requests', status=429), RetryStage.UPLOAD),
+    (DataUploadException('not authorized', status=403), None),
+    (MetadataUploadException('validation error', status=409), None),
+    (DataUploadException('file not found: isochrone_60.geojson', transient=False), None),
+])
+def test_datalake_errors(exp, stage):
+    assert classify_exception(exp, RetryStage.UPLOAD) is stage
+
+
+def test_upload_errors():
+    assert classify_exception(upload_errors([DataUploadException('timeout', status=504)]), RetryStage.UPLOAD)
+    assert classify_exception(
+        upload_errors([DataUploadException('timeout', status=504), DataUploadException('bad request', status=400)]),
+        RetryStage.UPLOAD) is None
+    assert classify_exception(upload_errors([ValueError('bad output')]), RetryStage.UPLOAD) is None
+
+
+def test_transient_exceptions():
+    assert classify_exception(requests.ConnectionError(), RetryStage.UPLOAD) is RetryStage.UPLOAD
+    assert classify_exception(TimeoutError(), RetryStage.RUN) is RetryStage.RUN
+    assert classify_exception(ValueError('bad output'), RetryStage.UPLOAD) is None
+
+
+def test_transient_cause():
+    try:
+        try:
+            raise ConnectionResetError('reset')
+        except ConnectionResetError as exp:
+            raise RuntimeError('upload failed') from exp
+    except RuntimeError as exp:
+        assert classify_exception(exp, RetryStage.UPLOAD) is RetryStage.UPLOAD
+
+
+def test_job_from_delivery():
+    headers = {ATTEMPT_HEADER: 2, ERRORS_HEADER: b'["first", "second"]', USER_HEADER: b'owner'}
+    job = RetryJob.from_delivery('request.user.run.1', 'service', BODY.encode(), 35006, headers)
+
+    assert job.run_id == 'run.1'
+    assert job.user_id == 'owner'
+    assert job.body == BODY
+    assert job.attempt == 2
+    assert job.errors == ['first', 'second']
+
+
+def test_job_from_first_delivery():
+    job = RetryJob.from_delivery('request.user.run', 'user', BODY, 35006)
+
+    assert job.user_id == 'user'
+    assert job.attempt == 0
+    assert job.errors == []
+
+
+def test_retry_scheduled(queue, job, failures):
+    assert queue.retry(job, RetryStage.UPLOAD, 'upload failed')
+
+    (_, _, pending), = queue.pending
+    assert pending.attempt == 1
+    assert pending.stage == 'upload'
+    assert pending.errors == ['upload failed']
+    with open(queue.queue_file) as fp:
+        assert json.load(fp)[0]['routing_key'] == job.routing_key
+    assert failures == []
+
+
+@pytest.mark.parametrize('stage, attempt, pending, reason', [
+    (None, 0, 0, 'not retryable'),
+    (RetryStage.RUN, 2, 0, 'retries exhausted'),
+    (RetryStage.RUN, 0, 1, 'retry queue full'),
+])
+def test_dead_letter(queue, job, failures, stage, attempt, pending, reason):
+    for _ in range(pending):
+        queue.retry(RetryJob('request.user.other', 'user', BODY, 35006), RetryStage.RUN, 'error')
+    job = RetryJob(job.routing_key, job.user_id, job.body, job.datatype_id, attempt=attempt)
+
+    assert not queue.retry(job, stage, 'simulation failed', ValueError('simulation failed'))
+
+    (notified, notified_reason), = failures
+    assert notified.run_id == 'run.1'
+    assert notified_reason == reason
+    path, = os.listdir(queue.dead_letter_dir)
+    with open(os.path.join(queue.dead_letter_dir, path)) as fp:
+        record = json.load(fp)
+    assert record['reason'] == reason
+    assert record['attempts'] == attempt + 1
+    assert record['errors'] == ['simulation failed']
+    assert record['request'] == json.loads(BODY)
+    assert 'ValueError' in record['traceback']
+
+
+def test_dead_letter_published(monkeypatch, queue, job, failures):
+    RecordingClient.messages = []
+    monkeypatch.setattr(framework.pika_client, 'PikaClient', RecordingClient)
+    monkeypatch.setattr(RetryConfig, 'DEAD_LETTER_ROUTING_KEY', 'dead_letter.propagator')
+
+    queue.dead_letter(job, 'not retryable')
+
+    (routing_key, body), = RecordingClient.messages
+    assert routing_key == 'dead_letter.propagator'
+    assert json.loads(body)['run_id'] == 'run.1'
+
+
+def test_notify_failure_error_kept(queue, job, monkeypatch):
+    monkeypatch.setattr(retry, 'notify_failure', lambda job, reason: 1 / 0)
+
+    assert os.path.exists(queue.dead_letter(job, 'not retryable'))
+
+
+def take(queue):
+    # what the loop does when a retry is due
+    _, key, job = heapq.heappop(queue.pending)
+    queue.in_flight[key] = job
+    return key, job
+
+
+def test_handoff_does_not_block(monkeypatch, queue, job, failures):
+    republished, uploaded = [], []
+    monkeypatch.setattr(retry, 'republish', republished.append)
+    monkeypatch.setattr(retry, 'retry_upload', uploaded.append)
+    handed_off = []
+    queue.handoff = handed_off.append
+    queue.max_pending = 2
+    queue.retry(job, RetryStage.UPLOAD, 'upload failed')
+    queue.retry(RetryJob('request.user.other', 'user', BODY, 35006), RetryStage.RUN, 'simulation failed')
+
+    while queue.pending:
+        queue.execute(*take(queue))
+
+    # the republish ran, the upload waits for the consumer and stays saved
+    assert [republished_job.run_id for republished_job in republished] == ['other']
+    assert uploaded == []
+    task, = handed_off
+    with open(queue.queue_file) as fp:
+        assert [saved['routing_key'] for saved in json.load(fp)] == [job.routing_key]
+
+    consumer = threading.Thread(target=task)
+    consumer.start()
+    consumer.join()
+    assert [uploaded_job.run_id for uploaded_job in uploaded] == ['run.1']
+    assert queue.in_flight == {}
+
+
+def test_failed_upload_rescheduled(monkeypatch, queue, job, failures):
+    def fail(job):
+        raise DataUploadException('bad gateway', status=502)
+
+    monkeypatch.setattr(retry, 'retry_upload', fail)
+    queue.retry(job, RetryStage.UPLOAD, 'upload failed')
+
+    queue.execute(*take(queue))
+
+    (_, _, rescheduled), = queue.pending
+    assert rescheduled.attempt == 2
+    assert rescheduled.errors == ['upload failed', 'bad gateway']
+    assert queue.in_flight == {}
+
+
+def test_pending_runs_retained(monkeypatch, tmp_path, job, failures):
+    lifecycle = LifecycleManager(str(tmp_path), 0, 0, 600)
+    queue = RetryQueue(str(tmp_path / 'retry_queue.json'), str(tmp_path / 'dead_letter'),
+                       max_retries=2, base_delay=10, max_delay=60, max_pending=2, lifecycle_manager=lifecycle)
+    monkeypatch.setattr(retry, 'republish', lambda job: None)
+    other = RetryJob('request.user.other', 'user', BODY, 35006)
+
+    queue.retry(job, RetryStage.RUN, 'simulation failed')
+    queue.retry(other, RetryStage.RUN, 'simulation failed')
+    # not retryable, never queued
+    queue.retry(other, None, 'bad input')
+    assert lifecycle.retained == {'run.1': 1, 'other': 1}
+
+    queue.discard('other')
+    assert lifecycle.retained == {'run.1': 1}
+
+    queue.execute(*take(queue))
+    assert lifecycle.retained == {}
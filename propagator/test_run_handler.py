@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+from config import PropagatorConfig
+from propagator.lifecycle import MESSAGE_FILE, PACKAGE_FILE
+from propagator.run_handler import PropagatorRunHandler
+from propagator.utils import parse_request_body
+
+REQUEST = {
+    'start': '2023-01-02T18:51:00.000Z',
+    'time_limit': 120,
+    'probabilityRange': 0.75,
+    'boundary_conditions': [{'time': 0, 'w_dir': 276, 'w_speed': 10, 'moisture': 10}],
+    'title': 'my title',
+    'geometry': {'type': 'Point', 'coordinates': [9.271048, 42.450671]},
+}
+
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(PropagatorConfig, 'WORK_DIR', str(tmp_path))
+    return tmp_path
+
+
+def store_run(work_dir, request, datatype_id=35006):
+    run_dir = work_dir / f'run-1.{datatype_id}'
+    run_dir.mkdir()
+    (run_dir / MESSAGE_FILE).write_text(json.dumps(request))
+    (run_dir / PACKAGE_FILE).write_text('{}')
+    (run_dir / 'isochrone_60.geojson').write_text('{}')
+    return run_dir
+
+
+def handler(request):
+    return PropagatorRunHandler('user', 'run-1', parse_request_body(json.dumps(request)), datatype_id=35007)
+
+
+@pytest.mark.parametrize('changes', [
+    {'title': 'other title', 'probabilityRange': 0.5},
+    {'datatype_id': '35007'},
+])
+def test_same_simulation_reused(work_dir, changes):
+    store_run(work_dir, REQUEST)
+    runner = handler({**REQUEST, **changes})
+
+    assert runner.reuse_simulation()
+    assert os.path.exists(os.path.join(runner.output_dir, 'isochrone_60.geojson'))
+
+
+@pytest.mark.parametrize('changes', [
+    {'geometry': {'type': 'Point', 'coordinates': [9.3, 42.45]}},
+    {'time_limit': 240},
+    {'boundary_conditions': [{'time': 0, 'w_dir': 90, 'w_speed': 10, 'moisture': 10}]},
+])
+def test_other_simulation_not_reused(work_dir, changes):
+    store_run(work_dir, REQUEST)
+    runner = handler({**REQUEST, **changes})
+
+    assert not runner.reuse_simulation()
+    assert not os.path.exists(os.path.join(runner.output_dir, 'isochrone_60.geojson'))
+
+
+def test_unreadable_request_not_reused(work_dir):
+    run_dir = store_run(work_dir, REQUEST)
+    (run_dir / MESSAGE_FILE).write_text('not json')
+
+    assert not handler(REQUEST).reuse_simulation()
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.transform import from_origin
+
+from propagator.static_cache import StaticDataCache
+
+# two domains on different tiles
+DOMAIN = (9.21, 42.41, 9.29, 42.49)
+OTHER_DOMAIN = (9.51, 42.41, 9.59, 42.49)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    dem = str(tmp_path / 'dem.tif')
+    profile = {'driver': 'GTiff', 'width': 100, 'height': 100, 'count': 1, 'dtype': 'float32',
+               'crs': 'EPSG:4326', 'transform': from_origin(9, 43, 0.01, 0.01)}
+    with rio.open(dem, 'w', **profile) as dst:
+        dst.write(np.arange(100 * 100, dtype='float32').reshape(100, 100), 1)
+    # room for a single crop
+    return StaticDataCache(str(tmp_path / 'cache'), {'dem': dem}, budget=600, tile_size=0.1)
+
+
+def test_crop(cache):
+    meta = cache.acquire(DOMAIN)['dem']
+
+    assert meta['shape'] == [10, 10]
+    data = np.load(meta['path'], mmap_mode='r')
+    assert data[0, 0] == 50 * 100 + 20
+    assert sorted(os.listdir(cache.cache_dir)) == sorted([os.path.basename(meta['path']),
+                                                          os.path.basename(meta['path'])[:-4] + '.json'])
+
+
+def test_crops_in_use_not_evicted(cache):
+    static_data = cache.acquire(DOMAIN)
+    other_static_data = cache.acquire(OTHER_DOMAIN)
+
+    # both in use, over budget
+    assert os.path.exists(static_data['dem']['path'])
+    assert os.path.exists(other_static_data['dem']['path'])
+
+    cache.release(static_data)
+    cache.evict()
+    assert not os.path.exists(static_data['dem']['path'])
+    assert os.path.exists(other_static_data['dem']['path'])
+
+
+def test_shared_crop_released_by_every_run(cache):
+    static_data = cache.acquire(DOMAIN)
+    assert cache.acquire(DOMAIN) == static_data
+
+    cache.release(static_data)
+    cache.acquire(OTHER_DOMAIN)
+    assert os.path.exists(static_data['dem']['path'])
+
+    cache.release(static_data)
+    assert cache.active == {cache.acquire(OTHER_DOMAIN)['dem']['path']: 2}
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from propagator.validation import RequestValidationException, validate_request
+
+GEOMETRY = {
+    'type': 'Polygon',
+    'coordinates': [[[9.271048, 42.450671], [9.227102, 42.418248], [9.306205, 42.424734], [9.271048, 42.450671]]]
+}
+
+
+def request(**fields):
+    data = {
+        'description': 'my description',
+        'start': '2023-01-02T18:51:00.000Z',
+        'end': '2023-01-02T20:51:00.000Z',
+        'probabilityRange': 0.75,
+        'do_spotting': False,
+        'boundary_conditions': [{'time': 0, 'w_dir': 276, 'w_speed': 10, 'moisture': 10}],
+        'title': 'my title',
+        'geometry': GEOMETRY,
+        'datatype_id': '35006'
+    }
+    data.update(fields)
+    return json.dumps({name: value for name, value in data.items() if value is not None})
+
+
+def error_fields(body):
+    with pytest.raises(RequestValidationException) as info:
+        validate_request(body)
+    return [error['field'] for error in info.value.errors]
+
+
+def test_full_request():
+    assert validate_request(request())['title'] == 'my title'
+
+
+def test_handler_defaulted_fields_are_optional():
+    body = json.dumps({'geometry': GEOMETRY})
+    assert validate_request(body) == {'geometry': GEOMETRY}
+
+
+def test_time_limit_without_end():
+    assert validate_request(request(end=None, time_limit=120))['time_limit'] == 120
+    assert error_fields(request(end=None, time_limit=100000)) == ['time_limit']
+
+
+def test_time_limit_without_start():
+    assert validate_request(json.dumps({'geometry': GEOMETRY, 'time_limit': 120}))['time_limit'] == 120
+    for time_limit in (100000, -5):
+        assert error_fields(json.dumps({'geometry': GEOMETRY, 'time_limit': time_limit})) == ['time_limit']
+
+
+def test_dates_override_time_limit():
+    assert validate_request(request(time_limit=100000))['time_limit'] == 100000
+
+
+def test_geometry_required():
+    assert error_fields(request(geometry=None)) == ['body']
+
+
+def test_every_boundary_condition_checked():
+    conditions = [
+        {'time': 0, 'w_dir': 276, 'w_speed': 10, 'moisture': 10},
+        {'time': 1, 'w_dir': 'north', 'w_speed': 10}
+    ]
+    fields = error_fields(request(boundary_conditions=conditions))
+    assert sorted(fields) == ['boundary_conditions.1', 'boundary_conditions.1.w_dir']
+
+
+def test_point_and_multipolygon_geometries():
+    validate_request(request(geometry={'type': 'Point', 'coordinates': [9.27, 42.45]}))
+    validate_request(request(geometry={'type': 'MultiPolygon', 'coordinates': [GEOMETRY['coordinates']]}))
+
+
+def test_invalid_dates_and_extent():
+    assert error_fields(request(end='2023-01-01T20:51:00')) == ['end']
+    assert error_fields(request(start='yesterday')) == ['start']
+    far = {'type': 'LineString', 'coordinates': [[9.0, 42.0], [12.0, 42.0]]}
+    assert error_fields(request(geometry=far)) == ['geometry']
+
+
+def test_invalid_fire_break():
+    conditions = [{'time': 0, 'w_dir': 276, 'w_speed': 10, 'moisture': 10, 'fireBreak': {'canadair': 'LINESTRING (9.2'}}]
+    assert error_fields(request(boundary_conditions=conditions)) == ['boundary_conditions[0].fireBreak.canadair']
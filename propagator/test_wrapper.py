@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+from propagator.wrapper import Wrapper
+
+
+class FailingLimits:
+    def __init__(self):
+        self.pids = []
+
+    def apply(self, pid: int):
+        self.pids.append(pid)
+        raise ValueError('not allowed to raise maximum limit')
+
+
+def test_process_killed_if_limits_fail():
+    limits = FailingLimits()
+    wrapper = Wrapper(
+        program_cmd=[sys.executable, '-c', 'import time; time.sleep(60)'],
+        cwd=os.getcwd(),
+        end_callback=None,
+        progress_callback=None,
+        error_callback=None,
+        limits=limits
+    )
+
+    with pytest.raises(ValueError):
+        wrapper.launch()
+
+    pid, = limits.pids
+    # killed and reaped
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
@@ -1,21 +1,32 @@
 import json
+import logging
 
 from datetime import datetime
+from typing import TYPE_CHECKING
 
-import rasterio as rio
 import numpy as np
-from rasterio import features
 from shapely.geometry import MultiPolygon, Polygon
-from shapely.ops import unary_union
-import geopandas as gpd
+import shapely
 
-from geojson import FeatureCollection
-from geomet import wkt
+from config import GeometryConfig, StaticDataConfig
+from propagator.geometry import (PROPAGATOR_TYPES, PropagatorActions,
+                                 domain_bbox, format_geometry, geojson_parts,
+                                 geojson_to_shapely, preprocess_geometry,
+                                 to_propagator_strings)
+from propagator.geometry import \
+    wkt_to_propagator_strings as geometry_wkt_to_propagator_strings
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+    from geojson import FeatureCollection
+
+logger = logging.getLogger(__name__)
 
 
 def parse_request_body(body):
     data = json.loads(body)
     params = data.copy()
+    removed_vertices = 0
 
     if 'start' in data:
         start_date_str = data['start']
@@ -37,12 +48,17 @@ def parse_request_body(body):
             del params['end']
 
     if 'geometry' in data:
-        params['ignitions'] = transform_features_to_propagator_strings(
-            data['geometry'])
+        params['ignitions'], removed = prepare_propagator_strings(data['geometry'])
+        removed_vertices += removed
+        if StaticDataConfig.LAYERS:
+            # simulation domain, used to crop the static data
+            params['domain_bbox'] = domain_bbox(
+                geojson_to_shapely(data['geometry']), StaticDataConfig.DOMAIN_BUFFER * 1000)
         # delete geometry from params
         del params['geometry']
 
     if 'boundary_conditions' not in data:
+        log_removed_vertices(removed_vertices)
         return params
 
     # transform actions to suitable propagator format
@@ -56,39 +72,48 @@ def parse_request_body(body):
             if action_type == 'waterLine':
                 action_type = 'waterline_action'
 
-            bc[action_type] = wkt_to_propagator_strings(wkt)
+            bc[action_type], removed = prepare_propagator_strings(wkt)
+            removed_vertices += removed
 
         del bc['fireBreak']
 
+    log_removed_vertices(removed_vertices)
     return params
 
 
-def read_actions(imp_points_string):
-    strings = imp_points_string.split('\n')
+def prepare_propagator_strings(geometry):
+    """
+    Preprocesses a request geometry on the model grid and transforms it to propagator strings
+    :param geometry: geojson geometry or wkt string
+    :return: propagator string array and number of removed vertices
+    """
+    if not GeometryConfig.SNAP_TO_GRID:
+        if isinstance(geometry, str):
+            return wkt_to_propagator_strings(geometry, GeometryConfig.SIMPLIFY_TOLERANCE), 0
+        return transform_features_to_propagator_strings(geometry, GeometryConfig.SIMPLIFY_TOLERANCE), 0
+
+    if isinstance(geometry, str):
+        geom = shapely.from_wkt(geometry)
+    else:
+        geom = geojson_to_shapely(geometry)
+
+    geom, removed = preprocess_geometry(geom, GeometryConfig.RESOLUTION, GeometryConfig.SIMPLIFY_TOLERANCE)
 
-    polys, lines, points = [], [], []
+    return to_propagator_strings(geom), removed
 
-    for s in strings:
-        f_type, values = s.split(':')
-        values = values.replace('[', '').replace(']', '')
-        if f_type == 'POLYGON':
-            s_lats, s_lons = values.split(';')
-            lats = [float(sv) for sv in s_lats.split()]
-            lons = [float(sv) for sv in s_lons.split()]
-            polys.append((lats, lons))
 
-        elif f_type == 'LINE':
-            s_lats, s_lons = values.split(';')
-            lats = [float(sv) for sv in s_lats.split()]
-            lons = [float(sv) for sv in s_lons.split()]
-            lines.append((lats, lons))
+def log_removed_vertices(removed_vertices: int):
+    if GeometryConfig.SNAP_TO_GRID:
+        logger.info(f'Geometry preprocessing removed {removed_vertices} vertices')
 
-        elif f_type == 'POINT':
-            s_lat, s_lon = values.split(';')
-            lat, lon = float(s_lat), float(s_lon)
-            points.append((lat, lon))
 
-    return polys, lines, points
+def read_actions(imp_points_string):
+    """
+    Parse propagator strings into polygons, lines and points lists
+    :param imp_points_string: newline separated propagator strings
+    :return: polygons and lines as (lats, lons), points as (lat, lon)
+    """
+    return PropagatorActions.parse(imp_points_string).as_lists()
 
 
 def get_geometry_string(coordinates, geometry_type):
@@ -98,103 +123,42 @@ def get_geometry_string(coordinates, geometry_type):
     :param geometry_type: geometry type
     :return: propagator string
     """
-    propagator_type = None
-    if geometry_type == 'Point':
-        propagator_type = 'POINT'
-    elif geometry_type == 'LineString':
-        propagator_type = 'LINE'
-    elif geometry_type == 'Polygon':
-        propagator_type = 'POLYGON'
-
-    if propagator_type is None:
+    if geometry_type not in PROPAGATOR_TYPES:
         raise ValueError(f'Unknown geometry type: {geometry_type}')
 
-    # extract lats and lons from geometry
-    if propagator_type == 'POINT':
-        lon, lat = coordinates
-        propagator_string = f'{propagator_type}:{lat};{lon}'
-    else:
-        if propagator_type == 'POLYGON':
-            # skip holes
-            coordinates = coordinates[0]
-
-        lons, lats = list(zip(*coordinates))
-        propagator_string = f"{propagator_type}: [{' '.join(map(str, lats))}];[{' '.join(map(str, lons))}]"
-
-    return propagator_string
+    (propagator_type, coordinates), = geojson_parts({'type': geometry_type, 'coordinates': coordinates})
+    return format_geometry(coordinates, propagator_type)
 
 
-def wkt_to_propagator_strings(wkt_string: str):
+def wkt_to_propagator_strings(wkt_string: str, tolerance: float = 0):
     """
     Transform wkt string to propagator string
     :param wkt_string: wkt string
+    :param tolerance: optional simplification tolerance in metres
     :return: propagator string
     """
-    geom = wkt.loads(wkt_string)
-
-    return transform_features_to_propagator_strings(geom)
+    return geometry_wkt_to_propagator_strings(wkt_string, tolerance)
 
 
-def transform_features_to_propagator_strings(features: FeatureCollection):
+def transform_features_to_propagator_strings(features: 'FeatureCollection', tolerance: float = 0):
     """
     Exctract geometry type and coordinates from features
     :param features: geojson features
+    :param tolerance: optional simplification tolerance in metres
     :return: propagator string array
     """
-    propagator_strings = []
-    if features['type'] != 'FeatureCollection':
-        features = [features]
-    else:
-        features = features['geometries']
-
-    for feature in features:
-        feature_type = feature['type']
-
-        if feature_type == 'Polygon':
-            poly = feature['coordinates']
-            propagator_strings.append(get_geometry_string(poly, 'Polygon'))
-
-        elif feature_type == 'LineString':
-            line = feature['coordinates']
-            propagator_strings.append(
-                get_geometry_string(line, 'LineString'))
-
-        elif feature_type == 'MultiPolygon':
-            for poly in feature['coordinates']:
-                propagator_strings.append(get_geometry_string(poly, 'Polygon'))
-
-        elif feature_type == 'MultiLineString':
-            for line in feature['coordinates']:
-                propagator_strings.append(
-                    get_geometry_string(line, 'LineString'))
-
-        elif feature_type == 'MultiPoint':
-            for point in feature['coordinates']:
-                propagator_strings.append(get_geometry_string(point, 'Point'))
-
-        else:
-            coordinates = feature['coordinates']
-            propagator_strings.append(
-                get_geometry_string(coordinates, feature_type))
-
-    return propagator_strings
+    return to_propagator_strings(features, tolerance)
 
 
 
-def mask_on_cutoff(values_file: str, gdf: gpd.GeoDataFrame, cutoff_value: float) -> str:
-    """Masks a raster on the isochrones of a given value.
-    @param values_file: path to the raster file
-    @param geojson_file: path to the geojson file
-    @param cutoff_value: value to mask on
-    @return: path to the masked raster file
+def cutoff_mask(gdf: 'gpd.GeoDataFrame', shape: tuple, transform) -> np.ndarray:
+    """Rasterizes the area inside the isochrones on a raster grid.
+    @param gdf: isochrones geodataframe
+    @param shape: raster shape
+    @param transform: raster transform
+    @return: boolean mask, True inside the isochrones
     """
-
-    with rio.open(values_file) as values_src:
-        values = values_src.read(1)
-        values = values.astype(float)
-        transform = values_src.transform
-        profile = values_src.profile
-
+    from rasterio import features
 
     # read geometry
     geometry = gdf.geometry\
@@ -205,24 +169,42 @@ def mask_on_cutoff(values_file: str, gdf: gpd.GeoDataFrame, cutoff_value: float)
     # Rasterize vector using the shape and coordinate system of the raster
     rasterized = features.rasterize(
         [geom],
-        out_shape=values.shape,
+        out_shape=shape,
         fill=0,
         out=None,
         transform=transform,
         all_touched=True,
         default_value=1,
-        dtype=np.int32
+        dtype=np.uint8
     )
+    return rasterized.astype(bool)
+
+
+def mask_on_cutoff(values_file: str, gdf: 'gpd.GeoDataFrame', cutoff_value: float, cutoff_file: str = None) -> str:
+    """Masks a raster on the isochrones of a given value.
+    @param values_file: path to the raster file
+    @param gdf: isochrones geodataframe
+    @param cutoff_value: value to mask on
+    @param cutoff_file: path of the masked raster, next to the raster file by default
+    @return: path to the masked raster file
+    """
+    # the raster stack is only needed once a run ends, not at service startup
+    import rasterio as rio
+
+    from propagator.raster_output import valid_data, write_masked_raster
+
+    with rio.open(values_file) as values_src:
+        values = values_src.read(1)
+        transform = values_src.transform
+        profile = values_src.profile
+        src_nodata = values_src.nodata
 
-    # mask values
-    values = values * rasterized
+    # mask values: cells outside the isochrones or without data are written as nodata
+    valid = cutoff_mask(gdf, values.shape, transform) & valid_data(values, src_nodata)
 
-    
     # extract filename
-    cutoff_file = values_file.replace('.tiff', '_cutoff.tiff')
+    if cutoff_file is None:
+        cutoff_file = values_file.replace('.tiff', '_cutoff.tiff')
 
     # write to file 
-    with rio.open(cutoff_file, 'w', **profile) as dst:
-        dst.write(values, 1)
-    
-    return cutoff_file
+    return write_masked_raster(cutoff_file, values, valid, profile)
@@ -0,0 +1,146 @@
+import json
+import math
+import os
+from datetime import datetime
+from typing import List
+
+import shapely
+from shapely.validation import explain_validity
+
+from config import ValidationConfig
+from propagator.geometry import METERS_PER_DEGREE, geojson_to_shapely
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), 'message-schema.json')
+
+_validator = None
+
+
+class RequestValidationException(Exception):
+    def __init__(self, errors: List[dict]):
+        self.errors = errors
+        super().__init__('; '.join(f"{e['field']}: {e['error']}" for e in errors))
+
+
+def get_validator():
+    """
+    Returns the json schema validator of the request messages (loaded once)
+    """
+    global _validator
+    if _validator is None:
+        from jsonschema import Draft4Validator
+
+        with open(SCHEMA_FILE) as fp:
+            _validator = Draft4Validator(json.load(fp))
+    return _validator
+
+
+def parse_date(date_str: str) -> datetime:
+    return datetime.fromisoformat(date_str.rsplit('.')[0])
+
+
+def validate_geometry(geom, field: str, errors: List[dict]):
+    if geom.is_empty:
+        errors.append({'field': field, 'error': 'empty geometry'})
+    elif not geom.is_valid:
+        errors.append({'field': field, 'error': f'invalid geometry: {explain_validity(geom)}'})
+
+
+def validate_dates(data: dict, errors: List[dict]):
+    start_date, end_date = None, None
+    for field in ('start', 'end'):
+        if field not in data:
+            continue
+        try:
+            date = parse_date(data[field])
+        except (TypeError, ValueError):
+            errors.append({'field': field, 'error': f'invalid date: {data[field]}'})
+            continue
+        if field == 'start':
+            start_date = date
+        else:
+            end_date = date
+
+    if start_date is not None and end_date is not None:
+        # the run lasts from start to end, time_limit is ignored
+        time_limit = (end_date - start_date).total_seconds() / 60
+        field = 'end'
+    elif isinstance(data.get('time_limit'), (int, float)) and not isinstance(data['time_limit'], bool):
+        time_limit = data['time_limit']
+        field = 'time_limit'
+    else:
+        return
+
+    if not ValidationConfig.MIN_TIME_LIMIT <= time_limit <= ValidationConfig.MAX_TIME_LIMIT:
+        errors.append({
+            'field': field,
+            'error': f'time limit of {time_limit:.0f} minutes outside '
+                     f'[{ValidationConfig.MIN_TIME_LIMIT}, {ValidationConfig.MAX_TIME_LIMIT}]'
+        })
+
+
+def validate_geometries(data: dict, errors: List[dict]):
+    geometries = []
+
+    if 'geometry' in data:
+        try:
+            ignitions = geojson_to_shapely(data['geometry'])
+        except Exception as exp:
+            errors.append({'field': 'geometry', 'error': f'invalid geometry: {exp}'})
+        else:
+            validate_geometry(ignitions, 'geometry', errors)
+            geometries.append(ignitions)
+
+    for index, bc in enumerate(data.get('boundary_conditions', [])):
+        for action_type, wkt in bc.get('fireBreak', {}).items():
+            field = f'boundary_conditions[{index}].fireBreak.{action_type}'
+            try:
+                action = shapely.from_wkt(wkt)
+            except Exception as exp:
+                errors.append({'field': field, 'error': f'invalid wkt: {exp}'})
+                continue
+            validate_geometry(action, field, errors)
+            geometries.append(action)
+
+    if not geometries:
+        return
+
+    lonmin, latmin, lonmax, latmax = shapely.total_bounds(geometries)
+    if lonmin < -180 or lonmax > 180 or latmin < -90 or latmax > 90:
+        errors.append({'field': 'geometry', 'error': 'coordinates outside EPSG:4326 bounds'})
+        return
+
+    lat_extent = (latmax - latmin) * METERS_PER_DEGREE / 1000
+    lon_extent = (lonmax - lonmin) * METERS_PER_DEGREE * math.cos(math.radians((latmin + latmax) / 2)) / 1000
+    if max(lat_extent, lon_extent) > ValidationConfig.MAX_DOMAIN_EXTENT:
+        errors.append({
+            'field': 'geometry',
+            'error': f'domain extent exceeds {ValidationConfig.MAX_DOMAIN_EXTENT} km'
+        })
+
+
+def validate_request(body) -> dict:
+    """
+    Validates a request message before any disk or subprocess work is done:
+    json schema, dates and time limit bounds, geometry validity and domain extent.
+    @param body: raw message body
+    @return: the decoded message
+    @raise RequestValidationException: with the list of errors found
+    """
+    try:
+        data = json.loads(body)
+    except ValueError as exp:
+        raise RequestValidationException([{'field': 'body', 'error': f'invalid json: {exp}'}])
+
+    errors = [
+        {'field': '.'.join(map(str, error.path)) or 'body', 'error': error.message}
+        for error in get_validator().iter_errors(data)
+    ]
+    if errors:
+        raise RequestValidationException(errors)
+
+    validate_dates(data, errors)
+    validate_geometries(data, errors)
+    if errors:
+        raise RequestValidationException(errors)
+
+    return data
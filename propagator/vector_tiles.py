@@ -0,0 +1,195 @@
+import gzip
+import json
+import logging
+import math
+import os
+import sqlite3
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import shapely
+
+logger = logging.getLogger(__name__)
+
+# half the side of the web mercator square, in metres
+MERCATOR_EXTENT = 20037508.342789244
+MAX_LATITUDE = 85.0511287798066
+
+TileBounds = Tuple[float, float, float, float]
+
+
+def to_mercator(coordinates: np.ndarray) -> np.ndarray:
+    """
+    Projects lon/lat coordinates (n, 2) to web mercator metres
+    """
+    lon = coordinates[:, 0]
+    lat = np.clip(coordinates[:, 1], -MAX_LATITUDE, MAX_LATITUDE)
+    x = np.radians(lon) * MERCATOR_EXTENT / math.pi
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * MERCATOR_EXTENT / math.pi
+    return np.column_stack((x, y))
+
+
+def tile_size(zoom: int) -> float:
+    return 2 * MERCATOR_EXTENT / 2 ** zoom
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> TileBounds:
+    """
+    Returns the mercator bounds of a tile (XYZ scheme, y from the top)
+    """
+    size = tile_size(zoom)
+    xmin = -MERCATOR_EXTENT + x * size
+    ymax = MERCATOR_EXTENT - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def tiles_for_bounds(bounds: TileBounds, zoom: int) -> Iterator[Tuple[int, int]]:
+    """
+    Yields the (x, y) tiles of a zoom level intersecting mercator bounds
+    """
+    size = tile_size(zoom)
+    last = 2 ** zoom - 1
+    xmin, ymin, xmax, ymax = bounds
+    x0 = min(max(int((xmin + MERCATOR_EXTENT) // size), 0), last)
+    x1 = min(max(int((xmax + MERCATOR_EXTENT) // size), 0), last)
+    y0 = min(max(int((MERCATOR_EXTENT - ymax) // size), 0), last)
+    y1 = min(max(int((MERCATOR_EXTENT - ymin) // size), 0), last)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+def python_value(value):
+    # vector tile properties must be python scalars
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def to_tile_units(geometries: np.ndarray, bounds: TileBounds, extent: int) -> np.ndarray:
+    """
+    Maps mercator geometries to the integer coordinates of a tile (0 to extent, y up)
+    """
+    xmin, ymin, xmax, _ = bounds
+    scale = extent / (xmax - xmin)
+    tile_units = shapely.transform(geometries, lambda coordinates: (coordinates - (xmin, ymin)) * scale)
+    # snapping to the integer grid also drops the vertices falling on the same tile unit
+    return shapely.set_precision(tile_units, 1)
+
+
+def encode_tiles(geometries: np.ndarray, properties: List[dict], zoom: int, layer: str,
+                 extent: int, buffer: int) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    Encodes the tiles of a zoom level, clipping the geometries per tile
+    @param geometries: mercator geometries, generalized to the zoom level
+    @param properties: properties of each geometry
+    @param zoom: zoom level
+    @param layer: vector tile layer name
+    @param extent: tile extent in tile units
+    @param buffer: clipping buffer in tile units
+    @return: (x, y, gzipped tile) of the non empty tiles
+    """
+    import mapbox_vector_tile
+
+    size = tile_size(zoom)
+    tree = shapely.STRtree(geometries)
+    margin = size * buffer / extent
+
+    for x, y in tiles_for_bounds(shapely.total_bounds(geometries), zoom):
+        bounds = tile_bounds(zoom, x, y)
+        clip_box = (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin)
+        candidates = tree.query(shapely.box(*clip_box))
+        if len(candidates) == 0:
+            continue
+
+        clipped = shapely.clip_by_rect(geometries[candidates], *clip_box)
+        not_empty = ~shapely.is_empty(clipped)
+        if not not_empty.any():
+            continue
+
+        # quantized here in bulk, the encoder would transform the coordinates one by one
+        quantized = to_tile_units(clipped[not_empty], bounds, extent)
+        features = [
+            {'geometry': geometry, 'properties': properties[index]}
+            for index, geometry in zip(candidates[not_empty], quantized)
+        ]
+        tile = mapbox_vector_tile.encode(
+            [{'name': layer, 'features': features}],
+            default_options={'extents': extent}
+        )
+        yield x, y, gzip.compress(tile)
+
+
+def generalize(geometries: np.ndarray, min_zoom: int, max_zoom: int, extent: int) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Yields the geometries simplified to the resolution of each zoom level (a tile unit), from
+    the highest zoom down: each level simplifies the previous one, which is already much lighter
+    """
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        geometries = shapely.simplify(geometries, tile_size(zoom) / extent)
+        yield zoom, geometries
+
+
+def write_mbtiles(mbtiles_file: str, tiles: Iterator[Tuple[int, int, int, bytes]], metadata: dict) -> int:
+    """
+    Writes vector tiles to an MBTiles archive (tile rows in the TMS scheme)
+    @param tiles: (zoom, x, y, tile data) with y from the top
+    @return: number of tiles written
+    """
+    tmp_file = mbtiles_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    count = 0
+    with sqlite3.connect(tmp_file) as db:
+        db.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+        db.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        db.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        for zoom, x, y, data in tiles:
+            db.execute('INSERT INTO tiles VALUES (?, ?, ?, ?)', (zoom, x, 2 ** zoom - 1 - y, data))
+            count += 1
+        db.executemany('INSERT INTO metadata VALUES (?, ?)', [(k, str(v)) for k, v in metadata.items()])
+    db.close()
+
+    os.replace(tmp_file, mbtiles_file)
+    return count
+
+
+def write_vector_tiles(mbtiles_file: str, geometries, properties: List[dict], name: str,
+                       min_zoom: int, max_zoom: int, layer: str = 'isochrones',
+                       extent: int = 4096, buffer: int = 64) -> str:
+    """
+    Packages lon/lat geometries as Mapbox Vector Tiles in an MBTiles archive, generalized per zoom level
+    (requires mapbox_vector_tile)
+    @param mbtiles_file: path of the archive
+    @param geometries: lon/lat (EPSG:4326) geometries
+    @param properties: properties of each geometry
+    @param name: tileset name
+    @param min_zoom: first zoom level
+    @param max_zoom: last zoom level
+    @return: path of the archive
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    lonmin, latmin, lonmax, latmax = shapely.total_bounds(geometries)
+    mercator = shapely.transform(geometries, to_mercator)
+    properties = [{key: python_value(value) for key, value in p.items()} for p in properties]
+
+    def tiles():
+        for zoom, generalized in generalize(mercator, min_zoom, max_zoom, extent):
+            for x, y, data in encode_tiles(generalized, properties, zoom, layer, extent, buffer):
+                yield zoom, x, y, data
+
+    fields = {key: 'Number' if isinstance(value, (int, float)) else 'String'
+              for p in properties for key, value in p.items()}
+    count = write_mbtiles(mbtiles_file, tiles(), {
+        'name': name,
+        'format': 'pbf',
+        'type': 'overlay',
+        'minzoom': min_zoom,
+        'maxzoom': max_zoom,
+        'bounds': f'{lonmin},{latmin},{lonmax},{latmax}',
+        'center': f'{(lonmin + lonmax) / 2},{(latmin + latmax) / 2},{min_zoom}',
+        'json': json.dumps({'vector_layers': [
+            {'id': layer, 'fields': fields, 'minzoom': min_zoom, 'maxzoom': max_zoom}
+        ]}),
+    })
+    logger.info(f'{count} vector tiles written to {mbtiles_file}')
+    return mbtiles_file
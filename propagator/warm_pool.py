@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+from typing import List
+
+from config import PropagatorConfig, WarmStartConfig
+from propagator.warm_worker import EXIT_MARKER, PID_MARKER
+
+logger = logging.getLogger(__name__)
+
+WARM_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warm_worker.py')
+
+
+class WarmWorkerUnavailable(Exception):
+    pass
+
+
+class WarmStdout:
+    """
+    File-like stdout of a warm process: strips the EXIT frame and records the exit code
+    """
+    def __init__(self, process: 'WarmProcess', reader):
+        self.process = process
+        self.reader = reader
+
+    def readline(self) -> str:
+        line = self.reader.readline()
+        # the exit frame follows the output, possibly on its last (unterminated) line
+        index = line.find(EXIT_MARKER)
+        if index >= 0:
+            self.process.returncode = int(line[index:].split()[1])
+            return line[:index]
+        if line == '':
+            # connection closed without an exit frame: the worker died
+            self.process.returncode = 1
+        return line
+
+    def read(self) -> str:
+        lines = []
+        while self.process.returncode is None:
+            lines.append(self.readline())
+        return ''.join(lines)
+
+    def close(self):
+        self.reader.close()
+
+
+class WarmStderr:
+    """
+    File-like stderr of a warm process, written by the simulation to a temporary file
+    """
+    def __init__(self, stderr_file: str):
+        self.stderr_file = stderr_file
+
+    def read(self) -> str:
+        try:
+            with open(self.stderr_file) as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return ''
+
+
+class WarmProcess:
+    """
+    Popen-like handle of a simulation forked by the warm worker
+    """
+    def __init__(self, conn: socket.socket, stderr_file: str):
+        self.conn = conn
+        self.returncode = None
+        self._stderr_file = stderr_file
+
+        reader = conn.makefile('r', encoding='utf-8', errors='replace')
+        first_line = reader.readline()
+        if not first_line.startswith(PID_MARKER):
+            reader.close()
+            conn.close()
+            raise WarmWorkerUnavailable(f'unexpected answer from warm worker: {first_line!r}')
+
+        self.pid = int(first_line.split()[1])
+        self.stdout = WarmStdout(self, reader)
+        self.stderr = WarmStderr(stderr_file)
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self.stdout.read()
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.stdout.close()
+        self.conn.close()
+        if os.path.exists(self._stderr_file):
+            os.remove(self._stderr_file)
+
+
+class WarmWorkerPool:
+    """
+    Keeps a pre-initialised PROPAGATOR worker (see propagator/warm_worker.py) which forks
+    a simulation process for each run, avoiding interpreter startup, imports and static
+    data loading. spawn raises WarmWorkerUnavailable when the worker is not ready, so
+    callers can fall back to a cold subprocess launch.
+    """
+    def __init__(self, python_path: str, propagator_dir: str, socket_path: str):
+        self.python_path = python_path
+        self.propagator_dir = propagator_dir
+        self.propagator_main = os.path.join(propagator_dir, 'main.py')
+        self.socket_path = socket_path
+        self.worker = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the warm worker in the background (if not running already)
+        """
+        with self._lock:
+            if self.worker is not None and self.worker.poll() is None:
+                return
+
+            cmd = [
+                self.python_path, '-u', WARM_WORKER_SCRIPT,
+                '--socket', self.socket_path,
+                '--main', self.propagator_main,
+                '--preload', WarmStartConfig.PRELOAD,
+            ]
+            if WarmStartConfig.INIT:
+                cmd += ['--init', WarmStartConfig.INIT]
+
+            logger.info(f'Starting warm worker: {" ".join(cmd)}')
+            self.worker = subprocess.Popen(cmd, cwd=self.propagator_dir)
+
+    def stop(self):
+        with self._lock:
+            if self.worker is not None and self.worker.poll() is None:
+                self.worker.terminate()
+                self.worker.wait()
+            self.worker = None
+
+    def spawn(self, program_cmd: List[str], cwd: str, limits: dict = None) -> WarmProcess:
+        """
+        Runs a PROPAGATOR command line on the warm worker
+        @param program_cmd: the cold command line (interpreter, flags, main.py, arguments)
+        @param cwd: working directory of the simulation
+        @param limits: optional resource limits of the simulation (see RunLimits.as_dict)
+        @return: a Popen-like process
+        @raise WarmWorkerUnavailable: if the worker can't take the run
+        """
+        if self.worker is None or self.worker.poll() is not None:
+            # (re)start for the next runs, this one goes cold
+            self.start()
+            raise WarmWorkerUnavailable('warm worker not running')
+
+        try:
+            argv = program_cmd[program_cmd.index(self.propagator_main) + 1:]
+        except ValueError:
+            raise WarmWorkerUnavailable('command does not run PROPAGATOR main.py')
+
+        fd, stderr_file = tempfile.mkstemp(prefix='propagator_stderr_', suffix='.log')
+        os.close(fd)
+
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+            request = {'argv': argv, 'cwd': cwd, 'stderr': stderr_file, 'limits': limits}
+            conn.sendall((json.dumps(request) + '\n').encode())
+            return WarmProcess(conn, stderr_file)
+        except (OSError, WarmWorkerUnavailable) as exp:
+            conn.close()
+            os.remove(stderr_file)
+            raise WarmWorkerUnavailable(str(exp))
+
+
+_pool = None
+
+
+def get_warm_pool() -> WarmWorkerPool:
+    """
+    Returns the warm worker pool of the service, None if warm start is disabled
+    """
+    global _pool
+    if not WarmStartConfig.ENABLED:
+        return None
+    if _pool is None:
+        _pool = WarmWorkerPool(PropagatorConfig.PYTHON_PATH, PropagatorConfig.PROPAGATOR_DIR, WarmStartConfig.SOCKET)
+        _pool.start()
+    return _pool
@@ -0,0 +1,144 @@
+"""
+Warm-start PROPAGATOR worker.
+
+Runs with the PROPAGATOR interpreter (PYTHON_PATH) and must not import anything from
+this repository. The worker imports the scientific stack and optionally runs an init hook
+(e.g. loading static data) once, then listens on a unix socket. Each connection sends a
+json line {"argv": [...], "cwd": "...", "stderr": "...", "limits": {...}}; the worker forks
+a child that applies the resource limits and runs PROPAGATOR's main.py with that argv,
+already initialised. The child's stdout is
+streamed back on the connection, framed by a PID line and an EXIT line.
+"""
+import argparse
+import importlib
+import json
+import os
+import resource
+import runpy
+import signal
+import socket
+import sys
+import traceback
+
+PID_MARKER = '__PROPAGATOR_PID__'
+EXIT_MARKER = '__PROPAGATOR_EXIT__'
+
+
+def apply_limits(limits: dict):
+    """
+    Applies the resource limits of a run to the current process
+    (mirrors propagator.resources.apply_limits, which can't be imported here)
+    """
+    if not limits:
+        return
+    if limits.get('memory'):
+        resource.setrlimit(resource.RLIMIT_AS, (limits['memory'], limits['memory']))
+    if limits.get('cpu_time'):
+        resource.setrlimit(resource.RLIMIT_CPU, (limits['cpu_time'], limits['cpu_time'] + 5))
+    if limits.get('cpus') and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, limits['cpus'])
+
+
+def run_simulation(main_file: str, request: dict) -> int:
+    """
+    Runs PROPAGATOR's main in the current (forked) process
+    @return: the exit code
+    """
+    os.chdir(request['cwd'])
+    sys.argv = [main_file] + request['argv']
+    try:
+        runpy.run_path(main_file, run_name='__main__')
+    except SystemExit as exp:
+        if exp.code is None:
+            return 0
+        if isinstance(exp.code, int):
+            return exp.code
+        print(exp.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def handle_connection(conn: socket.socket, main_file: str):
+    """
+    Runs in a child of the worker: forks the simulation process, streams its pid
+    and exit code around its output
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    with conn.makefile('r') as reader:
+        request = json.loads(reader.readline())
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        # simulation process
+        os.setsid()
+        os.dup2(conn.fileno(), 1)
+        stderr_fd = os.open(request['stderr'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(stderr_fd, 2)
+        code = 1
+        try:
+            apply_limits(request.get('limits'))
+            code = run_simulation(main_file, request)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    conn.sendall(f'{PID_MARKER} {pid}\n'.encode())
+    _, status = os.waitpid(pid, 0)
+    if os.WIFEXITED(status):
+        code = os.WEXITSTATUS(status)
+    else:
+        code = -os.WTERMSIG(status)
+    conn.sendall(f'{EXIT_MARKER} {code}\n'.encode())
+    conn.close()
+
+
+def serve(socket_path: str, main_file: str):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    # forked connection handlers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    print(f'Warm worker ready on {socket_path}', flush=True)
+
+    while True:
+        conn, _ = server.accept()
+        sys.stdout.flush()
+        if os.fork() == 0:
+            server.close()
+            try:
+                handle_connection(conn, main_file)
+            finally:
+                os._exit(0)
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm-start PROPAGATOR worker')
+    parser.add_argument('--socket', required=True, help='unix socket path')
+    parser.add_argument('--main', required=True, help="path to PROPAGATOR's main.py")
+    parser.add_argument('--preload', default='', help='comma separated modules to import at startup')
+    parser.add_argument('--init', default='', help='module:function called once at startup')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.main)))
+    for module in filter(None, args.preload.split(',')):
+        importlib.import_module(module.strip())
+
+    if args.init:
+        module, function = args.init.split(':')
+        getattr(importlib.import_module(module), function)()
+
+    serve(args.socket, args.main)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,15 @@
-import json
+import contextvars
 import logging
-import os
 import subprocess
 from dataclasses import dataclass, field
-from datetime import datetime
-from time import sleep
 import enum
 
 
-from framework.pika_client import PikaClient
+from framework.tracing import span
 import threading
-from config import PropagatorConfig
-from models.datalake import DatalakeMetadata
-from framework.data_uploader import upload
-import geopandas as gpd
-import shapely
-from os.path import getmtime
+from propagator.warm_pool import WarmWorkerUnavailable
+
+logger = logging.getLogger(__name__)
 
 class ErrorCodes(enum.Enum):
     OK = 0
@@ -24,31 +18,73 @@ class ErrorCodes(enum.Enum):
     IGNITIONS_ERROR = 3
     BC_ERROR = 4
 
+
+def exit_error_code(returncode: int) -> ErrorCodes:
+    """
+    Returns the error code of a simulation exit status, GENERIC_ERROR for the statuses
+    PROPAGATOR doesn't define (e.g. a process killed by a signal or a resource limit)
+    """
+    try:
+        return ErrorCodes(returncode)
+    except ValueError:
+        return ErrorCodes.GENERIC_ERROR
+
 @dataclass
 class Wrapper:
     process: any = field(init=False)
     program_cmd: list[str]
     cwd: str
-    logger = logging
+    logger = logging.getLogger(__name__)
     end_callback: callable
     progress_callback: callable
     error_callback: callable
-    
+    # optional WarmWorkerPool, runs fall back to a cold launch when it is unavailable
+    pool: any = None
+    # optional RunLimits applied to the simulation process
+    limits: any = None
+    # optional ActiveRun of the supervisor, which can stop the simulation
+    control: any = None
+
+    def launch(self):
+        """
+        Starts the simulation on the warm worker pool if available, as a new subprocess otherwise
+        """
+        if self.pool is not None:
+            try:
+                process = self.pool.spawn(
+                    self.program_cmd, self.cwd, limits=self.limits.as_dict() if self.limits else None)
+                self.logger.info(f'Simulation started on warm worker (pid {process.pid})')
+                return process
+            except WarmWorkerUnavailable as exp:
+                self.logger.warning(f'Warm worker unavailable, cold start: {exp}')
+
+        process = subprocess.Popen(
+            self.program_cmd,
+            cwd=self.cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+            universal_newlines=True
+        )
+        if self.limits is not None:
+            try:
+                self.limits.apply(process.pid)
+            except Exception:
+                # not left running without its limits and unsupervised
+                process.kill()
+                process.wait()
+                raise
+        return process
 
     def __start(self):
         self.logger.info(f'Executing command: {" ".join(self.program_cmd)}')
 
         try:
-            with subprocess.Popen(
-                    self.program_cmd,
-                    cwd=self.cwd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    bufsize=0,
-                    universal_newlines=True
-            ) as p:
+            with span('simulation') as simulation_span, self.launch() as p:
 
                 self.process = p
+                if self.control is not None:
+                    self.control.attach(p.send_signal)
                 accum_stdout = []
                 accum_stderr = []
 
@@ -56,17 +92,20 @@ class Wrapper:
                 while p.poll() is None:
                     line = p.stdout.readline()
                     if line:
-                        self.logger.info(line)
+                        self.logger.debug(line)
                         accum_stdout.append(line)
                         self.progress_callback(line)
 
-                if p.returncode > 0:
+                if simulation_span is not None:
+                    simulation_span.set_attribute('returncode', p.returncode)
+
+                if p.returncode != 0:
                     stderr = p.stderr.read()
                     self.logger.warning(
                         'Error in simulation:\n{}'.format(stderr))
                     accum_stderr.append(stderr)
-                    error_code = ErrorCodes(p.returncode).name
-                    self.error_callback(f'Error running simulation: {error_code}')
+                    error_code = exit_error_code(p.returncode)
+                    self.error_callback(f'Error running simulation: {error_code.name}', error_code, p.returncode, stderr)
 
         except Exception:
             raise
@@ -75,11 +114,12 @@ class Wrapper:
             self.end_callback()
 
     def start(self):
-        t = threading.Thread(target=self.__start)
+        # the reading thread logs with the run context of the caller
+        t = threading.Thread(target=contextvars.copy_context().run, args=(self.__start,))
         t.start()
-        logging.info("Main: before running thread")
+        logger.info("Main: before running thread")
         t.join()
-        logging.info("Main: Thread finished")
+        logger.info("Main: Thread finished")
 
 
 if __name__ == '__main__':
@@ -87,7 +127,7 @@ if __name__ == '__main__':
     wrapper = Wrapper(
         program_cmd=['python3', 'test.py'],
         cwd='/home/propagator/propagator',
-        logger=logging,
+        logger=logger,
         end_callback=lambda: print('callback'),
         error_callback=lambda: print('error_callback')
     )
\ No newline at end of file